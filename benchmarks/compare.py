@@ -0,0 +1,54 @@
+"""
+Compares the results of two runs of benchmarks/run.py
+
+    python benchmarks/compare.py before.json after.json
+"""
+from __future__ import print_function, division
+import json
+import sys
+
+
+def change(before, after):
+    if not before:
+        return u''
+    return u'{:+.1f}%'.format((after - before) / before * 100)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print(__doc__.strip())
+        return 2
+    with open(argv[0]) as before_file:
+        before = json.load(before_file)
+    with open(argv[1]) as after_file:
+        after = json.load(after_file)
+
+    print(u'{} -> {}'.format(before[u'revision'], after[u'revision']))
+    for name in (u'jobs_per_second', u'requests_per_second'):
+        old = before[u'throughput'][name]
+        new = after[u'throughput'][name]
+        print(u'{:<34} {:>10.2f} {:>10.2f} {:>8}'.format(
+            name, old, new, change(old, new)))
+
+    routes = dict(before[u'routes'])
+    routes[u'job turnaround'] = before[u'turnaround']
+    after_routes = dict(after[u'routes'])
+    after_routes[u'job turnaround'] = after[u'turnaround']
+    for route in sorted(set(routes) | set(after_routes)):
+        print(route)
+        for stat in (u'p50', u'p95', u'p99'):
+            old = routes.get(route, {}).get(stat, None)
+            new = after_routes.get(route, {}).get(stat, None)
+            if old is None or new is None:
+                print(u'  {:<32} {:>10} {:>10}'.format(
+                    stat, u'-' if old is None else u'{:.1f}'.format(old * 1000),
+                    u'-' if new is None else u'{:.1f}'.format(new * 1000)))
+                continue
+            print(u'  {:<32} {:>10.1f} {:>10.1f} {:>8}'.format(
+                stat + u' ms', old * 1000, new * 1000, change(old, new)))
+    return 0
+
+
+if __name__ == u'__main__':
+    sys.exit(main())
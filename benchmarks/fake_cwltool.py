@@ -0,0 +1,108 @@
+"""
+Stands in for cwltool in the benchmarks, see CWLTOOL_COMMAND.
+
+Takes the same arguments the service hands to cwltool, reads the job order
+from stdin, logs to stderr for a while and writes a single output file.
+With --cachedir, the output is kept in an entry of the cache named after
+the job order, reused by later runs with the same order, and copied to the
+working directory, as cwltool does with --copy-outputs.
+How it behaves is set through the environment:
+
+    FAKE_CWLTOOL_SECONDS       how long it runs, 0.5 by default
+    FAKE_CWLTOOL_OUTPUT_BYTES  size of the output file, 1024 by default
+    FAKE_CWLTOOL_LOG_LINES     lines logged over the run, 100 by default
+    FAKE_CWLTOOL_FAIL          exits with an error when set to 1
+"""
+from __future__ import print_function
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+CHUNK = b'0123456789abcdef' * 4096
+
+
+def write_output(outdir, size):
+    path = os.path.join(outdir, u'out.txt')
+    with open(path, 'wb') as output:
+        left = size
+        while left > 0:
+            data = CHUNK[:left]
+            output.write(data)
+            left -= len(data)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(u'--leave-outputs', action=u'store_true')
+    parser.add_argument(u'--tmp-outdir-prefix', default=None)
+    parser.add_argument(u'--tmpdir-prefix', default=None)
+    parser.add_argument(u'--copy-outputs', action=u'store_true')
+    parser.add_argument(u'--cachedir', default=None)
+    parser.add_argument(u'--parallel', action=u'store_true')
+    parser.add_argument(u'workflow')
+    parser.add_argument(u'job_order')
+    args, _ = parser.parse_known_args()
+
+    seconds = float(os.environ.get(u'FAKE_CWLTOOL_SECONDS', 0.5))
+    size = int(os.environ.get(u'FAKE_CWLTOOL_OUTPUT_BYTES', 1024))
+    lines = int(os.environ.get(u'FAKE_CWLTOOL_LOG_LINES', 100))
+
+    order = sys.stdin.read() if args.job_order == u'-' else u'{}'
+    print(u'fake cwltool 1.0', file=sys.stderr)
+    print(u'Resolved {!r} with {} bytes of job order'.format(
+        args.workflow, len(order)), file=sys.stderr)
+
+    started = time.time()
+    for line in range(lines):
+        print(u'[job fake] line {} of {}'.format(line + 1, lines),
+              file=sys.stderr)
+        sys.stderr.flush()
+        time.sleep(max(started + seconds * (line + 1) / lines - time.time(),
+                       0))
+    time.sleep(max(started + seconds - time.time(), 0))
+
+    if os.environ.get(u'FAKE_CWLTOOL_FAIL', u'') == u'1':
+        print(u'Final process status is permanentFail', file=sys.stderr)
+        return 1
+
+    if args.cachedir is None:
+        outdir = tempfile.mkdtemp(prefix=args.tmp_outdir_prefix or u'fake')
+        path = write_output(outdir, size)
+    else:
+        entry = os.path.join(args.cachedir, hashlib.md5(
+            order.encode(u'utf-8')).hexdigest())
+        if os.path.isdir(entry):
+            print(u'[job fake] Using cached output in ' + entry,
+                  file=sys.stderr)
+        else:
+            print(u'[job fake] Output of job will be cached in ' + entry,
+                  file=sys.stderr)
+            os.makedirs(entry)
+            write_output(entry, size)
+        path = os.path.join(os.getcwd(), u'out.txt')
+        shutil.copy(os.path.join(entry, u'out.txt'), path)
+    checksum = hashlib.sha1()
+    with open(path, 'rb') as output:
+        for data in iter(lambda: output.read(len(CHUNK)), b''):
+            checksum.update(data)
+
+    print(u'Final process status is success', file=sys.stderr)
+    json.dump({u'out': {
+        u'class': u'File',
+        u'location': u'file://' + path,
+        u'path': path,
+        u'basename': u'out.txt',
+        u'size': size,
+        u'checksum': u'sha1$' + checksum.hexdigest()
+    }}, sys.stdout)
+    return 0
+
+
+if __name__ == u'__main__':
+    sys.exit(main())
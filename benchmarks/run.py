@@ -0,0 +1,273 @@
+"""
+End to end load test of the service, with a fake cwltool.
+
+Starts the Flask application in this process, with a database, scratch
+directory and keys of its own, and runs cwltool's stand-in,
+fake_cwltool.py, for every job. A number of concurrent clients then go
+through cycles of submitting a job, polling its status until it finishes,
+following its log and downloading its output.
+
+The latency of each route, the job turnaround and the throughput are
+printed and saved as JSON, named after the revision being measured, so
+runs can be compared with compare.py. Nothing is fetched from the network.
+
+    python benchmarks/run.py --clients 20 --cycles 10 --runtime 1
+    python benchmarks/compare.py benchmarks/results/a.json \\
+        benchmarks/results/b.json
+"""
+from __future__ import print_function, division
+import argparse
+from datetime import datetime, timedelta
+import json
+import math
+import os
+import shutil
+from subprocess import check_output, CalledProcessError
+import sys
+import tempfile
+from threading import Lock, Thread
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+CONFIG = u'''
+X509_FILE = {x509!r}
+SQLALCHEMY_DATABASE_URI = {db_uri!r}
+MAX_RUNNING_JOBS = {max_running!r}
+RUNNER_MODE = 'subprocess'
+CWLTOOL_COMMAND = {command!r}
+SCRATCH_DIR = {scratch!r}
+RECONCILE_ON_START = False
+MEMOIZE = False
+MAX_STATUS_WAIT = 60
+'''
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split(u'\n')[1])
+    parser.add_argument(u'--clients', type=int, default=10,
+                        help=u'concurrent clients')
+    parser.add_argument(u'--cycles', type=int, default=5,
+                        help=u'jobs each client goes through')
+    parser.add_argument(u'--runtime', type=float, default=0.5,
+                        help=u'seconds each fake cwltool runs for')
+    parser.add_argument(u'--output-bytes', type=int, default=1024,
+                        help=u'size of the output of each job')
+    parser.add_argument(u'--log-lines', type=int, default=100,
+                        help=u'lines logged by each job')
+    parser.add_argument(u'--max-running', type=int, default=8,
+                        help=u'MAX_RUNNING_JOBS of the service')
+    parser.add_argument(u'--poll-interval', type=float, default=0.2,
+                        help=u'seconds between status polls')
+    parser.add_argument(u'--wait', action=u'store_true',
+                        help=u'poll with ?wait instead of at intervals')
+    parser.add_argument(u'--output', default=None,
+                        help=u'where the results are saved, '
+                             u'benchmarks/results/<revision>-<time>.json '
+                             u'by default')
+    return parser.parse_args(argv)
+
+
+def revision():
+    try:
+        return check_output([u'git', u'describe', u'--always', u'--dirty'],
+                            cwd=ROOT).decode(u'utf-8').strip()
+    except (CalledProcessError, OSError):
+        return u'unknown'
+
+
+def write_certificate(path):
+    # the service wants a certificate to check tokens with, the clients
+    # don't send any
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048,
+                                   backend=default_backend())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u'benchmark')])
+    now = datetime.utcnow()
+    certificate = x509.CertificateBuilder().subject_name(name).issuer_name(
+        name).public_key(key.public_key()).serial_number(1).not_valid_before(
+            now).not_valid_after(now + timedelta(days=1)).sign(
+                key, hashes.SHA256(), default_backend())
+    with open(path, 'wb') as pem:
+        pem.write(certificate.public_bytes(serialization.Encoding.PEM))
+
+
+def set_up(args):
+    """
+    Configures the service, it has to run before it's imported
+    """
+    workdir = tempfile.mkdtemp(prefix=u'wes-benchmark-')
+    x509 = os.path.join(workdir, u'cert.pem')
+    write_certificate(x509)
+    scratch = os.path.join(workdir, u'scratch')
+    os.makedirs(scratch)
+
+    config = os.path.join(workdir, u'application.cfg')
+    with open(config, 'w') as config_file:
+        config_file.write(CONFIG.format(
+            x509=x509,
+            db_uri=u'sqlite:///' + os.path.join(workdir, u'benchmark.db'),
+            max_running=args.max_running,
+            command=[sys.executable, os.path.join(HERE, u'fake_cwltool.py')],
+            scratch=scratch))
+
+    os.environ[u'WORKFLOW_SERVICE_CONFIG'] = config
+    os.environ[u'FAKE_CWLTOOL_SECONDS'] = str(args.runtime)
+    os.environ[u'FAKE_CWLTOOL_OUTPUT_BYTES'] = str(args.output_bytes)
+    os.environ[u'FAKE_CWLTOOL_LOG_LINES'] = str(args.log_lines)
+    sys.path.insert(0, ROOT)
+    return workdir
+
+
+class Recorder(object):
+    def __init__(self):
+        self._lock = Lock()
+        # route -> latencies in seconds
+        self.latencies = dict()
+        # route -> number of unexpected responses
+        self.errors = dict()
+        self.turnarounds = []
+
+    def request(self, route, call, expected):
+        started = time.time()
+        response = call()
+        data = response.get_data()
+        elapsed = time.time() - started
+        with self._lock:
+            self.latencies.setdefault(route, []).append(elapsed)
+            if response.status_code not in expected:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return response, data
+
+    def turnaround(self, seconds):
+        with self._lock:
+            self.turnarounds.append(seconds)
+
+
+def client_cycles(app, args, recorder):
+    client = app.test_client()
+    for cycle in range(args.cycles):
+        submitted = time.time()
+        response, _ = recorder.request(
+            u'POST /run',
+            lambda: client.post(u'/run?wf=benchmark.cwl',
+                                data=json.dumps({u'cycle': cycle})),
+            (303,))
+        if response.status_code != 303:
+            continue
+        job = u'/jobs/' + response.headers[u'Location'].rsplit(u'/', 1)[-1]
+
+        status = {u'state': u'Queued'}
+        while status.get(u'state') in (u'Queued', u'Running'):
+            if args.wait:
+                route = u'GET /jobs/<id>?wait'
+                url = job + u'?wait=30'
+            else:
+                route = u'GET /jobs/<id>'
+                url = job
+                time.sleep(args.poll_interval)
+            _, data = recorder.request(route, lambda url=url: client.get(url),
+                                       (200,))
+            status = json.loads(data.decode(u'utf-8'))
+        recorder.turnaround(time.time() - submitted)
+
+        recorder.request(u'GET /jobs/<id>/log',
+                         lambda: client.get(job + u'/log'), (200,))
+        recorder.request(u'GET /jobs/<id>/output/<output>',
+                         lambda: client.get(job + u'/output/out'), (200,))
+
+
+def percentile(values, fraction):
+    # nearest rank
+    ordered = sorted(values)
+    index = max(int(math.ceil(fraction * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summary(values):
+    if not values:
+        return {u'count': 0}
+    return {
+        u'count': len(values),
+        u'mean': sum(values) / len(values),
+        u'p50': percentile(values, 0.50),
+        u'p95': percentile(values, 0.95),
+        u'p99': percentile(values, 0.99),
+        u'max': max(values)
+    }
+
+
+def report(args, recorder, duration):
+    requests = sum(len(values) for values in recorder.latencies.values())
+    routes = dict()
+    for route, values in recorder.latencies.items():
+        routes[route] = summary(values)
+        routes[route][u'errors'] = recorder.errors.get(route, 0)
+    return {
+        u'revision': revision(),
+        u'time': datetime.utcnow().strftime(u'%Y-%m-%dT%H:%M:%SZ'),
+        u'parameters': vars(args),
+        u'duration': duration,
+        u'throughput': {
+            u'jobs_per_second': len(recorder.turnarounds) / duration,
+            u'requests_per_second': requests / duration
+        },
+        u'turnaround': summary(recorder.turnarounds),
+        u'routes': routes
+    }
+
+
+def print_report(results):
+    print(u'revision {revision}, {duration:.1f} s'.format(**results))
+    print(u'{jobs_per_second:.2f} jobs/s, {requests_per_second:.1f} '
+          u'requests/s'.format(**results[u'throughput']))
+    print(u'{:<34} {:>7} {:>6} {:>9} {:>9} {:>9}'.format(
+        u'', u'count', u'errors', u'p50 ms', u'p95 ms', u'p99 ms'))
+    rows = sorted(results[u'routes'].items())
+    rows.append((u'job turnaround', dict(results[u'turnaround'], errors=0)))
+    for route, stats in rows:
+        if not stats[u'count']:
+            continue
+        print(u'{:<34} {:>7} {:>6} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            route, stats[u'count'], stats[u'errors'], stats[u'p50'] * 1000,
+            stats[u'p95'] * 1000, stats[u'p99'] * 1000))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = set_up(args)
+    try:
+        from workflow_service.server import APP
+
+        recorder = Recorder()
+        clients = [Thread(target=client_cycles, args=(APP, args, recorder))
+                   for _ in range(args.clients)]
+        started = time.time()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        results = report(args, recorder, time.time() - started)
+    finally:
+        # the database, the certificate and the jobs' directories
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(results)
+    output = args.output or os.path.join(
+        HERE, u'results', u'{}-{}.json'.format(
+            results[u'revision'], results[u'time'].replace(u':', u'')))
+    if not os.path.isdir(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+    print(u'saved to ' + output)
+
+
+if __name__ == u'__main__':
+    main()
@@ -24,6 +24,10 @@ TEST_DEPS = [
     'pytest'
 ]
 DEV_DEPS = []
+# used for serializing statuses when installed, see serialization.py
+FAST_JSON_DEPS = [
+    'orjson; python_version >= "3.6"'
+]
 
 setup(
     name='workflow_service',
@@ -66,7 +70,8 @@ setup(
 
     extras_require={
         'test': TEST_DEPS,
-        'dev': DEV_DEPS
+        'dev': DEV_DEPS,
+        'fast-json': FAST_JSON_DEPS
     },
 
     entry_points={
@@ -168,7 +168,8 @@ def wait_for_completion(client, job_id, timeout):
                                     u'/jobs/' + job_id
                                    )
         assert status_code == 200
-        if u'state' in data and data[u'state'] != State.Running.value:
+        if u'state' in data and data[u'state'] not in (State.Queued.value,
+                                                       State.Running.value):
             running = False
         if running:
             time.sleep(1)
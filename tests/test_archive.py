@@ -0,0 +1,111 @@
+"""
+Tests for the downloads of job outputs, archived, ranged and indexed
+"""
+import io
+import tarfile
+import zipfile
+from uuid import UUID
+
+import pytest
+
+from workflow_service.archive import (
+    ZIP_STREAMING, archive_entries, tar_stream, zip_stream
+)
+from workflow_service.database import DB_SESSION
+from workflow_service.models import Job, State
+
+from tests import app_client
+
+
+def file_output(path):
+    return {u'class': u'File', u'location': u'http://localhost/x',
+            u'path': str(path), u'basename': path.basename}
+
+
+@pytest.fixture
+def outputs(tmpdir):
+    single = tmpdir.join(u'single.txt')
+    single.write(u'0123456789')
+    big = tmpdir.join(u'big.bin')
+    big.write_binary(b'x' * (200 * 1024 + 3))
+    listing = tmpdir.mkdir(u'dir')
+    listing.join(u'inner.txt').write(u'inner')
+    directory = {u'class': u'Directory', u'location': u'http://localhost/y',
+                 u'path': str(listing), u'basename': u'dir'}
+
+    return {
+        u'single': file_output(single),
+        u'all': [file_output(big), directory]
+    }
+
+
+def test_entries(outputs):
+    assert sorted(name for name, _ in archive_entries(outputs)) == [
+        u'all/0/big.bin', u'all/1/dir', u'single/single.txt']
+
+
+def test_tar_stream(outputs):
+    data = b''.join(tar_stream(archive_entries(outputs)))
+    assert len(data) % tarfile.RECORDSIZE == 0
+
+    archive = tarfile.open(fileobj=io.BytesIO(data))
+    assert sorted(archive.getnames()) == [
+        u'all/0/big.bin', u'all/1/dir', u'all/1/dir/inner.txt',
+        u'single/single.txt']
+    assert archive.extractfile(u'all/0/big.bin').read() == b'x' * (200 * 1024 + 3)
+    assert archive.extractfile(u'all/1/dir/inner.txt').read() == b'inner'
+
+
+@pytest.mark.skipif(not ZIP_STREAMING, reason=u'needs python 3.6')
+def test_zip_stream(outputs):
+    data = b''.join(zip_stream(archive_entries(outputs)))
+
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert archive.testzip() is None
+    assert archive.read(u'single/single.txt') == b'0123456789'
+    assert archive.read(u'all/1/dir/inner.txt') == b'inner'
+
+
+@pytest.fixture
+def complete_job(app_client, outputs):
+    _, client = app_client
+
+    session = DB_SESSION()
+    job = Job(u'wf.cwl', u'{}', u'http://localhost/')
+    job.state = State.Complete
+    job.output = outputs
+    session.add(job)
+    session.commit()
+    jobid = str(job.id)
+    DB_SESSION.remove()
+
+    return client, u'/jobs/' + jobid
+
+
+def test_archive_download(complete_job):
+    client, url = complete_job
+    response = client.get(url + u'/outputs.tar')
+    assert response.status_code == 200
+    assert response.mimetype == u'application/x-tar'
+    archive = tarfile.open(fileobj=io.BytesIO(response.data))
+    assert archive.extractfile(u'single/single.txt').read() == b'0123456789'
+
+
+def test_indexed_output(complete_job):
+    client, url = complete_job
+    session = DB_SESSION()
+    job = session.query(Job).get(UUID(url.split(u'/')[-1]))
+    job.output_index = {u'renamed': job.output[u'single']}
+    session.commit()
+    DB_SESSION.remove()
+
+    assert client.get(url + u'/output/renamed').data == b'0123456789'
+    assert client.get(url + u'/output/single').status_code == 404
+
+
+def test_ranged_output(complete_job):
+    client, url = complete_job
+    response = client.get(url + u'/output/single',
+                          headers={u'Range': u'bytes=2-5'})
+    assert response.status_code == 206
+    assert response.data == b'2345'
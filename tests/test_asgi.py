@@ -0,0 +1,197 @@
+"""
+Tests for the ASGI front end
+"""
+import gzip
+from io import BytesIO
+import json
+import os
+import sys
+import tempfile
+from threading import Timer
+from time import time
+from uuid import uuid4
+
+import pytest
+
+from workflow_service.database import DB_SESSION
+from workflow_service.events import JOB_EVENTS
+from workflow_service.log_store import compress_log
+from workflow_service.log_streamer import LOG_WATCHER
+from workflow_service.models import Job, State, transition_job
+
+from tests import app_client  # pylint: disable=unused-import
+
+if sys.version_info < (3, 5):
+    pytest.skip(u'the ASGI front end needs Python 3.5', allow_module_level=True)
+
+import asyncio  # noqa: E402 pylint: disable=wrong-import-position,wrong-import-order
+from workflow_service.asgi import APPLICATION  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def call(path, query=b'', headers=(), method=u'GET', body=(b'',)):
+    """
+    Serves a request, with the body sent in the given chunks, returns the
+    status and the body of the response
+    """
+    loop = asyncio.get_event_loop()
+    messages = []
+    requests = [{u'type': u'http.request', u'body': chunk,
+                 u'more_body': index < len(body) - 1}
+                for index, chunk in enumerate(body)]
+
+    def receive():
+        # the client stays connected after sending the request
+        future = loop.create_future()
+        if requests:
+            future.set_result(requests.pop(0))
+        return future
+
+    def send(message):
+        messages.append(message)
+        future = loop.create_future()
+        future.set_result(None)
+        return future
+
+    scope = {
+        u'type': u'http', u'method': method, u'path': path,
+        u'query_string': query, u'headers': list(headers), u'root_path': u'',
+        u'scheme': u'http', u'server': (u'localhost', 80)
+    }
+    loop.run_until_complete(
+        asyncio.wait_for(APPLICATION(scope, receive, send), 10))
+    assert messages[0][u'type'] == u'http.response.start'
+    return (messages[0][u'status'],
+            b''.join(message.get(u'body', b'') for message in messages[1:]))
+
+
+def add_job(state, log=b''):
+    handle, logname = tempfile.mkstemp()
+    os.write(handle, log)
+    os.close(handle)
+
+    session = DB_SESSION()
+    job = Job(u'wf.cwl', u'{}', u'http://localhost/')
+    jobid = job.id = uuid4()
+    job.state = state
+    job.logfile = logname
+    job.outdir = tempfile.gettempdir()
+    session.add(job)
+    session.commit()
+    DB_SESSION.remove()
+    return jobid, logname
+
+
+def test_flask_routes(app_client):  # pylint: disable=redefined-outer-name,unused-argument
+    status, body = call(u'/jobs/{}'.format(uuid4()))
+    assert status == 404
+    assert json.loads(body.decode(u'utf-8'))[u'error'] == 404
+
+    jobid, _ = add_job(State.Complete)
+    status, body = call(u'/jobs/{}'.format(jobid))
+    assert status == 200
+    assert json.loads(body.decode(u'utf-8'))[u'state'] == u'Complete'
+
+
+def test_finished_log(app_client):  # pylint: disable=redefined-outer-name,unused-argument
+    jobid, _ = add_job(State.Complete, b'first\nsecond\n')
+    status, body = call(u'/jobs/{}/log'.format(jobid))
+    assert status == 200
+    assert body.decode(u'utf-8') == (
+        u'id: 13\ndata: first\ndata: second\n\n'
+        u'id: 13\nevent: end\ndata: \n\n')
+
+    status, body = call(u'/jobs/{}/log'.format(jobid), b'offset=6')
+    assert body.decode(u'utf-8').startswith(u'id: 13\ndata: second\n\n')
+
+    status, _ = call(u'/jobs/{}/log'.format(jobid), b'offset=-1')
+    assert status == 400
+
+
+def test_compressed_log(app_client):  # pylint: disable=redefined-outer-name,unused-argument
+    jobid, logname = add_job(State.Complete, b'first\nsecond\n')
+    compress_log(logname)
+    status, body = call(u'/jobs/{}/log'.format(jobid), b'tail=1')
+    assert status == 200
+    assert body.decode(u'utf-8').startswith(u'id: 13\ndata: second\n\n')
+
+    status, body = call(u'/jobs/{}/log'.format(jobid), b'tail=1',
+                        [(b'accept-encoding', b'gzip')])
+    assert status == 200
+    assert gzip.GzipFile(fileobj=BytesIO(body)).read().decode(
+        u'utf-8').startswith(u'id: 13\ndata: second\n\n')
+
+    status, _ = call(u'/jobs/{}/log'.format(jobid), b'tail=some')
+    assert status == 400
+
+
+def test_follow_log(app_client):  # pylint: disable=redefined-outer-name,unused-argument
+    jobid, logname = add_job(State.Running, b'started\n')
+
+    def finish():
+        with open(logname, 'ab') as log:
+            log.write(b'finished\n')
+        transition_job(jobid, (State.Running,), State.Complete)
+        DB_SESSION.remove()
+        LOG_WATCHER.wake(logname)
+
+    Timer(0.3, finish).start()
+    status, body = call(u'/jobs/{}/log'.format(jobid))
+    assert status == 200
+    assert u'data: started\n' in body.decode(u'utf-8')
+    assert u'data: finished\n' in body.decode(u'utf-8')
+    assert body.decode(u'utf-8').endswith(u'event: end\ndata: \n\n')
+
+
+def test_wait_for_job(app_client):  # pylint: disable=redefined-outer-name,unused-argument
+    jobid, _ = add_job(State.Queued)
+
+    def start():
+        transition_job(jobid, (State.Queued,), State.Running)
+        DB_SESSION.remove()
+        JOB_EVENTS.notify(jobid)
+
+    Timer(0.3, start).start()
+    started = time()
+    status, body = call(u'/jobs/{}'.format(jobid), b'wait=5')
+    assert status == 200
+    assert json.loads(body.decode(u'utf-8'))[u'state'] == u'Running'
+    assert time() - started < 5
+
+    status, _ = call(u'/jobs/{}'.format(jobid), b'wait=soon')
+    assert status == 400
+
+
+def test_wait_must_be_finite(app_client):  # pylint: disable=redefined-outer-name,unused-argument
+    jobid, _ = add_job(State.Running)
+    for wait in (b'nan', b'inf', b'-1'):
+        started = time()
+        status, _ = call(u'/jobs/{}'.format(jobid), b'wait=' + wait)
+        assert status == 400
+        assert time() - started < 5
+
+
+def test_streamed_upload(app_client):  # pylint: disable=redefined-outer-name,unused-argument
+    boundary = b'upload-boundary'
+    message = str(uuid4())
+    body = (b'--' + boundary + b'\r\n'
+            b'Content-Disposition: form-data; name="job_order"\r\n\r\n' +
+            json.dumps({u'message': message}).encode(u'utf-8') + b'\r\n'
+            b'--' + boundary + b'\r\n'
+            b'Content-Disposition: form-data; name="reference"; '
+            b'filename="ref.fa"\r\n'
+            b'Content-Type: application/octet-stream\r\n\r\n' +
+            b'GATTACA\n' * 4096 + b'\r\n'
+            b'--' + boundary + b'--\r\n')
+    # sent in chunks, without a length
+    chunks = [body[start:start + 1000] for start in range(0, len(body), 1000)]
+    status, _ = call(u'/run', b'wf=wf.cwl', [
+        (b'content-type', b'multipart/form-data; boundary=' + boundary)],
+                     method=u'POST', body=chunks)
+    assert status == 303
+
+    job = Job.query.filter(Job.input_json.like(u'%' + message + u'%')).one()
+    order = json.loads(job.input_json)
+    DB_SESSION.remove()
+    with open(order[u'reference'][u'location'][len(u'file://'):],
+              'rb') as staged:
+        assert staged.read() == b'GATTACA\n' * 4096
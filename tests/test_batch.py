@@ -0,0 +1,67 @@
+"""
+Tests for submitting batches of job orders
+"""
+import json
+
+import pytest
+
+from workflow_service import server
+from workflow_service.database import DB_SESSION
+from workflow_service.models import Job, State
+
+from tests import app_client
+
+
+def test_job_orders():
+    assert server.job_orders(u' [{"a": 1}, {"a": 2}]') == [
+        u'{"a": 1}', u'{"a": 2}']
+    assert server.job_orders(u'{"a": 1}\n\n{"a": 2}\n') == [
+        u'{"a": 1}', u'{"a": 2}']
+
+    for body in (u'[1, 2]', u'{"a": 1}\nnot json', u'{"a": 1'):
+        with pytest.raises(ValueError):
+            server.job_orders(body)
+
+
+class StubExecutor(object):
+    # keeps the runners instead of running them
+    def __init__(self):
+        self.runners = []
+
+    def submit_all(self, runners, owner=None):  # pylint: disable=W0613
+        self.runners.extend(runners)
+
+    def queued(self):
+        return list(self.runners)
+
+
+def test_batch(app_client, monkeypatch):
+    _, client = app_client
+    executor = StubExecutor()
+    monkeypatch.setattr(server.JOB_RUNNERS, u'executor', executor)
+
+    response = client.post(u'/runs?wf=wf.cwl',
+                           data=u'{"message": "a"}\n{"message": "b"}\n')
+    assert response.status_code == 200
+    urls = json.loads(response.data)
+    assert len(urls) == 2
+
+    assert [str(runner.uuid) for runner in executor.runners] == [
+        url.split(u'/')[-1] for url in urls]
+    for url, message in zip(urls, (u'a', u'b')):
+        status = json.loads(client.get(url).data)
+        assert status[u'state'] == State.Queued.value
+        assert json.loads(status[u'input']) == {u'message': message}
+
+    # the jobs are never run, cancel them so they don't stay queued
+    session = DB_SESSION()
+    for runner in executor.runners:
+        session.query(Job).get(runner.uuid).state = State.Cancelled
+        server.registry.unregister(runner)
+    session.commit()
+
+
+@pytest.mark.parametrize('body', [u'', u'[]', u'[1]', u'{"message": '])
+def test_bad_batches(app_client, body):
+    _, client = app_client
+    assert client.post(u'/runs?wf=wf.cwl', data=body).status_code == 400
@@ -0,0 +1,66 @@
+"""
+Tests for looking up the status of many jobs at once
+"""
+import json
+from uuid import uuid4
+
+import pytest
+
+from workflow_service import server
+from workflow_service.database import DB_SESSION
+from workflow_service.models import Job, State
+
+from tests import app_client, user_token
+
+
+@pytest.fixture
+def owned_jobs(app_client):
+    app, client = app_client
+    owner = u'dashboard-' + str(uuid4())
+
+    session = DB_SESSION()
+    jobs = []
+    for number, state in enumerate((State.Complete, State.Error, State.Complete)):
+        job = Job(u'wf{}.cwl'.format(number), u'{}', u'http://localhost/',
+                  owner if number < 2 else u'someone-else')
+        job.state = state
+        session.add(job)
+        jobs.append(job)
+    session.commit()
+    jobids = [str(job.id) for job in jobs]
+    DB_SESSION.remove()
+
+    token = user_token(app, owner)
+    if isinstance(token, bytes):
+        token = token.decode(u'utf-8')
+    return client, {u'Authorization': u'Bearer ' + token}, jobids
+
+
+def test_states(owned_jobs, monkeypatch):
+    client, headers, jobids = owned_jobs
+    monkeypatch.setattr(server, u'STATUS_BATCH_SIZE', 1)
+    missing = str(uuid4())
+
+    response = client.post(u'/jobs/status', headers=headers,
+                           data=json.dumps(jobids + [missing]))
+    assert response.status_code == 200
+    assert json.loads(response.data) == {
+        jobids[0]: State.Complete.value,
+        jobids[1]: State.Error.value
+    }
+
+
+def test_full_statuses(owned_jobs):
+    client, headers, jobids = owned_jobs
+    response = client.post(u'/jobs/status?full=true', headers=headers,
+                           data=json.dumps(jobids[:1]))
+    status = json.loads(response.data)[jobids[0]]
+    assert status[u'id'] == u'http://localhost/jobs/' + jobids[0]
+    assert status[u'run'] == u'wf0.cwl'
+
+
+@pytest.mark.parametrize('body', [u'', u'{"a": 1}', u'["not-a-job"]', u'[1]'])
+def test_bad_requests(owned_jobs, body):
+    client, headers, _ = owned_jobs
+    assert client.post(u'/jobs/status', headers=headers,
+                       data=body).status_code == 400
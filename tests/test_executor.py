@@ -0,0 +1,121 @@
+"""
+Tests for the bounded job executor
+"""
+from threading import Event
+
+import pytest
+
+from workflow_service.executor import JobExecutor
+from workflow_service.models import State
+
+
+class BlockingRunner(object):
+    # stands in for a JobRunner, finishes when told to
+    def __init__(self):
+        self.state = State.Queued
+        self.started = Event()
+        self._finish = Event()
+        self._done_callbacks = []
+
+    def add_done_callback(self, func):
+        self._done_callbacks.append(func)
+
+    def start(self):
+        self.state = State.Running
+        self.started.set()
+
+    def finish(self):
+        self.state = State.Complete
+        for func in self._done_callbacks:
+            func(self)
+
+
+def test_runs_up_to_max():
+    executor = JobExecutor(2)
+    runners = [BlockingRunner() for _ in range(3)]
+    for runner in runners:
+        executor.submit(runner)
+
+    assert [r.started.is_set() for r in runners] == [True, True, False]
+    assert executor.queued() == [runners[2]]
+    assert len(executor.running()) == 2
+
+
+def test_queue_is_fifo():
+    executor = JobExecutor(1)
+    runners = [BlockingRunner() for _ in range(3)]
+    for runner in runners:
+        executor.submit(runner)
+
+    runners[0].finish()
+    assert [r.started.is_set() for r in runners] == [True, True, False]
+
+    runners[1].finish()
+    assert runners[2].started.is_set()
+    assert executor.queued() == []
+
+
+def test_invalid_max():
+    with pytest.raises(ValueError):
+        JobExecutor(0)
+
+
+def test_submit_all_keeps_order():
+    executor = JobExecutor(1)
+    runners = [BlockingRunner() for _ in range(3)]
+    executor.submit_all(runners)
+
+    assert executor.queued() == runners[1:]
+    runners[0].finish()
+    assert executor.queued() == runners[2:]
+
+
+def started(runners):
+    return [r.started.is_set() for r in runners]
+
+
+def test_owners_take_turns():
+    executor = JobExecutor(1)
+    batch = [BlockingRunner() for _ in range(3)]
+    executor.submit_all(batch, u'batcher')
+    others = [BlockingRunner() for _ in range(2)]
+    executor.submit(others[0], u'other')
+    executor.submit(others[1], None)
+
+    batch[0].finish()
+    assert started(others) == [True, False]
+    others[0].finish()
+    assert started(others) == [True, True]
+    others[1].finish()
+    assert started(batch) == [True, True, False]
+
+
+def test_weights():
+    executor = JobExecutor(1, owner_weights={u'heavy': 2})
+    heavy = [BlockingRunner() for _ in range(4)]
+    light = [BlockingRunner() for _ in range(2)]
+    executor.submit_all(heavy, u'heavy')
+    executor.submit_all(light, u'light')
+
+    order = []
+    while executor.running():
+        runner = executor.running()[0]
+        order.append(u'heavy' if runner in heavy else u'light')
+        runner.finish()
+    assert order == [u'heavy', u'heavy', u'light', u'heavy', u'heavy', u'light']
+
+
+def test_owner_limits():
+    executor = JobExecutor(4, max_per_owner=2, owner_limits={None: 1})
+    batch = [BlockingRunner() for _ in range(3)]
+    anonymous = [BlockingRunner() for _ in range(2)]
+    executor.submit_all(batch, u'batcher')
+    executor.submit_all(anonymous)
+
+    assert started(batch) == [True, True, False]
+    assert started(anonymous) == [True, False]
+    assert len(executor.running()) == 3
+
+    batch[0].finish()
+    assert started(batch) == [True, True, True]
+    assert started(anonymous) == [True, False]
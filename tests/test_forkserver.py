@@ -0,0 +1,75 @@
+"""
+Tests for the server that forks cwltool jobs
+"""
+from subprocess import Popen
+from threading import Event
+
+import pytest
+
+from workflow_service import forkserver
+from workflow_service.forkserver import ForkedProcess, ForkServer
+
+
+def test_spawn(tmpdir):
+    order = tmpdir.join(u'job.json')
+    order.write(u'{}')
+    output = tmpdir.join(u'output')
+    log = tmpdir.join(u'log')
+    log.write(u'')
+
+    server = ForkServer()
+    process = server.spawn([u'--version'], str(tmpdir), str(order),
+                           str(output), str(log))
+    assert process.wait() == 0
+    assert b'cwltool' in output.read_binary()
+
+    process = server.spawn([str(tmpdir.join(u'missing.cwl'))], str(tmpdir),
+                           str(order), str(output), str(log))
+    assert process.wait() != 0
+
+
+def test_resource_usage(tmpdir):
+    order = tmpdir.join(u'job.json')
+    order.write(u'{}')
+    log = tmpdir.join(u'log')
+    log.write(u'')
+
+    process = ForkServer().spawn([u'--version'], str(tmpdir), str(order),
+                                 str(tmpdir.join(u'output')), str(log))
+    process.wait()
+    assert process.rusage[u'max_rss'] > 0
+    assert process.rusage[u'cpu_user'] >= 0
+
+
+def test_lost_process(tmpdir, monkeypatch):
+    monkeypatch.setattr(forkserver, u'LOST_INTERVAL', 0.05)
+    child = Popen([u'sleep', u'0.3'], cwd=str(tmpdir))
+    process = ForkedProcess(child.pid, str(tmpdir))
+    process.lost()
+    assert process.returncode is None
+    # the exit status is unknown, only that it's gone
+    assert process.wait() is None
+    child.wait()
+
+
+def test_spawn_timeout(tmpdir, monkeypatch):
+    order = tmpdir.join(u'job.json')
+    order.write(u'{}')
+    log = tmpdir.join(u'log')
+    log.write(u'')
+
+    abandoned = []
+    killed = Event()
+
+    def abandon(pid):
+        abandoned.append(pid)
+        killed.set()
+
+    monkeypatch.setattr(forkserver, u'SPAWN_TIMEOUT', 0)
+    monkeypatch.setattr(forkserver, u'_abandon', abandon)
+    with pytest.raises(OSError):
+        ForkServer().spawn([u'--version'], str(tmpdir), str(order),
+                           str(tmpdir.join(u'output')), str(log))
+    # the job started too late is killed rather than left running
+    assert killed.wait(30)
+    assert len(abandoned) == 1
@@ -0,0 +1,100 @@
+"""
+Tests for the job runners, with the stand-in for cwltool of the benchmarks
+"""
+import os
+import sys
+import tempfile
+from uuid import uuid4
+
+from workflow_service.job_runner import JobRunner
+from workflow_service.models import State
+from workflow_service.step_cache import cache_stats
+
+FAKE_CWLTOOL = [sys.executable, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    u'benchmarks', u'fake_cwltool.py')]
+
+
+def run(monkeypatch, **env):
+    monkeypatch.setenv(u'FAKE_CWLTOOL_SECONDS', u'0')
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    finished = []
+    runner = JobRunner(u'wf.cwl', u'{"message": "hi"}', uuid4(),
+                       onfinishing=finished.append,
+                       scratch_dir=tempfile.mkdtemp(), command=FAKE_CWLTOOL)
+    runner.start()
+    runner.join(30)
+    assert finished == [runner]
+    return runner
+
+
+def test_command(monkeypatch):
+    runner = run(monkeypatch, FAKE_CWLTOOL_OUTPUT_BYTES=u'100')
+    assert runner.state == State.Complete
+    output = runner.output[u'out']
+    assert output[u'size'] == 100
+    # the outputs are kept in the job's directory
+    assert output[u'path'].startswith(runner.outdir + os.sep)
+    assert os.path.getsize(output[u'path']) == 100
+    with open(runner.logname, 'rb') as log:
+        assert b'Final process status is success' in log.read()
+    assert runner.usage[u'wall_time'] > 0
+
+
+class ReapedJobRunner(JobRunner):
+    # Popen gets to reap cwltool first, as when it's polled
+    def _wait(self):
+        self._proc.wait()
+        super(ReapedJobRunner, self)._wait()
+
+
+class LostJobRunner(JobRunner):
+    def _wait(self):
+        raise OSError(u'lost')
+
+
+def test_reaped_command(monkeypatch):
+    monkeypatch.setenv(u'FAKE_CWLTOOL_SECONDS', u'0')
+    for runner_class, state in ((ReapedJobRunner, State.Complete),
+                                (LostJobRunner, State.Error)):
+        finished = []
+        runner = runner_class(u'wf.cwl', u'{"message": "hi"}', uuid4(),
+                              onfinishing=finished.append,
+                              scratch_dir=tempfile.mkdtemp(),
+                              command=FAKE_CWLTOOL)
+        runner.start()
+        runner.join(30)
+        assert finished == [runner]
+        assert runner.state == state
+
+
+def test_failing_command(monkeypatch):
+    runner = run(monkeypatch, FAKE_CWLTOOL_FAIL=u'1')
+    assert runner.state == State.Error
+    assert runner.output == {}
+
+
+def test_step_cache(monkeypatch):
+    monkeypatch.setenv(u'FAKE_CWLTOOL_SECONDS', u'0')
+    cachedir = tempfile.mkdtemp()
+    runners = []
+    for _ in range(2):
+        runner = JobRunner(u'wf.cwl', u'{"message": "hi"}', uuid4(),
+                           scratch_dir=tempfile.mkdtemp(),
+                           command=FAKE_CWLTOOL, cachedir=cachedir,
+                           parallel=True)
+        runner.start()
+        runner.join(30)
+        runners.append(runner)
+
+    stats = [cache_stats(runner.logname) for runner in runners]
+    assert [(stat.hits, stat.misses) for stat in stats] == [(0, 1), (1, 0)]
+    assert stats[0].paths == stats[1].paths
+    assert os.path.dirname(stats[0].paths[0]) == cachedir
+    for runner in runners:
+        assert runner.state == State.Complete
+        # the outputs are copied from the cache to the job's directory
+        assert runner.output[u'out'][u'path'] == os.path.join(
+            runner.outdir, u'out.txt')
+        assert os.path.isfile(runner.output[u'out'][u'path'])
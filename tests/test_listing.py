@@ -0,0 +1,141 @@
+"""
+Tests for listing jobs
+"""
+from datetime import timedelta
+import gzip
+import io
+import json
+from uuid import UUID, uuid4
+
+import pytest
+
+from workflow_service import server
+from workflow_service.database import DB_SESSION
+from workflow_service.models import Job, State
+
+from tests import app_client, request, user_token
+
+
+@pytest.fixture
+def lister(app_client):
+    # a user with a known set of jobs
+    app, client = app_client
+    owner = u'lister-' + str(uuid4())
+
+    session = DB_SESSION()
+    for number in range(7):
+        job = Job(u'wf{}.cwl'.format(number), u'{}', u'http://localhost/', owner)
+        job.state = State.Complete if number % 2 else State.Error
+        session.add(job)
+    session.commit()
+    DB_SESSION.remove()
+
+    token = user_token(app, owner)
+    if isinstance(token, bytes):
+        token = token.decode(u'utf-8')
+    return client, token
+
+
+def job_ids(jobs):
+    return [job[u'id'].split(u'/')[-1] for job in jobs]
+
+
+def test_pages(lister):
+    client, token = lister
+    status_code, everything = request(client, u'get', u'/jobs', token=token)
+    assert status_code == 200
+    assert len(everything) == 7
+
+    pages = []
+    url = u'/jobs?limit=3'
+    while True:
+        status_code, page = request(client, u'get', url, token=token)
+        assert status_code == 200
+        if not page:
+            break
+        pages.append(page)
+        url = u'/jobs?limit=3&after=' + job_ids(page)[-1]
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sum([job_ids(page) for page in pages], []) == job_ids(everything)
+
+
+def test_state_filter(lister):
+    client, token = lister
+    _, jobs = request(client, u'get', u'/jobs?state=Complete', token=token)
+    assert len(jobs) == 3
+    assert all(job[u'state'] == State.Complete.value for job in jobs)
+
+    _, jobs = request(client, u'get', u'/jobs?state=Complete&state=Error',
+                      token=token)
+    assert len(jobs) == 7
+
+
+def test_time_filter(lister):
+    client, token = lister
+    _, jobs = request(client, u'get', u'/jobs?since=2000-01-01', token=token)
+    assert len(jobs) == 7
+
+    _, jobs = request(client, u'get', u'/jobs?until=2000-01-01T00:00:00',
+                      token=token)
+    assert jobs == []
+
+
+@pytest.mark.parametrize('query', [
+    u'limit=0', u'limit=many', u'state=Sleeping', u'since=yesterday',
+    u'after=not-a-job', u'after=00000000-0000-0000-0000-000000000000'
+])
+def test_bad_queries(lister, query):
+    client, token = lister
+    status_code, _ = request(client, u'get', u'/jobs?' + query, token=token)
+    assert status_code == 400
+
+
+def test_batches_and_gzip(lister, monkeypatch):
+    client, token = lister
+    monkeypatch.setattr(server, u'JOBS_BATCH_SIZE', 2)
+    _, jobs = request(client, u'get', u'/jobs', token=token)
+
+    response = client.get(u'/jobs', headers={
+        u'Authorization': u'Bearer ' + token,
+        u'Accept-Encoding': u'gzip'
+    })
+    assert response.headers[u'Content-Encoding'] == u'gzip'
+    assert json.loads(gzip.GzipFile(fileobj=io.BytesIO(response.data)).read()
+                      .decode(u'utf-8')) == jobs
+
+
+def test_page_size(lister, monkeypatch):
+    client, token = lister
+    monkeypatch.setitem(server.APP.config, u'JOBS_PAGE_SIZE', 4)
+    monkeypatch.setitem(server.APP.config, u'MAX_JOBS_PAGE_SIZE', 5)
+    _, jobs = request(client, u'get', u'/jobs', token=token)
+    assert len(jobs) == 4
+    _, jobs = request(client, u'get', u'/jobs?limit=100', token=token)
+    assert len(jobs) == 5
+
+
+def test_queue_positions(lister, monkeypatch):
+    client, token = lister
+    monkeypatch.setattr(server, u'JOBS_BATCH_SIZE', 2)
+    _, jobs = request(client, u'get', u'/jobs', token=token)
+    session = DB_SESSION()
+    queued = session.query(Job).filter(
+        Job.id.in_([UUID(jobid) for jobid in job_ids(jobs)[2:5]])).all()
+    # jobs started within a second share a position
+    for seconds, job in enumerate(queued):
+        job.state = State.Queued
+        job.start_time += timedelta(seconds=seconds)
+    session.commit()
+    DB_SESSION.remove()
+
+    _, jobs = request(client, u'get', u'/jobs', token=token)
+    queued = [job for job in jobs if job[u'state'] == u'Queued']
+    assert [job[u'queue_position'] for job in queued] == [1, 2, 3]
+    assert all(u'queue_position' not in job
+               for job in jobs if job[u'state'] != u'Queued')
+
+    # the single lookup agrees with the listing
+    _, job = request(client, u'get', u'/jobs/' + job_ids(queued)[1],
+                     token=token)
+    assert job[u'queue_position'] == 2
@@ -70,3 +70,14 @@ def test_retrieve_outputs_in_list():
 
     for outputid in [u'all-out/3', u'all-out//', u'foo/bar', u'']:
         assert server.getoutputobj(in_list, outputid) is None
+
+def test_output_index():
+    in_list = status_with_name['in-list']
+    index = server.index_outputs(in_list[u'output'])
+    assert sorted(index) == [u'all-out/0', u'all-out/1', u'all-out/2', u'xml']
+    for outputid, entry in viewitems(index):
+        output = server.getoutputobj(in_list, outputid)
+        assert entry == {key: output[key] for key in
+                         (u'path', u'basename', u'size', u'checksum')}
+
+    assert server.index_outputs(status_with_name[u'empty'][u'output']) == {}
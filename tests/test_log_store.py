@@ -0,0 +1,130 @@
+"""
+Tests for the compression of finished logs and the tails of logs
+"""
+import gzip
+from io import BytesIO
+import os
+import tempfile
+from uuid import uuid4
+
+import pytest
+
+from workflow_service.database import DB_SESSION
+from workflow_service.log_store import (
+    LogCompressor, compress_log, is_compressed, open_log, tail_offset
+)
+from workflow_service.models import Job, State
+
+from tests import app_client  # pylint: disable=unused-import
+
+LOG = b'first\nsecond\nthird\n'
+
+
+def write_log(contents=LOG):
+    handle, logname = tempfile.mkstemp()
+    os.write(handle, contents)
+    os.close(handle)
+    return logname
+
+
+def test_compress_log():
+    logname = write_log()
+    assert compress_log(logname)
+    assert is_compressed(logname)
+    assert not os.path.exists(logname)
+    with gzip.open(logname + u'.gz', 'rb') as compressed:
+        assert compressed.read() == LOG
+    with open_log(logname) as log:
+        log.seek(6)
+        assert log.read() == b'second\nthird\n'
+    # it's already done
+    assert not compress_log(logname)
+    with pytest.raises(IOError):
+        open_log(logname + u'.missing')
+
+
+def test_compressor():
+    lognames = [write_log(), write_log()]
+    compressor = LogCompressor(level=1)
+    compressor._pending.extend(lognames)  # pylint: disable=protected-access
+    compressor.flush()
+    assert all(is_compressed(logname) for logname in lognames)
+
+
+@pytest.mark.parametrize(u'compressed', [False, True])
+def test_tail_offset(compressed):
+    logs = [write_log(LOG), write_log(LOG + b'fourth'), write_log(b'')]
+    if compressed:
+        for logname in logs:
+            compress_log(logname)
+    finished, partial, empty = logs
+    assert tail_offset(finished, 1) == 13
+    assert tail_offset(finished, 2) == 6
+    assert tail_offset(finished, 10) == 0
+    assert tail_offset(finished, 0) == len(LOG)
+    # the line being written counts
+    assert tail_offset(partial, 1) == len(LOG)
+    assert tail_offset(partial, 2) == 13
+    assert tail_offset(empty, 5) == 0
+
+
+def add_job(logname):
+    session = DB_SESSION()
+    job = Job(u'wf.cwl', u'{}', u'http://localhost/')
+    jobid = job.id = uuid4()
+    job.state = State.Complete
+    job.logfile = logname
+    job.outdir = tempfile.gettempdir()
+    session.add(job)
+    session.commit()
+    DB_SESSION.remove()
+    return u'/jobs/{}/log'.format(jobid)
+
+
+def test_get_log(app_client):  # pylint: disable=redefined-outer-name
+    _, client = app_client
+    logname = write_log()
+    url = add_job(logname)
+
+    response = client.get(url + u'?tail=1')
+    assert response.status_code == 200
+    assert u'Content-Encoding' not in response.headers
+    assert response.get_data() == (
+        b'id: 19\ndata: third\n\nid: 19\nevent: end\ndata: \n\n')
+
+    compress_log(logname)
+    response = client.get(url + u'?tail=2',
+                          headers={u'Accept-Encoding': u'gzip'})
+    assert response.status_code == 200
+    assert response.headers[u'Content-Encoding'] == u'gzip'
+    assert gzip.GzipFile(fileobj=BytesIO(response.get_data())).read() == (
+        b'id: 19\ndata: second\ndata: third\n\n'
+        b'id: 19\nevent: end\ndata: \n\n')
+
+    # resuming clients don't get the tail again
+    response = client.get(url + u'?tail=2',
+                          headers={u'Last-Event-ID': u'19'})
+    assert u'Content-Encoding' not in response.headers
+    assert response.get_data() == b'id: 19\nevent: end\ndata: \n\n'
+
+    for query in (u'tail=-1', u'tail=last', u'offset=-1'):
+        assert client.get(url + u'?' + query).status_code == 400
+
+
+def test_get_whole_compressed_log(app_client):  # pylint: disable=redefined-outer-name
+    _, client = app_client
+    logname = write_log()
+    url = add_job(logname)
+    expected = client.get(url).get_data()
+    compress_log(logname)
+
+    for _ in range(2):
+        response = client.get(url, headers={u'Accept-Encoding': u'gzip'})
+        assert response.status_code == 200
+        assert response.headers[u'Content-Encoding'] == u'gzip'
+        assert response.mimetype == u'text/event-stream'
+        assert response.headers[u'Cache-Control'] == u'no-cache'
+        assert gzip.GzipFile(fileobj=BytesIO(response.get_data())).read() == (
+            expected)
+    # the events are kept next to the log, and sent as they are
+    assert os.path.exists(logname + u'.events.gz')
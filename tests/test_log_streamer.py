@@ -0,0 +1,86 @@
+"""
+Tests for log streaming
+"""
+from threading import Event, Thread
+from time import sleep
+
+from workflow_service.log_streamer import LogReader, LogWatcher, sse_events
+
+LOG = b'first line\nsecond line\nthird'
+
+
+def write_log(tmpdir, contents=LOG):
+    logfile = tmpdir.join(u'log')
+    logfile.write_binary(contents)
+    return str(logfile)
+
+
+def test_follow_finished_log(tmpdir):
+    logname = write_log(tmpdir)
+    chunks = list(LogWatcher().follow(logname, 0, lambda: False))
+
+    assert b''.join(data for _, data in chunks) == LOG
+    assert chunks[-1][0] == len(LOG)
+
+
+def test_follow_from_offset(tmpdir):
+    logname = write_log(tmpdir)
+    offset = LOG.index(b'second')
+    chunks = list(LogWatcher().follow(logname, offset, lambda: False))
+
+    assert b''.join(data for _, data in chunks) == LOG[offset:]
+
+
+def test_follow_live_log(tmpdir):
+    logname = write_log(tmpdir, b'')
+    finished = Event()
+    watcher = LogWatcher(interval=0.01)
+
+    def writer():
+        with open(logname, 'ab') as logfile:
+            for line in (b'one\n', b'two\n', b'three'):
+                sleep(0.05)
+                logfile.write(line)
+                logfile.flush()
+        finished.set()
+        watcher.wake(logname)
+
+    thread = Thread(target=writer)
+    thread.start()
+    chunks = list(watcher.follow(logname, 0, lambda: not finished.is_set()))
+    thread.join()
+
+    assert b''.join(data for _, data in chunks) == b'one\ntwo\nthree'
+    assert chunks[-1][0] == 13
+
+
+def test_log_reader(tmpdir):
+    logname = write_log(tmpdir)
+    with open(logname, 'ab') as logfile, open(logname, 'rb') as log:
+        reader = LogReader(log, 0)
+        assert reader.read() == (len(b'first line\nsecond line\n'),
+                                 b'first line\nsecond line\n')
+        # the last line is held back until it's complete
+        assert reader.read() is None
+        assert reader.position == len(LOG)
+
+        logfile.write(b' line\nfourth')
+        logfile.flush()
+        assert reader.read() == (len(LOG + b' line\n'), b'third line\n')
+        assert reader.read() is None
+        assert reader.rest() == (len(LOG + b' line\nfourth'), b'fourth')
+        assert reader.rest() is None
+
+
+def test_sse_framing():
+    events = u''.join(sse_events([(11, b'first line\n'), (23, b'a\nb\n')]))
+
+    assert events == (
+        u'id: 11\ndata: first line\n\n'
+        u'id: 23\ndata: a\ndata: b\n\n'
+        u'id: 23\nevent: end\ndata: \n\n'
+    )
+
+
+def test_sse_framing_empty():
+    assert list(sse_events([], 42)) == [u'id: 42\nevent: end\ndata: \n\n']
@@ -0,0 +1,128 @@
+"""
+Tests for the memoization of job results
+"""
+from functools import partial
+import json
+import os
+
+import pytest
+
+from workflow_service import server
+from workflow_service.database import DB_SESSION
+from workflow_service.memo import memo_key, outputs_exist
+from workflow_service.models import Job, State
+from workflow_service.workflow_cache import WorkflowCache, packed_workflow
+
+from tests import app_client
+
+
+def fetch(url):
+    if url != u'wf.cwl':
+        raise IOError(u'Not found: ' + url)
+    return b'class: CommandLineTool'
+
+
+def test_key_ignores_formatting():
+    key = memo_key(u'wf.cwl', u'{"a": 1, "b": [1, 2]}', fetch=fetch)
+    assert key == memo_key(u'wf.cwl', u'{ "b": [1,2],\n"a": 1 }', fetch=fetch)
+    assert key != memo_key(u'wf.cwl', u'{"a": 2, "b": [1, 2]}', fetch=fetch)
+    assert memo_key(u'missing.cwl', u'{}', fetch=fetch) is None
+
+
+def test_key_follows_local_inputs(tmpdir):
+    data = tmpdir.join(u'data.txt')
+    data.write(u'hi')
+    order = json.dumps({u'in': {u'class': u'File', u'location':
+                                u'file://' + str(data)}})
+    key = memo_key(u'wf.cwl', order, fetch=fetch)
+    assert key is not None
+    assert key == memo_key(u'wf.cwl', order, fetch=fetch)
+
+    stat = os.stat(str(data))
+    os.utime(str(data), (stat.st_atime, stat.st_mtime + 10))
+    assert memo_key(u'wf.cwl', order, fetch=fetch) != key
+
+    folder = tmpdir.mkdir(u'folder')
+    order = json.dumps({u'in': {u'class': u'Directory',
+                                u'path': str(folder)}})
+    key = memo_key(u'wf.cwl', order, fetch=fetch)
+    folder.join(u'new.txt').write(u'hi')
+    assert memo_key(u'wf.cwl', order, fetch=fetch) != key
+
+
+def test_unhashable_inputs_are_not_memoized(tmpdir):
+    for location in (u'http://example.org/data.txt', u'data.txt',
+                     str(tmpdir.join(u'missing.txt'))):
+        order = json.dumps({u'in': [{u'class': u'File',
+                                     u'location': location}]})
+        assert memo_key(u'wf.cwl', order, fetch=fetch) is None
+    # YAML
+    assert memo_key(u'wf.cwl', u'in: {class: File, location: data.txt}',
+                    fetch=fetch) is None
+
+
+def test_outputs_exist(tmpdir):
+    out = tmpdir.join(u'out.txt')
+    output = {u'out': [{u'location': u'http://localhost/jobs/x/output/out/0',
+                        u'path': str(out), u'basename': u'out.txt'}]}
+    assert not outputs_exist(output)
+    out.write(u'hi')
+    assert outputs_exist(output)
+
+
+def pack(url):
+    with open(url, 'rb') as document:
+        return b'packed ' + document.read()
+
+
+@pytest.fixture
+def memoized(app_client, tmpdir, monkeypatch):
+    app, client = app_client
+    workflow = tmpdir.join(u'wf.cwl')
+    workflow.write(u'class: CommandLineTool')
+    out = tmpdir.join(u'out.txt')
+    out.write(u'hi')
+    body = u'{"message": "hi"}'
+
+    cache = WorkflowCache(str(tmpdir.join(u'cache')), pack=pack)
+    monkeypatch.setattr(server, u'WORKFLOW_CACHE', cache)
+    fetch_packed = partial(packed_workflow, cache=cache)
+
+    session = DB_SESSION()
+    job = Job(str(workflow), body, u'http://localhost/')
+    job.state = State.Complete
+    job.memo_key = memo_key(str(workflow), body, fetch=fetch_packed)
+    job.output = {u'out': {u'location': u'http://localhost/jobs/x/output/out',
+                           u'path': str(out), u'basename': u'out.txt'}}
+    session.add(job)
+    session.commit()
+    jobid = job.id
+    DB_SESSION.remove()
+
+    app.config[u'MEMOIZE'] = True
+    yield client, str(workflow), body, jobid, out, fetch_packed
+    app.config[u'MEMOIZE'] = False
+
+
+def test_identical_run_is_memoized(memoized):
+    client, workflow, body, jobid, _, _ = memoized
+    response = client.post(u'/run?wf=' + workflow, data=u'{"message":"hi"}')
+    assert response.status_code == 303
+
+    status = json.loads(client.get(response.headers[u'Location']).data)
+    assert status[u'state'] == State.Complete.value
+    assert status[u'output'][u'out'][u'location'] == (
+        status[u'id'] + u'/output/out')
+    assert str(jobid) not in status[u'id']
+    assert client.get(status[u'id'] + u'/output/out').data == b'hi'
+
+
+def test_runs_without_outputs_are_forgotten(memoized):
+    _, workflow, body, jobid, out, fetch_packed = memoized
+    out.remove()
+    with server.APP.test_request_context():
+        assert server.clone_memoized(workflow, body, None,
+                                     memo_key(workflow, body,
+                                              fetch=fetch_packed),
+                                     u'http://localhost/') is None
+        assert DB_SESSION().query(Job).get(jobid).memo_key is None
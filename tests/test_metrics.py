@@ -0,0 +1,105 @@
+"""
+Tests for the metrics of the service
+"""
+import json
+import os
+
+from workflow_service.metrics import Registry
+from workflow_service.processes import identity
+
+from tests import app_client
+
+DEAD_PID = 2 ** 22 + 1
+
+
+def registry_in(metrics_dir):
+    registry = Registry(metrics_dir)
+    return (registry,
+            registry.counter(u'runs', u'Runs', (u'state',)),
+            registry.gauge(u'streams', u'Streams'),
+            registry.histogram(u'latency', u'Latency', buckets=(1, 10)))
+
+
+def other_process(metrics_dir, pid, values, process=None):
+    # metrics left by another server process, the ones without an identity
+    # are from before processes had one
+    data = {u'pid': pid, u'values': values}
+    if process is not None:
+        data[u'process'] = process
+    with open(os.path.join(str(metrics_dir), u'{}-0.json'.format(pid)),
+              'w') as metrics_file:
+        json.dump(data, metrics_file)
+
+
+def test_processes_are_added_up(tmpdir):
+    registry, runs, streams, latency = registry_in(str(tmpdir))
+    runs.inc(state=u'Complete')
+    streams.inc()
+    latency.observe(0.5)
+    latency.observe(5)
+
+    values = {
+        u'runs': {runs.key(state=u'Complete'): 2},
+        u'streams': {streams.key(): 3},
+        u'latency': {latency.key(): {u'buckets': [0, 1], u'sum': 2,
+                                     u'count': 1}}
+    }
+    other_process(tmpdir, os.getppid(), values)
+    # gauges of processes that are gone don't count
+    other_process(tmpdir, DEAD_PID, values)
+
+    totals = registry.collect()
+    assert totals[u'runs'] == {runs.key(state=u'Complete'): 5}
+    assert totals[u'streams'] == {streams.key(): 4}
+    assert totals[u'latency'] == {latency.key(): {
+        u'buckets': [1, 4], u'sum': 9.5, u'count': 4}}
+
+
+def test_gone_processes_are_retired(tmpdir):
+    registry, runs, streams, _ = registry_in(str(tmpdir))
+    values = {
+        u'runs': {runs.key(state=u'Complete'): 2},
+        u'streams': {streams.key(): 3}
+    }
+    other_process(tmpdir, DEAD_PID, values)
+    # a process that got the pid of the parent's after it was gone
+    other_process(tmpdir, os.getppid(), values,
+                  process=u'{}-1'.format(os.getppid()))
+    parent = u'{}.json'.format(identity(os.getppid()))
+    with open(os.path.join(str(tmpdir), parent), 'w') as metrics_file:
+        json.dump({u'pid': os.getppid(), u'process': identity(os.getppid()),
+                   u'values': values}, metrics_file)
+
+    for _ in range(2):
+        totals = registry.collect()
+        assert totals[u'runs'] == {runs.key(state=u'Complete'): 6}
+        assert totals[u'streams'] == {streams.key(): 3}
+        # the files of the processes that are gone are deleted
+        assert sorted(name for name in os.listdir(str(tmpdir))
+                      if name.endswith(u'.json')) == [parent]
+
+
+def test_exposition():
+    registry, runs, _, latency = registry_in(None)
+    runs.inc(state=u'Complete')
+    latency.observe(2)
+
+    lines = registry.exposition().splitlines()
+    assert u'# TYPE runs counter' in lines
+    assert u'runs{state="Complete"} 1.0' in lines
+    assert u'latency_bucket{le="1.0"} 0.0' in lines
+    assert u'latency_bucket{le="10.0"} 1.0' in lines
+    assert u'latency_bucket{le="+Inf"} 1.0' in lines
+    assert u'latency_count 1.0' in lines
+
+
+def test_endpoint(app_client):
+    _, client = app_client
+    client.get(u'/health')
+    response = client.get(u'/metrics')
+    assert response.status_code == 200
+
+    text = response.get_data(as_text=True)
+    assert u'# TYPE workflow_service_jobs gauge' in text
+    assert (u'workflow_service_request_seconds_count{route="/health",'
+            u'method="GET",status="200"}') in text
@@ -0,0 +1,87 @@
+"""
+Tests for the upgrades of the schema of existing databases
+"""
+import os
+import tempfile
+
+from sqlalchemy import (
+    Column, DateTime, Enum, MetaData, String, Table, UnicodeText,
+    create_engine, func, inspect
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy_utils import JSONType, UUIDType
+import pytest
+
+from workflow_service.database import BASE
+from workflow_service.migrations import (
+    current_version, latest_version, upgrade
+)
+from workflow_service.models import Job
+
+from tests import app_client  # pylint: disable=unused-import
+
+
+def first_release(engine):
+    """Creates the jobs table as the first release did"""
+    metadata = MetaData()
+    Table(
+        u'jobs', metadata,
+        Column(u'id', UUIDType(native=True), primary_key=True),
+        Column(u'input_json', JSONType),
+        Column(u'workflow', UnicodeText),
+        Column(u'output', JSONType),
+        Column(u'state', Enum(u'Running', u'Complete', u'Paused', u'Error',
+                              u'Cancelled', name=u'state')),
+        Column(u'start_time', DateTime, server_default=func.now()),
+        Column(u'state_time', DateTime),
+        Column(u'owner', String(50)),
+        Column(u'run_by_host', String(50)))
+    metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+def engine():
+    handle, filename = tempfile.mkstemp(suffix=u'.db')
+    os.close(handle)
+    yield create_engine(u'sqlite:///' + filename)
+    os.remove(filename)
+
+
+def insert_job(engine, state):
+    engine.execute(
+        u"INSERT INTO jobs (id, workflow, state, owner, run_by_host) "
+        u"VALUES (?, 'wf.cwl', ?, 'alice', 'http://localhost/')",
+        os.urandom(16), state)
+
+
+def test_upgrade_first_release(engine):
+    first_release(engine)
+    insert_job(engine, u'Complete')
+    with pytest.raises(IntegrityError):
+        insert_job(engine, u'Queued')
+
+    assert upgrade(engine, BASE.metadata) == list(
+        range(2, latest_version() + 1))
+    assert current_version(engine) == latest_version()
+
+    # the upgraded table is the one create_all makes
+    columns = set(column[u'name']
+                  for column in inspect(engine).get_columns(u'jobs'))
+    assert columns == set(Job.__table__.columns.keys())
+    indexes = set(index[u'name']
+                  for index in inspect(engine).get_indexes(u'jobs'))
+    assert indexes == set(index.name for index in Job.__table__.indexes)
+    insert_job(engine, u'Queued')
+    states = [row[0] for row in engine.execute(
+        u'SELECT state FROM jobs ORDER BY state')]
+    assert states == [u'Complete', u'Queued']
+
+    # nothing left to do
+    assert upgrade(engine, BASE.metadata) == []
+
+
+def test_new_database(engine):
+    assert upgrade(engine, BASE.metadata) == []
+    assert current_version(engine) == latest_version()
+    assert engine.has_table(u'jobs')
+    insert_job(engine, u'Queued')
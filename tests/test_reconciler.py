@@ -0,0 +1,149 @@
+"""
+Tests for the reconciliation of the jobs left behind by server processes
+"""
+import json
+import os
+from subprocess import Popen
+import tempfile
+from uuid import uuid4
+
+from workflow_service import reconciler, server
+from workflow_service.database import DB_SESSION
+from workflow_service.job_runner import output_file
+from workflow_service.models import Job, State
+from workflow_service.processes import identity, is_identity_alive
+from workflow_service.reconciler import reconcile
+
+from tests import app_client  # pylint: disable=unused-import
+
+
+def dead_pid():
+    proc = Popen([u'true'])
+    proc.wait()
+    return proc.pid
+
+
+def add_job(node, state, pid=None, output=None, log=b'', supervisor=None):
+    outdir = os.path.join(tempfile.mkdtemp(), u'out')
+    os.makedirs(outdir)
+    logname = os.path.join(os.path.dirname(outdir), u'log')
+    with open(logname, 'wb') as logfile:
+        logfile.write(log)
+    if output is not None:
+        with open(output_file(outdir), 'w') as outfile:
+            json.dump(output, outfile)
+
+    session = DB_SESSION()
+    job = Job(u'wf.cwl', u'{}', u'http://localhost/', u'someone')
+    jobid = job.id = uuid4()
+    job.state = state
+    job.node = node
+    job.supervisor = supervisor or identity(dead_pid())
+    job.pid = pid
+    job.logfile = logname
+    job.outdir = outdir
+    session.add(job)
+    session.commit()
+    DB_SESSION.remove()
+    return jobid, outdir
+
+
+def test_finished_and_lost_jobs(app_client):  # pylint: disable=redefined-outer-name,unused-argument
+    node = u'node-' + str(uuid4())
+    output = {u'out': {u'class': u'File', u'location': u'file:///out.txt',
+                       u'path': u'/out.txt'}}
+    done, _ = add_job(node, State.Running, dead_pid(), output,
+                      b'[job] Final process status is success\n')
+    failed, _ = add_job(node, State.Running, dead_pid(), output,
+                        b'[job] Final process status is permanentFail\n')
+    lost, _ = add_job(node, State.Paused, dead_pid())
+    queued, _ = add_job(node, State.Queued)
+
+    requeued = []
+    finished = dict()
+    thread = reconcile(node, lambda job: requeued.append(job.id),
+                       lambda job, state, out: finished.update(
+                           {job.id: (state, out)}))
+
+    assert thread is None
+    assert requeued == [queued]
+    assert finished[done] == (State.Complete, output)
+    assert finished[failed] == (State.Error, {})
+    assert finished[lost] == (State.Error, {})
+
+    # they're all claimed now
+    assert reconcile(node, requeued.append, None) is None
+    assert requeued == [queued]
+
+
+def test_running_process_is_watched(app_client, monkeypatch):  # pylint: disable=redefined-outer-name,unused-argument
+    monkeypatch.setattr(reconciler, u'WATCH_INTERVAL', 0.05)
+    node = u'node-' + str(uuid4())
+    jobid, outdir = add_job(node, State.Running)
+    proc = Popen([u'sleep', u'30'], cwd=outdir)
+    session = DB_SESSION()
+    session.query(Job).get(jobid).pid = proc.pid
+    session.commit()
+    DB_SESSION.remove()
+
+    finished = []
+    thread = reconcile(node, None,
+                       lambda job, state, out: finished.append(state))
+    assert thread is not None
+    assert finished == []
+
+    proc.kill()
+    proc.wait()
+    thread.join(5)
+    assert finished == [State.Error]
+
+
+def test_finish_orphan(app_client):  # pylint: disable=redefined-outer-name,unused-argument
+    node = u'node-' + str(uuid4())
+    output = {u'out': {u'class': u'File', u'location': u'file:///tmp/out.txt',
+                       u'path': u'/tmp/out.txt', u'basename': u'out.txt'}}
+    jobid, _ = add_job(node, State.Running, dead_pid(), output,
+                       b'Final process status is success\n')
+    reconcile(node, None, server.JOB_RUNNERS.finish_orphan)
+
+    job = Job.query.get(jobid)
+    assert job.state == State.Complete
+    assert job.output[u'out'][u'location'] == (
+        u'http://localhost/jobs/{}/output/out'.format(jobid))
+    assert job.output_index[u'out'][u'path'] == u'/tmp/out.txt'
+    DB_SESSION.remove()
+
+
+def test_reused_pids(app_client):  # pylint: disable=redefined-outer-name,unused-argument
+    node = u'node-' + str(uuid4())
+    proc = Popen([u'sleep', u'30'])
+    try:
+        # an earlier process with the pid of this one, or of another one
+        mine, _ = add_job(node, State.Queued,
+                          supervisor=u'{}-1'.format(os.getpid()))
+        legacy, _ = add_job(node, State.Queued,
+                            supervisor=u'{}'.format(os.getpid()))
+        reused, _ = add_job(node, State.Queued,
+                            supervisor=u'{}-1'.format(proc.pid))
+        alive, _ = add_job(node, State.Queued, supervisor=identity(proc.pid))
+        assert is_identity_alive(identity(proc.pid))
+
+        requeued = []
+        reconcile(node, lambda job: requeued.append(job.id), None)
+        assert sorted(requeued) == sorted([mine, legacy, reused])
+        assert Job.query.get(mine).supervisor == identity()
+        assert Job.query.get(alive).supervisor == identity(proc.pid)
+        DB_SESSION.remove()
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_start_once(monkeypatch):
+    adopted = []
+    monkeypatch.setattr(server, u'STARTED', False)
+    monkeypatch.setattr(server.JOB_RUNNERS, u'adopt_orphans',
+                        lambda: adopted.append(True))
+    server.start()
+    server.start()
+    assert adopted == [True]
@@ -0,0 +1,82 @@
+"""
+Tests for the registry of job runners
+"""
+from signal import SIGQUIT
+from subprocess import Popen
+from time import sleep
+from uuid import uuid4
+
+from workflow_service import registry
+from workflow_service.models import Job, State
+
+
+def job_with(**columns):
+    job = Job(u'wf.cwl', u'{}', u'http://localhost/')
+    job.id = uuid4()
+    for key, value in columns.items():
+        setattr(job, key, value)
+    return job
+
+
+class LocalRunner(object):  # pylint: disable=too-few-public-methods
+    def __init__(self, uuid):
+        self.uuid = uuid
+        self.logname = u'/tmp/log'
+        self.outdir = u'/tmp/out'
+
+    def add_done_callback(self, func):
+        self.done = func  # pylint: disable=attribute-defined-outside-init
+
+
+def test_local_runner_is_preferred():
+    job = job_with()
+    runner = LocalRunner(job.id)
+    registry.register(job, runner)
+
+    assert registry.runner_for(job) is runner
+    assert job.node == registry.NODE
+    assert job.logfile == runner.logname
+
+    runner.done(runner)
+    assert job.id not in registry.RUNNERS
+
+
+def test_remote_runner():
+    job = job_with(node=registry.NODE, pid=42, logfile=u'/tmp/log')
+    runner = registry.runner_for(job)
+
+    assert isinstance(runner, registry.RemoteRunner)
+    assert runner.pid == 42
+    assert runner.reachable()
+
+    other = registry.runner_for(job_with(node=u'elsewhere', logfile=u'/tmp/log'))
+    assert not other.reachable()
+
+
+def test_remote_runner_checks_process(tmpdir):
+    proc = Popen([u'sleep', u'30'], cwd=str(tmpdir))
+    try:
+        job = job_with(node=registry.NODE, pid=proc.pid, logfile=u'/tmp/log',
+                       outdir=str(tmpdir.mkdir(u'other')))
+        # the pid went to a process that isn't the job's
+        registry.runner_for(job).cancel()
+        sleep(0.2)
+        assert proc.poll() is None
+
+        job.outdir = str(tmpdir)
+        registry.runner_for(job).cancel()
+        assert proc.wait() == -SIGQUIT
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+def test_unknown_runner():
+    assert registry.runner_for(job_with()) is None
+
+
+def test_control_checks_state():
+    job = job_with(state=State.Complete, node=registry.NODE, logfile=u'/tmp/log')
+    for action in (u'cancel', u'pause', u'resume'):
+        assert not registry.control(job, action)
@@ -0,0 +1,55 @@
+"""
+Tests for the accounting of the resources used by jobs
+"""
+import json
+from uuid import uuid4
+
+from workflow_service import server
+from workflow_service.database import DB_SESSION
+from workflow_service.models import Job, State, update_job
+
+from tests import app_client, user_token
+
+
+def test_usage_in_status_and_stats(app_client):
+    app, client = app_client
+    owner = u'accountant-' + str(uuid4())
+
+    session = DB_SESSION()
+    jobs = [Job(u'wf.cwl', u'{}', u'http://localhost/', owner)
+            for _ in range(3)]
+    session.add_all(jobs)
+    session.commit()
+    jobids = [job.id for job in jobs]
+    DB_SESSION.remove()
+
+    for number, jobid in enumerate(jobids[:2]):
+        update_job(server.APP, jobid, State.Complete, {}, {}, {
+            u'wall_time': 10.0 * (number + 1), u'cpu_user': 1.5,
+            u'cpu_system': 0.5, u'max_rss': 1000 * (number + 1),
+            u'blocks_in': 8, u'blocks_out': 16
+        })
+
+    token = user_token(app, owner)
+    if isinstance(token, bytes):
+        token = token.decode(u'utf-8')
+    headers = {u'Authorization': u'Bearer ' + token}
+
+    status = json.loads(client.get(u'/jobs/{}'.format(jobids[0]),
+                                   headers=headers).data)
+    assert status[u'resources'][u'wall_time'] == 10.0
+    assert status[u'resources'][u'max_rss'] == 1000
+    status = json.loads(client.get(u'/jobs/{}'.format(jobids[2]),
+                                   headers=headers).data)
+    assert u'resources' not in status
+
+    response = client.get(u'/workflows/stats', headers=headers)
+    stats = json.loads(response.data)
+    assert len(stats) == 1
+    assert stats[0][u'workflow'] == u'wf.cwl'
+    assert stats[0][u'jobs'] == 2
+    assert stats[0][u'wall_time'] == 30.0
+    assert stats[0][u'max_wall_time'] == 20.0
+    assert stats[0][u'cpu_time'] == 4.0
+    assert stats[0][u'max_rss'] == 2000
+    assert stats[0][u'blocks_out'] == 32
@@ -0,0 +1,114 @@
+"""
+Tests for the garbage collection of the scratch directory
+"""
+from datetime import datetime, timedelta
+import os
+import tempfile
+from uuid import uuid4
+
+from workflow_service.database import DB_SESSION
+from workflow_service.models import Job, State
+from workflow_service.scratch import JobDir, ScratchCollector, to_evict
+
+from tests import app_client, user_token  # pylint: disable=unused-import
+
+NOW = datetime(2018, 10, 1, 12)
+
+
+def job_dirs(*specs):
+    return [JobDir(u'/scratch/{}/out'.format(number), owner,
+                   NOW - timedelta(hours=hours), size)
+            for number, (owner, hours, size) in enumerate(specs)]
+
+
+def test_max_age():
+    dirs = job_dirs((u'a', 48, 10), (u'b', 30, 10), (u'a', 1, 10))
+    assert to_evict(dirs, NOW, max_age=24 * 60 * 60) == [
+        u'/scratch/0/out', u'/scratch/1/out']
+
+
+def test_owner_quota():
+    dirs = job_dirs((u'a', 3, 10), (u'b', 2, 50), (u'a', 1, 10))
+    assert to_evict(dirs, NOW, owner_quota=20) == [u'/scratch/1/out']
+    assert to_evict(dirs, NOW, owner_quota=15) == [
+        u'/scratch/0/out', u'/scratch/1/out']
+
+
+def test_quota():
+    dirs = job_dirs((u'a', 3, 10), (u'b', 2, 50), (u'a', 1, 10))
+    # 30 bytes belong to running jobs
+    assert to_evict(dirs, NOW, used=100, quota=90) == [u'/scratch/0/out']
+    assert to_evict(dirs, NOW, used=100, quota=40) == [
+        u'/scratch/0/out', u'/scratch/1/out']
+    # the directories evicted by age count towards the quota
+    assert to_evict(dirs, NOW, used=100, quota=90,
+                    max_age=2.5 * 60 * 60) == [u'/scratch/0/out']
+
+
+def add_job(scratch_dir, owner, state, size, hours_ago):
+    outdir = os.path.join(scratch_dir, str(uuid4()), u'out')
+    os.makedirs(outdir)
+    with open(os.path.join(outdir, u'out.txt'), 'wb') as output:
+        output.write(b'x' * size)
+
+    session = DB_SESSION()
+    job = Job(u'wf.cwl', u'{}', u'http://localhost/', owner)
+    jobid = job.id = uuid4()
+    job.state = state
+    job.start_time = datetime.utcnow() - timedelta(hours=hours_ago)
+    job.node = u'scratch-test'
+    job.outdir = outdir
+    job.output = {u'out': {
+        u'class': u'File', u'location': u'http://localhost/output/out',
+        u'path': os.path.join(outdir, u'out.txt'), u'basename': u'out.txt'}}
+    job.output_index = {u'out': job.output[u'out']}
+    session.add(job)
+    session.commit()
+    DB_SESSION.remove()
+    return jobid, outdir
+
+
+def test_collect(app_client):  # pylint: disable=redefined-outer-name
+    app, client = app_client
+    owner = u'hoarder-' + str(uuid4())
+    scratch_dir = tempfile.mkdtemp()
+    old, old_dir = add_job(scratch_dir, owner, State.Complete, 100, 2)
+    new, new_dir = add_job(scratch_dir, owner, State.Complete, 100, 1)
+    running, running_dir = add_job(scratch_dir, owner, State.Running, 100, 3)
+
+    collector = ScratchCollector(scratch_dir, u'scratch-test', owner_quota=150)
+    assert collector.collect() == [old_dir]
+    assert not os.path.exists(os.path.dirname(old_dir))
+    assert os.path.exists(new_dir)
+    assert os.path.exists(running_dir)
+    assert collector.collect() == []
+
+    token = user_token(app, owner)
+    if isinstance(token, bytes):
+        token = token.decode(u'utf-8')
+    headers = {u'Authorization': u'Bearer ' + token}
+    assert client.get(u'/jobs/{}/output/out'.format(old),
+                      headers=headers).status_code == 410
+    assert client.get(u'/jobs/{}/outputs.tar'.format(old),
+                      headers=headers).status_code == 410
+    assert client.get(u'/jobs/{}/output/out'.format(new),
+                      headers=headers).status_code == 200
+    assert Job.query.get(old).evicted
+    assert not Job.query.get(running).evicted
+    DB_SESSION.remove()
+
+
+def test_quota_counts_jobs_only(app_client):  # pylint: disable=redefined-outer-name
+    owner = u'sharer-' + str(uuid4())
+    scratch_dir = tempfile.mkdtemp()
+    _, old_dir = add_job(scratch_dir, owner, State.Complete, 100, 2)
+    _, new_dir = add_job(scratch_dir, owner, State.Complete, 100, 1)
+    # the scratch directory is shared with files that aren't the service's
+    with open(os.path.join(scratch_dir, u'unrelated'), 'wb') as unrelated:
+        unrelated.write(b'x' * 1000)
+    os.makedirs(os.path.join(scratch_dir, u'other', u'out'))
+
+    collector = ScratchCollector(scratch_dir, u'scratch-test', quota=150)
+    assert collector.collect() == [old_dir]
+    assert os.path.exists(new_dir)
+    assert collector.collect() == []
@@ -0,0 +1,31 @@
+"""
+Tests for the serialization of payloads
+"""
+from datetime import datetime
+import json
+from uuid import UUID
+
+import pytest
+
+from workflow_service.models import State
+from workflow_service.serialization import dumps
+
+
+def test_dumps():
+    jobid = UUID(u'12345678-1234-5678-1234-567812345678')
+    assert json.loads(dumps({
+        u'state': State.Complete,
+        u'id': jobid,
+        u'time': datetime(2018, 9, 1, 12, 30),
+        u'output': [1, None]
+    })) == {
+        u'state': u'Complete',
+        u'id': str(jobid),
+        u'time': u'2018-09-01T12:30:00',
+        u'output': [1, None]
+    }
+
+
+def test_unknown_types():
+    with pytest.raises(TypeError):
+        dumps({u'job': object()})
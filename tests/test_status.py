@@ -0,0 +1,158 @@
+"""
+Tests for conditional and long-polling status requests
+"""
+from threading import Thread
+from time import sleep, time
+
+from flask import g
+import pytest
+from sqlalchemy import inspect
+
+from workflow_service import decorators
+from workflow_service.database import DB_SESSION
+from workflow_service.events import JobEvents
+from workflow_service.models import Job, State
+
+from tests import app_client
+
+
+@pytest.fixture
+def finished_job(app_client):
+    _, client = app_client
+
+    session = DB_SESSION()
+    job = Job(u'wf.cwl', u'{}', u'http://localhost/')
+    job.state = State.Complete
+    session.add(job)
+    session.commit()
+    jobid = str(job.id)
+    DB_SESSION.remove()
+
+    return client, u'/jobs/' + jobid
+
+
+def test_etag(finished_job):
+    client, url = finished_job
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response.headers[u'ETag']
+
+    response = client.get(url, headers={u'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers[u'ETag'] == etag
+
+    response = client.get(url, headers={u'If-None-Match': u'"Running-0"'})
+    assert response.status_code == 200
+
+
+def test_etag_changes_with_every_update(finished_job):
+    client, url = finished_job
+    etag = client.get(url).headers[u'ETag']
+
+    # within the same second, and without a change of state
+    session = DB_SESSION()
+    session.query(Job).filter(Job.id == url.split(u'/')[-1]).update(
+        {Job.evicted: True}, synchronize_session=False)
+    session.commit()
+    DB_SESSION.remove()
+
+    response = client.get(url, headers={u'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers[u'ETag'] != etag
+
+
+def test_wait_returns_stale_clients_right_away(finished_job):
+    client, url = finished_job
+    start = time()
+    response = client.get(url + u'?wait=10',
+                          headers={u'If-None-Match': u'"Running-0"'})
+    assert response.status_code == 200
+    assert time() - start < 5
+
+
+def test_wait_times_out(finished_job):
+    client, url = finished_job
+    etag = client.get(url).headers[u'ETag']
+
+    response = client.get(url + u'?wait=0.2', headers={u'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_wait_answers_finished_jobs_right_away(finished_job):
+    client, url = finished_job
+    etag = client.get(url).headers[u'ETag']
+
+    start = time()
+    assert client.get(url + u'?wait=10').status_code == 200
+    response = client.get(url + u'?wait=10', headers={u'If-None-Match': etag})
+    assert response.status_code == 304
+    assert time() - start < 5
+
+
+def test_invalid_wait(finished_job):
+    client, url = finished_job
+    assert client.get(url + u'?wait=forever').status_code == 400
+
+
+@pytest.fixture
+def live_job(app_client):
+    _, client = app_client
+
+    session = DB_SESSION()
+    job = Job(u'wf.cwl', u'{}', u'http://localhost/')
+    job.state = State.Running
+    session.add(job)
+    session.commit()
+    jobid = str(job.id)
+    DB_SESSION.remove()
+
+    return client, u'/jobs/' + jobid
+
+
+def test_big_columns_are_deferred(app_client, monkeypatch):
+    app, client = app_client
+    session = DB_SESSION()
+    job = Job(u'wf.cwl', u'{"message": "hi"}', u'http://localhost/')
+    job.state = State.Complete
+    job.output = {u'out': u'hi'}
+    job.output_index = {u'out': u'hi'}
+    session.add(job)
+    session.commit()
+    jobid = job.id
+    DB_SESSION.remove()
+
+    monkeypatch.setattr(decorators, u'get_user', lambda: None)
+    unloaded = []
+
+    def view(jobid):  # pylint: disable=unused-argument
+        unloaded.append(inspect(g.job).unloaded & set(decorators.BLOB_COLUMNS))
+
+    with app.test_request_context():
+        decorators.user_owns_job(view)(jobid=jobid)
+        decorators.user_owns_job(load=(u'output',))(view)(jobid=jobid)
+    DB_SESSION.remove()
+    assert unloaded == [set(decorators.BLOB_COLUMNS),
+                        {u'input_json', u'output_index'}]
+
+    # the status still has them
+    status = client.get(u'/jobs/{}'.format(jobid)).get_json()
+    assert status[u'input'] == u'{"message": "hi"}'
+    assert status[u'output'] == {u'out': u'hi'}
+
+
+def test_wait_must_be_finite(live_job):
+    client, url = live_job
+    for wait in (u'nan', u'NaN', u'inf', u'-inf', u'-1'):
+        start = time()
+        assert client.get(url + u'?wait=' + wait).status_code == 400
+        assert time() - start < 5
+
+
+def test_events_wake_listeners():
+    events = JobEvents()
+    listener = events.listen(u'job')
+    Thread(target=lambda: sleep(0.05) or events.notify(u'job')).start()
+
+    assert listener.wait(5)
+    events.forget(u'job', listener)
+    events.notify(u'job')
@@ -0,0 +1,138 @@
+"""
+Tests for cwltool's step cache
+"""
+import os
+import tempfile
+from time import time
+
+from workflow_service import registry
+from workflow_service.database import DB_SESSION
+from workflow_service.models import Job, State, finished_job, update_jobs
+from workflow_service.step_cache import (
+    CacheEntry, CacheStats, StepCache, cache_stats, to_trim
+)
+
+from tests import app_client  # pylint: disable=unused-import
+
+LOG = b'''INFO Resolved 'wf.cwl' to 'file:///wf.cwl'
+INFO [workflow ] start
+INFO [job step1] Using cached output in /cache/1b2c
+INFO [job step2] Output of job will be cached in /cache/3d4e
+INFO [job step2] completed success
+INFO [job step3_2] Using cached output in /cache/5f60
+INFO Final process status is success
+'''
+
+
+def test_cache_stats():
+    handle, logname = tempfile.mkstemp()
+    os.write(handle, LOG)
+    os.close(handle)
+    assert cache_stats(logname) == CacheStats(
+        2, 1, [u'/cache/1b2c', u'/cache/3d4e', u'/cache/5f60'])
+    assert cache_stats(logname + u'.missing') == CacheStats(0, 0, [])
+
+
+def test_to_trim():
+    entries = [CacheEntry(u'/cache/a', 100, 10),
+               CacheEntry(u'/cache/b', 300, 10),
+               CacheEntry(u'/cache/c', 200, 10)]
+    assert to_trim(entries, 1000, max_bytes=30) == []
+    assert to_trim(entries, 1000, max_bytes=15) == [
+        u'/cache/a', u'/cache/c']
+    # the ones used recently are spared
+    assert to_trim(entries, 1000, max_bytes=15, min_age=850) == [
+        u'/cache/a']
+
+
+def add_entry(cachedir, name, size, age, pending=False):
+    path = os.path.join(cachedir, name)
+    os.makedirs(path)
+    with open(os.path.join(path, u'out.txt'), 'wb') as output:
+        output.write(b'x' * size)
+    if pending:
+        open(path + u'.140230.pending', 'w').close()
+        os.utime(path + u'.140230.pending', (time() - age, time() - age))
+    os.utime(path, (time() - age, time() - age))
+    return path
+
+
+def test_trim():
+    cachedir = tempfile.mkdtemp()
+    oldest = add_entry(cachedir, u'a', 100, 300)
+    stale = add_entry(cachedir, u'b', 100, 400, pending=True)
+    used = add_entry(cachedir, u'c', 100, 200)
+    newest = add_entry(cachedir, u'd', 100, 90)
+    # left behind by a step that failed
+    failed = add_entry(cachedir, u'e', 100, 500, pending=True)
+
+    cache = StepCache(cachedir, max_bytes=250, min_age=60)
+    # jobs hit it after the others were written
+    cache.touch([used, u'/elsewhere/c'])
+
+    assert sorted(cache.trim()) == [oldest, stale, failed]
+    assert sorted(os.listdir(cachedir)) == [u'c', u'd']
+    assert os.path.exists(used) and os.path.exists(newest)
+    assert cache.trim() == []
+
+    cache.max_bytes = 0
+    # the one used in the last minute is kept
+    assert cache.trim() == [newest]
+
+
+def test_trim_spares_live_jobs(app_client):  # pylint: disable=redefined-outer-name
+    cachedir = tempfile.mkdtemp()
+    hit = add_entry(cachedir, u'a', 100, 300)
+    written = add_entry(cachedir, u'b', 100, 300, pending=True)
+    unused = add_entry(cachedir, u'c', 100, 300)
+    handle, logname = tempfile.mkstemp()
+    os.write(handle, u'[job step1] Using cached output in {}\n'
+             u'[job step2] Output of job will be cached in {}\n'.format(
+                 hit, written).encode(u'utf-8'))
+    os.close(handle)
+
+    session = DB_SESSION()
+    job = Job(u'wf.cwl', u'{}', u'http://localhost/')
+    job.state = State.Running
+    job.step_cache = True
+    job.node = registry.NODE
+    job.logfile = logname
+    session.add(job)
+    session.commit()
+    jobid = job.id
+    DB_SESSION.remove()
+
+    cache = StepCache(cachedir, max_bytes=0, min_age=60, node=registry.NODE)
+    assert cache.trim() == [unused]
+
+    update_jobs([(jobid, {u'state': State.Complete})])
+    DB_SESSION.remove()
+    assert sorted(cache.trim()) == [hit, written]
+
+
+def test_status(app_client):  # pylint: disable=redefined-outer-name
+    _, client = app_client
+    session = DB_SESSION()
+    job = Job(u'wf.cwl', u'{}', u'http://localhost/')
+    job.step_cache = True
+    session.add(job)
+    session.commit()
+    jobid = job.id
+    DB_SESSION.remove()
+
+    url = u'/jobs/{}'.format(jobid)
+    assert u'step_cache' not in client.get(url).get_json()
+
+    update_jobs([(jobid, finished_job(State.Complete, {}, {}, None,
+                                      CacheStats(3, 1, [])))])
+    DB_SESSION.remove()
+    assert client.get(url).get_json()[u'step_cache'] == {
+        u'hits': 3, u'misses': 1, u'hit_rate': 0.75}
+
+
+def test_invalid_options(app_client):  # pylint: disable=redefined-outer-name
+    _, client = app_client
+    for option in (u'cache', u'parallel'):
+        response = client.post(u'/run?wf=wf.cwl&{}=maybe'.format(option),
+                               data=u'{}')
+        assert response.status_code == 400
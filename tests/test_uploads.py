@@ -0,0 +1,132 @@
+"""
+Tests for the input files uploaded along with the job order
+"""
+from io import BytesIO
+import json
+import os
+
+import pytest
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.test import EnvironBuilder
+
+from workflow_service import server
+from workflow_service.database import DB_SESSION
+from workflow_service.models import Job
+from workflow_service.uploads import Staging, staged_job_order
+
+from tests import app_client  # pylint: disable=unused-import
+
+
+def upload(client, data):
+    return client.post(u'/run?wf=wf.cwl', data=data,
+                       content_type=u'multipart/form-data')
+
+
+def job_order(response):
+    jobid = response.headers[u'Location'].rsplit(u'/', 1)[-1]
+    order = json.loads(Job.query.get(jobid).input_json)
+    DB_SESSION.remove()
+    return order
+
+
+def test_upload(app_client):  # pylint: disable=redefined-outer-name
+    _, client = app_client
+    response = upload(client, {
+        u'job_order': json.dumps({u'message': u'hi', u'reads': u'replaced'}),
+        u'reads': [(BytesIO(b'ACGT\n'), u'one.fa'),
+                   (BytesIO(b'TTGA\n'), u'../one.fa')],
+        u'reference': (BytesIO(b'GATTACA\n'), u'ref.fa')
+    })
+    assert response.status_code == 303
+
+    order = job_order(response)
+    assert order[u'message'] == u'hi'
+    reads = order[u'reads']
+    assert [read[u'basename'] for read in reads] == [u'one.fa', u'one_1.fa']
+    reference = order[u'reference']
+    assert reference[u'class'] == u'File'
+    assert reference[u'location'].startswith(u'file:///')
+
+    path = reference[u'location'][len(u'file://'):]
+    # in the job's directory
+    jobid = response.headers[u'Location'].rsplit(u'/', 1)[-1]
+    assert os.path.dirname(os.path.dirname(path)) == os.path.join(
+        server.SCRATCH_DIR, jobid)
+    with open(path, 'rb') as staged:
+        assert staged.read() == b'GATTACA\n'
+    assert sorted(os.listdir(os.path.dirname(path))) == [
+        u'one.fa', u'one_1.fa', u'ref.fa']
+
+
+def test_job_order_file(app_client):  # pylint: disable=redefined-outer-name
+    _, client = app_client
+    response = upload(client, {
+        u'job_order': (BytesIO(b'{"message": "hi"}'), u'order.json'),
+        u'reference': (BytesIO(b'GATTACA\n'), u'ref.fa')
+    })
+    assert response.status_code == 303
+    order = job_order(response)
+    assert order[u'message'] == u'hi'
+    assert u'order.json' not in os.listdir(os.path.dirname(
+        order[u'reference'][u'location'][len(u'file://'):]))
+
+
+def test_bad_uploads(app_client):  # pylint: disable=redefined-outer-name
+    _, client = app_client
+    before = set(os.listdir(server.SCRATCH_DIR))
+    for data in ({u'reference': (BytesIO(b'GATTACA\n'), u'ref.fa')},
+                 {u'job_order': u'["hi"]',
+                  u'reference': (BytesIO(b'GATTACA\n'), u'ref.fa')}):
+        assert upload(client, data).status_code == 400
+    # the files are gone along with the job's directory
+    assert set(os.listdir(server.SCRATCH_DIR)) == before
+
+
+def test_bad_options(app_client):  # pylint: disable=redefined-outer-name
+    _, client = app_client
+    before = set(os.listdir(server.SCRATCH_DIR))
+    response = client.post(u'/run?wf=wf.cwl&cache=maybe', data={
+        u'job_order': u'{}',
+        u'reference': (BytesIO(b'GATTACA\n'), u'ref.fa')
+    }, content_type=u'multipart/form-data')
+    assert response.status_code == 400
+    assert set(os.listdir(server.SCRATCH_DIR)) == before
+
+
+def test_upload_limit(app_client, monkeypatch):  # pylint: disable=redefined-outer-name
+    app, client = app_client
+    monkeypatch.setitem(app.config, u'MAX_UPLOAD_BYTES', 1024)
+    before = set(os.listdir(server.SCRATCH_DIR))
+    response = upload(client, {
+        u'job_order': u'{}',
+        u'reference': (BytesIO(b'x' * 2048), u'ref.fa')
+    })
+    assert response.status_code == 413
+    assert set(os.listdir(server.SCRATCH_DIR)) == before
+
+    monkeypatch.setitem(app.config, u'MAX_JOB_ORDER_BYTES', 8)
+    response = upload(client, {u'job_order': u'{"message": "too long"}'})
+    assert response.status_code == 413
+
+
+def test_unknown_length(tmpdir):
+    # chunked requests are only stopped by the bytes actually written
+    builder = EnvironBuilder(method=u'POST', data={
+        u'job_order': u'{}',
+        u'reference': (BytesIO(b'x' * 2048), u'ref.fa')})
+    environ = builder.get_environ()
+    del environ[u'CONTENT_LENGTH']
+    environ[u'wsgi.input_terminated'] = True
+    staging = Staging(str(tmpdir.join(u'job', u'inputs')), max_bytes=1024)
+    with pytest.raises(RequestEntityTooLarge):
+        staged_job_order(environ, staging)
+    assert not tmpdir.join(u'job').exists()
+
+
+def test_invalid_json_cause(tmpdir):
+    builder = EnvironBuilder(method=u'POST', data={u'job_order': u'{oops'})
+    staging = Staging(str(tmpdir.join(u'job', u'inputs')))
+    with pytest.raises(BadRequest) as raised:
+        staged_job_order(builder.get_environ(), staging)
+    # the parser's error is kept
+    assert isinstance(raised.value.__cause__, ValueError)
@@ -0,0 +1,88 @@
+"""
+Tests for the cache of packed workflows
+"""
+import os
+
+from workflow_service.workflow_cache import WorkflowCache
+
+URL = u'https://example.org/wf.cwl'
+
+
+class Documents(object):
+    # fake remote documents, counting how often they are fetched and packed
+    def __init__(self):
+        self.contents = {URL: b'class: Workflow'}
+        self.fetches = 0
+        self.packs = 0
+
+    def fetch(self, url):
+        self.fetches += 1
+        if url not in self.contents:
+            raise IOError(u'Not found: ' + url)
+        return self.contents[url]
+
+    def pack(self, url):
+        self.packs += 1
+        if url not in self.contents:
+            return None
+        return b'packed ' + self.contents[url]
+
+
+def cache_in(tmpdir, documents, **kwargs):
+    return WorkflowCache(str(tmpdir.join(u'cache')),
+                         pack=documents.pack, fetch=documents.fetch, **kwargs)
+
+
+def test_hit_within_ttl(tmpdir):
+    documents = Documents()
+    cache = cache_in(tmpdir, documents)
+
+    path = cache.get(URL)
+    assert cache.get(URL) == path
+    assert (documents.fetches, documents.packs) == (1, 1)
+    with open(path, 'rb') as packed:
+        assert packed.read() == b'packed class: Workflow'
+
+
+def test_unchanged_document_is_not_packed_again(tmpdir):
+    documents = Documents()
+    cache = cache_in(tmpdir, documents, ttl=0)
+
+    path = cache.get(URL)
+    assert cache.get(URL) == path
+    assert (documents.fetches, documents.packs) == (2, 1)
+
+
+def test_changed_document_is_packed_again(tmpdir):
+    documents = Documents()
+    cache = cache_in(tmpdir, documents, ttl=0)
+
+    path = cache.get(URL)
+    documents.contents[URL] = b'class: CommandLineTool'
+    assert cache.get(URL) != path
+    assert documents.packs == 2
+
+
+def test_uncacheable_workflows(tmpdir):
+    documents = Documents()
+    documents.contents[u'broken'] = b'not cwl'
+    documents.pack = lambda url: None
+    cache = cache_in(tmpdir, documents)
+
+    assert cache.get(u'broken') == u'broken'
+    assert cache.get(u'missing') == u'missing'
+
+
+def test_eviction(tmpdir):
+    documents = Documents()
+    cache = cache_in(tmpdir, documents, max_bytes=50)
+    paths = []
+    for number in range(3):
+        url = u'https://example.org/{}.cwl'.format(number)
+        documents.contents[url] = u'class: Workflow #{}'.format(number).encode()
+        paths.append(cache.get(url))
+        os.utime(paths[-1], (number, number))
+        assert os.path.basename(paths[-1]) == u'{}.cwl'.format(number)
+    cache.evict()
+
+    assert [os.path.exists(path) for path in paths] == [False, True, True]
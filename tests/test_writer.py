@@ -0,0 +1,78 @@
+"""
+Tests for the batched writer of job updates
+"""
+from threading import Event
+from uuid import uuid4
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from workflow_service.database import DB_SESSION
+from workflow_service.models import Job, State, finished_job
+from workflow_service.writer import JobWriter
+
+from tests import app_client  # pylint: disable=unused-import
+
+
+def test_updates_are_merged():
+    batches = []
+    writer = JobWriter(write=batches.append)
+    called = []
+    writer._thread = object()  # pylint: disable=protected-access
+    writer.update(1, {u'state': u'Running'}, then=lambda: called.append(1))
+    writer.update(2, {u'state': u'Error'})
+    writer.update(1, {u'state': u'Complete', u'output': {}},
+                  then=lambda: called.append(2))
+    writer.flush()
+
+    assert batches == [[(1, {u'state': u'Complete', u'output': {}}),
+                        (2, {u'state': u'Error'})]]
+    assert called == [1, 2]
+
+
+def test_batches_and_failures():
+    written = []
+
+    def write(updates):
+        if len(updates) > 1:
+            raise SQLAlchemyError(u'locked')
+        if updates[0][0] == 2:
+            raise SQLAlchemyError(u'bad')
+        written.extend(updates)
+
+    writer = JobWriter(max_batch=2, write=write)
+    writer._thread = object()  # pylint: disable=protected-access
+    called = []
+    for jobid in range(1, 4):
+        writer.update(jobid, {}, then=lambda jobid=jobid: called.append(jobid))
+    writer.flush()
+
+    assert [jobid for jobid, _ in written] == [1, 3]
+    assert called == [1, 2, 3]
+
+
+def test_writes_jobs(app_client):  # pylint: disable=redefined-outer-name,unused-argument
+    session = DB_SESSION()
+    jobs = [Job(u'wf.cwl', u'{}', u'http://localhost/') for _ in range(3)]
+    for job in jobs:
+        job.id = uuid4()
+        job.state = State.Running
+    jobids = [job.id for job in jobs]
+    session.add_all(jobs)
+    session.commit()
+    DB_SESSION.remove()
+
+    writer = JobWriter(delay=0)
+    written = Event()
+    for number, jobid in enumerate(jobids):
+        writer.update(jobid, finished_job(
+            State.Complete, {u'n': number}, {}, {u'wall_time': 1.0}))
+    writer.update(jobids[0], finished_job(State.Cancelled, {}),
+                  then=written.set)
+    assert written.wait(5)
+
+    states = [(job.state, job.output) for job in
+              (Job.query.get(jobid) for jobid in jobids)]
+    assert states == [(State.Cancelled, {}), (State.Complete, {u'n': 1}),
+                      (State.Complete, {u'n': 2})]
+    assert Job.query.get(jobids[0]).wall_time is None
+    DB_SESSION.remove()
@@ -1,4 +1,5 @@
 import logging
+import os
 
 from flask import Flask
 from flask_cors import CORS
@@ -7,9 +8,6 @@ from aap_client.flask.client import JWTClient
 from aap_client.crypto_files import load_public_from_x509
 from workflow_service.database import init_db_engine, init_db_models
 
-# jobid -> runner
-RUNNER_FOR = dict()
-
 
 def init_loggers(web_app):
     # flask is naughty and sets up default handlers
@@ -25,8 +23,16 @@ def init_loggers(web_app):
     web_app.logger.setLevel(logging.WARNING)
 
 
-def init_db(db_uri):
-    init_db_engine(db_uri)
+def init_db(db_uri, config=None):
+    config = config or {}
+    init_db_engine(
+        db_uri,
+        pool_size=config.get(u'SQLALCHEMY_POOL_SIZE', None),
+        max_overflow=config.get(u'SQLALCHEMY_MAX_OVERFLOW', None),
+        pool_pre_ping=config.get(u'SQLALCHEMY_POOL_PRE_PING', False),
+        pool_recycle=config.get(u'SQLALCHEMY_POOL_RECYCLE', -1),
+        pool_timeout=config.get(u'SQLALCHEMY_POOL_TIMEOUT', None),
+        busy_timeout=config.get(u'SQLITE_BUSY_TIMEOUT', 30))
     # import all db models before initialising the database
     # so they are registered properly on the metadata.
     from workflow_service import models  # pylint: disable=unused-variable
@@ -44,7 +50,7 @@ def configure_app(web_app, config):
 
     web_app.config.from_pyfile(config)
 
-    init_db(web_app.config[u'SQLALCHEMY_DATABASE_URI'])
+    init_db(web_app.config[u'SQLALCHEMY_DATABASE_URI'], web_app.config)
 
     # set up new url mapper to load uuids
     from workflow_service.decorators import UUIDConverter
@@ -54,7 +60,11 @@ def configure_app(web_app, config):
     web_app.config[u'JWT_PUBLIC_KEY'] = public_key
 
 
-def app(config='application.cfg'):
+def app(config=None):
+    # the config file is looked for in the instance folder, unless it's
+    # an absolute path
+    if config is None:
+        config = os.environ.get(u'WORKFLOW_SERVICE_CONFIG', u'application.cfg')
     web_app = Flask(__name__, instance_relative_config=True)
 
     init_loggers(web_app)
@@ -0,0 +1,152 @@
+"""
+Archives of the outputs of a job, streamed as they're read from disk.
+
+Neither the archive nor any of the files in it are ever held whole in
+memory or written anywhere, the archives are produced in chunks as the
+response is sent.
+Entries are named after the output ids used in the output URLs, followed
+by the name of the file, e.g. all-out/0/result.png
+"""
+import os
+import sys
+import tarfile
+import zipfile
+
+from future.utils import iteritems
+
+CHUNK_SIZE = 64 * 1024
+
+# zipfile can only write to unseekable streams from python 3.6 onwards
+ZIP_STREAMING = sys.version_info >= (3, 6)
+
+
+def archive_entries(output, prefix=u''):
+    """
+    Yields (arcname, path) for the files and directories in a cwltool output
+    object, secondary files included
+    """
+    if isinstance(output, list):
+        for index, item in enumerate(output):
+            for entry in archive_entries(item, prefix + str(index) + u'/'):
+                yield entry
+    elif isinstance(output, dict):
+        if u'path' in output and u'basename' in output:
+            yield prefix + output[u'basename'], output[u'path']
+            for secondary in output.get(u'secondaryFiles', []):
+                for entry in archive_entries(secondary, prefix):
+                    yield entry
+        elif u'location' not in output:
+            for key, value in iteritems(output):
+                for entry in archive_entries(value, prefix + key + u'/'):
+                    yield entry
+
+
+def walk(entries):
+    # expands the directories, yields (arcname, path) for them and all the
+    # files and directories they contain
+    for arcname, path in entries:
+        yield arcname, path
+        if not os.path.isdir(path):
+            continue
+        for root, dirs, files in os.walk(path):
+            relative = os.path.relpath(root, path)
+            base = arcname if relative == u'.' else u'/'.join(
+                [arcname] + relative.split(os.sep))
+            for name in sorted(dirs) + sorted(files):
+                yield base + u'/' + name, os.path.join(root, name)
+
+
+def read_chunks(path, size=None):
+    # yields the contents of the file at path, or its first size bytes
+    with open(path, 'rb') as handle:
+        while size is None or size > 0:
+            chunk = handle.read(
+                CHUNK_SIZE if size is None else min(CHUNK_SIZE, size))
+            if not chunk:
+                break
+            if size is not None:
+                size -= len(chunk)
+            yield chunk
+
+
+def tar_stream(entries):
+    """
+    Yields an uncompressed tar archive with the (arcname, path) entries
+    """
+    written = 0
+    for arcname, path in walk(entries):
+        stat = os.stat(path)
+        info = tarfile.TarInfo(arcname)
+        info.mtime = stat.st_mtime
+        info.mode = stat.st_mode & 0o7777
+        if os.path.isdir(path):
+            info.type = tarfile.DIRTYPE
+        else:
+            info.size = stat.st_size
+
+        header = info.tobuf(tarfile.PAX_FORMAT, u'utf-8', u'strict')
+        written += len(header)
+        yield header
+        if info.type == tarfile.DIRTYPE:
+            continue
+
+        sent = 0
+        for chunk in read_chunks(path, info.size):
+            sent += len(chunk)
+            yield chunk
+        # the size in the header has been promised already, files that
+        # shrank in the meantime are padded
+        padding = info.size - sent
+        _, remainder = divmod(info.size, tarfile.BLOCKSIZE)
+        if remainder:
+            padding += tarfile.BLOCKSIZE - remainder
+        if padding:
+            yield tarfile.NUL * padding
+        written += sent + padding
+
+    # end of archive: two empty blocks, then up to the end of the record
+    end = 2 * tarfile.BLOCKSIZE
+    _, remainder = divmod(written + end, tarfile.RECORDSIZE)
+    if remainder:
+        end += tarfile.RECORDSIZE - remainder
+    yield tarfile.NUL * end
+
+
+class _Spool(object):
+    # unseekable file that keeps what's written until it's drained
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_stream(entries):
+    """
+    Yields a zip archive with the (arcname, path) entries, stored without
+    compression. Needs python 3.6 or later, see ZIP_STREAMING
+    """
+    spool = _Spool()
+    archive = zipfile.ZipFile(spool, mode='w', compression=zipfile.ZIP_STORED,
+                              allowZip64=True)
+    for arcname, path in walk(entries):
+        info = zipfile.ZipInfo.from_file(path, arcname)
+        if info.is_dir():
+            archive.writestr(info, b'')
+        else:
+            with archive.open(info, 'w') as member:
+                for chunk in read_chunks(path):
+                    member.write(chunk)
+                    yield spool.drain()
+        yield spool.drain()
+    archive.close()
+    yield spool.drain()
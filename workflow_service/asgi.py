@@ -0,0 +1,427 @@
+"""
+ASGI front end, for serving many long-lived connections from one process.
+
+Following the log of a job and waiting for a job to change state, with
+?wait, tie up a thread of a WSGI server for as long as they last. Here
+they are coroutines woken up by the same log watcher and job events the
+Flask views use, so a single process can serve thousands of them.
+Every other request, and any of those that ends in an error, is handed to
+the Flask application in a thread pool, so they behave as they do under
+WSGI, authentication included.
+
+Runs on any ASGI server, e.g.
+
+    uvicorn workflow_service.asgi:APPLICATION
+
+It needs Python 3.5 or later.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from io import BufferedReader, BytesIO, RawIOBase
+import re
+import sys
+from time import time
+from uuid import UUID
+
+from future.moves.urllib.parse import parse_qsl, urlencode
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_accept_header, parse_etags
+from flask import g
+
+from aap_client.flask.decorators import jwt_optional
+
+from workflow_service import registry
+from workflow_service.database import DB_SESSION
+from workflow_service.decorators import user_owns_job
+from workflow_service.events import JOB_EVENTS, time_left, waits_for
+from workflow_service.log_store import is_compressed, open_log
+from workflow_service.log_streamer import (
+    CHUNK_SIZE, LIVENESS_INTERVAL, LOG_WATCHER, LogReader, sse_end, sse_event
+)
+from workflow_service.models import LIVE_STATES, current_etag
+from workflow_service.params import log_offset, wait_seconds
+from workflow_service.server import APP, LOG_STREAMS, start
+
+JOB_PATH = re.compile(u'^/jobs/(?P<jobid>[^/]+)/?$')
+LOG_PATH = re.compile(u'^/jobs/(?P<jobid>[^/]+)/log$')
+
+# chunks of a response produced ahead of the client
+QUEUED_CHUNKS = 8
+
+# runs the Flask application and the blocking calls of the coroutines
+EXECUTOR = ThreadPoolExecutor(APP.config.get(u'ASGI_THREADS', 32))
+
+
+async def APPLICATION(scope, receive, send):  # pylint: disable=invalid-name
+    """
+    ASGI 3 application
+    """
+    if scope[u'type'] == u'lifespan':
+        return await _lifespan(receive, send)
+    if scope[u'type'] != u'http':
+        raise ValueError(u'Unsupported connection: ' + scope[u'type'])
+
+    if scope[u'method'] == u'GET':
+        query = dict(parse_qsl(scope[u'query_string'].decode(u'latin-1')))
+        match = LOG_PATH.match(scope[u'path'])
+        if match:
+            return await _until_disconnected(
+                follow_log(scope, match.group(u'jobid'), query, send),
+                receive)
+        match = JOB_PATH.match(scope[u'path'])
+        if match and u'wait' in query:
+            return await _until_disconnected(
+                wait_for_job(scope, match.group(u'jobid'), query, send),
+                receive)
+    return await call_flask(scope, receive, send)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message[u'type'] == u'lifespan.startup':
+            await blocking(start)
+            await send({u'type': u'lifespan.startup.complete'})
+        elif message[u'type'] == u'lifespan.shutdown':
+            await send({u'type': u'lifespan.shutdown.complete'})
+            return
+
+
+async def _until_disconnected(coroutine, receive):
+    # runs the coroutine until it's done or the client goes away
+    task = asyncio.ensure_future(coroutine)
+    disconnected = asyncio.ensure_future(_disconnection(receive))
+    done, _ = await asyncio.wait([task, disconnected],
+                                 return_when=asyncio.FIRST_COMPLETED)
+    for future in (task, disconnected):
+        if future not in done:
+            future.cancel()
+    if task in done:
+        task.result()
+
+
+async def _disconnection(receive):
+    while True:
+        message = await receive()
+        if message[u'type'] == u'http.disconnect':
+            return
+
+
+def blocking(func, *args):
+    """
+    Runs func in the thread pool, with a database session of its own
+    """
+    def call():
+        try:
+            return func(*args)
+        finally:
+            DB_SESSION.remove()
+    return asyncio.get_event_loop().run_in_executor(EXECUTOR, call)
+
+
+def owned_job(scope, jobid):
+    """
+    Returns the job if the request is allowed to see it, None otherwise,
+    with the same checks the Flask views make
+    """
+    try:
+        jobid = UUID(jobid)
+    except ValueError:
+        return None
+
+    @jwt_optional
+    @user_owns_job
+    def load(jobid):  # pylint: disable=unused-argument
+        return g.job
+
+    with APP.request_context(wsgi_environ(scope, b'')):
+        try:
+            job = load(jobid=jobid)
+        except HTTPException:
+            return None
+        # detached, so it can be used once the session is removed. The
+        # query loaded every column but the BLOB_COLUMNS of
+        # workflow_service.decorators, none of which are used here
+        DB_SESSION().expunge(job)
+    return job
+
+
+async def follow_log(scope, jobid, query, send):
+    """
+    Streams the log of the job as server-sent events, like
+    server.get_log does
+    """
+    job = await blocking(owned_job, scope, jobid)
+    runner = registry.runner_for(job) if job and not job.evicted else None
+    if runner is None or _sends_compressed(scope, runner.logname):
+        # lets Flask answer with the error, or the compressed log
+        return await call_flask(scope, None, send)
+    try:
+        offset = await blocking(
+            log_offset, runner.logname,
+            query.get(u'offset', _header(scope, b'last-event-id') or u'0'),
+            query.get(u'tail', None))
+    except ValueError:
+        return await call_flask(scope, None, send)
+
+    await send({u'type': u'http.response.start', u'status': 200,
+                u'headers': [(b'content-type',
+                              b'text/event-stream; charset=utf-8'),
+                             (b'cache-control', b'no-cache'),
+                             (b'vary', b'Accept-Encoding')]})
+    LOG_STREAMS.inc()
+    try:
+        offset = await _stream_log(runner, offset, send)
+    except IOError:
+        pass
+    finally:
+        LOG_STREAMS.dec()
+    await send({u'type': u'http.response.body',
+                u'body': sse_end(offset).encode(u'utf-8')})
+
+
+def _sends_compressed(scope, logname):
+    # finished logs go through Flask, which compresses them for the
+    # clients accepting it
+    return is_compressed(logname) and u'gzip' in parse_accept_header(
+        _header(scope, b'accept-encoding'))
+
+
+async def _stream_log(runner, offset, send):
+    # the coroutine version of LogWatcher.follow, returns the final offset
+    loop = asyncio.get_event_loop()
+    changed = asyncio.Event()
+
+    def wake():
+        loop.call_soon_threadsafe(changed.set)
+
+    feed = LOG_WATCHER.watch(runner.logname, wake)
+    try:
+        with open_log(runner.logname) as logfile:
+            reader = LogReader(logfile, offset)
+            live = True
+            while True:
+                changed.clear()
+                chunk = reader.read()
+                if chunk:
+                    await _send_body(send, sse_event(*chunk))
+                    continue
+
+                if not live:
+                    break
+                live = await blocking(runner.is_live)
+                if live:
+                    try:
+                        await asyncio.wait_for(changed.wait(),
+                                               LIVENESS_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+
+            chunk = reader.rest()
+            if chunk:
+                await _send_body(send, sse_event(*chunk))
+            return reader.offset
+    finally:
+        LOG_WATCHER.unwatch(feed, wake)
+
+
+async def _send_body(send, text):
+    await send({u'type': u'http.response.body',
+                u'body': text.encode(u'utf-8'), u'more_body': True})
+
+
+async def wait_for_job(scope, jobid, query, send):
+    """
+    Holds the request until the job changes state, like
+    server.job_control does with ?wait, and then lets Flask answer it
+    """
+    try:
+        wait = wait_seconds(query[u'wait'],
+                            APP.config.get(u'MAX_STATUS_WAIT', 60))
+    except ValueError:
+        # lets Flask answer with the error
+        return await call_flask(scope, None, send)
+
+    job = await blocking(owned_job, scope, jobid)
+    if job is not None and job.state in LIVE_STATES:
+        etag = await blocking(current_etag, job.id)
+        if waits_for(parse_etags(_header(scope, b'if-none-match')), etag):
+            await _job_changed(job, etag, wait)
+
+    # the answer is the same as without waiting
+    query = [(name, value) for name, value in parse_qsl(
+        scope[u'query_string'].decode(u'latin-1')) if name != u'wait']
+    scope = dict(scope, query_string=urlencode(query).encode(u'latin-1'))
+    return await call_flask(scope, None, send)
+
+
+async def _job_changed(job, etag, timeout):
+    # waits until the ETag of the job is not etag anymore, or timeout
+    # seconds pass
+    loop = asyncio.get_event_loop()
+    changed = asyncio.Event()
+
+    class Listener(object):  # pylint: disable=too-few-public-methods
+        @staticmethod
+        def set():
+            loop.call_soon_threadsafe(changed.set)
+
+    listener = Listener()
+    deadline = time() + timeout
+    JOB_EVENTS.listen(job.id, listener)
+    try:
+        while True:
+            changed.clear()
+            current = await blocking(current_etag, job.id)
+            remaining = time_left(etag, current, deadline)
+            if not remaining:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        JOB_EVENTS.forget(job.id, listener)
+
+
+def _header(scope, name):
+    for key, value in scope[u'headers']:
+        if key.lower() == name:
+            return value.decode(u'latin-1')
+    return None
+
+
+async def call_flask(scope, receive, send):
+    """
+    Serves the request with the Flask application, in the thread pool.
+    The whole response is produced by the same thread, the Flask request
+    context of streamed responses lives in it. The body is read as the
+    application asks for it, it's never held in memory as a whole
+    """
+    loop = asyncio.get_event_loop()
+    body = BufferedReader(RequestBody(receive, loop), CHUNK_SIZE)
+    chunks = asyncio.Queue(QUEUED_CHUNKS)
+    response = dict()
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info:
+            raise exc_info[1].with_traceback(exc_info[2])
+        response[u'status'] = int(status.split(u' ', 1)[0])
+        response[u'headers'] = [(name.lower().encode(u'latin-1'),
+                                 value.encode(u'latin-1'))
+                                for name, value in headers]
+
+    def put(chunk):
+        # waits while the client is behind
+        asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop).result()
+
+    def produce():
+        try:
+            result = APP.wsgi_app(wsgi_environ(scope, body), start_response)
+            try:
+                for chunk in result:
+                    if chunk:
+                        put(chunk)
+            finally:
+                if hasattr(result, u'close'):
+                    result.close()
+        finally:
+            put(None)
+
+    producing = blocking(produce)
+    finished = False
+    try:
+        chunk = await chunks.get()
+        finished = chunk is None
+        if not response:
+            # the application failed before starting the response
+            await producing
+        await send({u'type': u'http.response.start',
+                    u'status': response[u'status'],
+                    u'headers': response[u'headers']})
+        while chunk is not None:
+            await send({u'type': u'http.response.body', u'body': chunk,
+                        u'more_body': True})
+            chunk = await chunks.get()
+            finished = chunk is None
+        await send({u'type': u'http.response.body'})
+    finally:
+        if not finished:
+            # lets the thread run to the end
+            asyncio.ensure_future(_drain(chunks))
+    await producing
+
+
+class RequestBody(RawIOBase):
+    """
+    The body of an ASGI request as a blocking stream, for the thread
+    serving it. Reading waits for the client to send more
+    """
+    def __init__(self, receive, loop):
+        super(RequestBody, self).__init__()
+        self._receive = receive
+        self._loop = loop
+        self._chunk = memoryview(b'')
+        self._more = receive is not None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk and self._more:
+            message = asyncio.run_coroutine_threadsafe(
+                self._next_message(), self._loop).result()
+            self._chunk = memoryview(message.get(u'body', b''))
+            self._more = message[u'type'] == u'http.request' and \
+                message.get(u'more_body', False)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    async def _next_message(self):
+        return await self._receive()
+
+
+async def _drain(chunks):
+    while await chunks.get() is not None:
+        pass
+
+
+def wsgi_environ(scope, body):
+    """
+    Returns the WSGI environment of the ASGI request, body is either bytes
+    or a stream with them
+    """
+    server = scope.get(u'server', None) or (u'localhost', 80)
+    client = scope.get(u'client', None) or (u'', 0)
+    environ = {
+        u'REQUEST_METHOD': scope[u'method'],
+        u'SCRIPT_NAME': scope.get(u'root_path', u'').encode(
+            u'utf-8').decode(u'latin-1'),
+        u'PATH_INFO': scope[u'path'].encode(u'utf-8').decode(u'latin-1'),
+        u'QUERY_STRING': scope[u'query_string'].decode(u'latin-1'),
+        u'SERVER_NAME': server[0],
+        u'SERVER_PORT': str(server[1]),
+        u'SERVER_PROTOCOL': u'HTTP/' + scope.get(u'http_version', u'1.1'),
+        u'REMOTE_ADDR': client[0],
+        u'wsgi.version': (1, 0),
+        u'wsgi.url_scheme': scope.get(u'scheme', u'http'),
+        u'wsgi.input': BytesIO(body) if isinstance(body, bytes) else body,
+        # the body ends where the client's does, even when it's chunked
+        u'wsgi.input_terminated': True,
+        u'wsgi.errors': sys.stderr,
+        u'wsgi.multithread': True,
+        u'wsgi.multiprocess': True,
+        u'wsgi.run_once': False,
+    }
+    for name, value in scope[u'headers']:
+        name = name.decode(u'latin-1').upper().replace(u'-', u'_')
+        value = value.decode(u'latin-1')
+        if name in (u'CONTENT_TYPE', u'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        key = u'HTTP_' + name
+        environ[key] = value if key not in environ else (
+            environ[key] + u',' + value)
+    return environ
@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker
 
@@ -6,10 +7,33 @@ ENGINE = None
 DB_SESSION = None
 BASE = None
 
+
 # pylint: disable=global-statement
-def init_db_engine(db_uri):
+def init_db_engine(db_uri, pool_size=None, max_overflow=None,
+                   pool_pre_ping=False, pool_recycle=-1, pool_timeout=None,
+                   busy_timeout=30):
+    """
+    The pool settings are those of create_engine, the ones left as None
+    keep SQLAlchemy's defaults. SQLite databases, which don't use a pool
+    of connections, are switched to write-ahead logging instead, and
+    wait up to busy_timeout seconds for the lock of another writer.
+    """
+    options = dict(convert_unicode=True, echo=False,
+                   pool_pre_ping=pool_pre_ping, pool_recycle=pool_recycle)
+    url = make_url(db_uri)
+    sqlite = url.get_backend_name() == u'sqlite'
+    if not sqlite:
+        for name, value in ((u'pool_size', pool_size),
+                            (u'max_overflow', max_overflow),
+                            (u'pool_timeout', pool_timeout)):
+            if value is not None:
+                options[name] = value
+
     global ENGINE
-    ENGINE = create_engine(db_uri, convert_unicode=True, echo=False)
+    ENGINE = create_engine(db_uri, **options)
+    if sqlite:
+        tune_sqlite(ENGINE, in_memory=url.database in (None, u'', u':memory:'),
+                    busy_timeout=busy_timeout)
 
     global DB_SESSION
     DB_SESSION = scoped_session(sessionmaker(bind=ENGINE))
@@ -18,5 +42,21 @@ def init_db_engine(db_uri):
     BASE = declarative_base()
     BASE.query = DB_SESSION.query_property()
 
+
+def tune_sqlite(engine, in_memory=False, busy_timeout=30):
+    # readers don't block the writer, nor the writer the readers, with WAL
+    @event.listens_for(engine, u'connect')
+    def on_connect(connection, _):  # pylint: disable=unused-variable
+        cursor = connection.cursor()
+        if not in_memory:
+            cursor.execute(u'PRAGMA journal_mode=WAL')
+            cursor.execute(u'PRAGMA synchronous=NORMAL')
+        cursor.execute(u'PRAGMA busy_timeout={:d}'.format(
+            int(busy_timeout * 1000)))
+        cursor.close()
+
+
 def init_db_models():
-    BASE.metadata.create_all(bind=ENGINE)
+    # creates the tables of new databases and upgrades the existing ones
+    from workflow_service.migrations import upgrade
+    upgrade(ENGINE, BASE.metadata)
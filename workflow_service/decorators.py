@@ -1,18 +1,28 @@
-from functools import wraps
+from functools import partial, wraps
 from uuid import UUID
 
 from werkzeug.routing import BaseConverter
-from flask import abort
+from flask import abort, g
 from aap_client.flask.decorators import get_user
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import defer
 
 from workflow_service.database import DB_SESSION
 from workflow_service.models import Job
 
 
-def user_owns_job(func):
+# the JSON columns that can be big, left out when loading single jobs
+BLOB_COLUMNS = (u'input_json', u'output', u'output_index')
+
+
+def user_owns_job(func=None, load=()):
     # decorator that checks if user owns the job
     # intended to be used always wrapped by @jwt_optional/jwt_required
+    # the job is loaded by the same query and left in flask.g.job, without
+    # the BLOB_COLUMNS that aren't in load, see load_deferred
+    if func is None:
+        return partial(user_owns_job, load=load)
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         current_user = get_user()
@@ -24,7 +34,10 @@ def user_owns_job(func):
         try:
             session = DB_SESSION()
 
-            job = session.query(Job).filter(
+            job = session.query(Job).options(*[
+                defer(column) for column in BLOB_COLUMNS
+                if column not in load
+            ]).filter(
                 Job.id == jobid,
                 (Job.owner == current_user) |
                 (Job.owner == None)
@@ -35,11 +48,18 @@ def user_owns_job(func):
         if not job:
             return abort(404)
 
+        g.job = job
         return func(*args, **kwargs)
 
     return wrapper
 
 
+def load_deferred(job, *columns):
+    # loads the columns left out by user_owns_job in a single query,
+    # instead of one for each as they're accessed
+    DB_SESSION().refresh(job, attribute_names=columns)
+
+
 class UUIDConverter(BaseConverter):
     def to_python(self, value):
         try:
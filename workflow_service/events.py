@@ -0,0 +1,69 @@
+"""
+Lets requests wait for changes in the jobs run by this process, without
+polling the database.
+"""
+from threading import Event, Lock
+from time import time
+
+
+class JobEvents(object):
+    """
+    Listeners have to be registered before checking the job, so changes
+    that happen between the check and the wait are not missed:
+
+        event = JOB_EVENTS.listen(jobid)
+        try:
+            # check the job, then
+            event.wait(timeout)
+        finally:
+            JOB_EVENTS.forget(jobid, event)
+    """
+    def __init__(self):
+        self._lock = Lock()
+        # jobid -> set of events
+        self._listeners = dict()
+
+    def listen(self, jobid, event=None):
+        # event can be anything with a set() method, a threading.Event by
+        # default
+        if event is None:
+            event = Event()
+        with self._lock:
+            self._listeners.setdefault(jobid, set()).add(event)
+        return event
+
+    def forget(self, jobid, event):
+        with self._lock:
+            listeners = self._listeners.get(jobid, set())
+            listeners.discard(event)
+            if not listeners:
+                self._listeners.pop(jobid, None)
+
+    def notify(self, jobid):
+        with self._lock:
+            listeners = list(self._listeners.get(jobid, ()))
+        for event in listeners:
+            event.set()
+
+
+def waits_for(if_none_match, etag):
+    """
+    Returns whether a request with ?wait= is held, given its If-None-Match
+    header: clients sending one wait for an ETag other than the ones they
+    have, the rest for any change
+    """
+    return not if_none_match or if_none_match.contains(etag)
+
+
+def time_left(etag, current, deadline):
+    """
+    Returns the seconds a request waiting for the ETag of a job to change
+    from etag has left to wait, now that it's current, 0 once it has
+    changed or the deadline has passed
+    """
+    if current != etag:
+        return 0
+    return max(deadline - time(), 0)
+
+
+JOB_EVENTS = JobEvents()
@@ -0,0 +1,143 @@
+from collections import deque
+from itertools import count
+from threading import Lock
+
+from workflow_service.models import State
+
+# stands for no owner at all, None is the owner of anonymous jobs
+_NOBODY = object()
+
+
+class JobExecutor(object):
+    """
+    Bounds the number of cwltool processes that run at the same time, and
+    shares them fairly between owners.
+
+    Submitted runners wait in their owner's FIFO queue, in the Queued state,
+    until one of the running jobs finishes and frees a slot. Slots are
+    handed to the owners in turns, the owner that had its last turn the
+    longest ago goes first, owners that never had one before the rest.
+    An owner with weight n gets n runners started per turn, and owners at
+    their limit of running jobs are skipped.
+    Anonymous jobs, owned by None, share a queue of their own.
+    The queues live in memory, they are mirrored by the Queued rows in the
+    jobs table, which the reconciler queues again when the server starts.
+
+    Args:
+        max_running: maximum number of runners that may be running at once.
+        max_per_owner: maximum number of runners of any single owner that
+                       may be running at once, None for no limit.
+        owner_limits: owner -> maximum running runners, overriding
+                      max_per_owner.
+        owner_weights: owner -> runners started per turn, 1 by default.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, max_running, max_per_owner=None, owner_limits=None,
+                 owner_weights=None):
+        if max_running < 1:
+            raise ValueError(u'max_running must be at least 1')
+        if max_per_owner is not None and max_per_owner < 1:
+            raise ValueError(u'max_per_owner must be at least 1')
+        self.max_running = max_running
+        self.max_per_owner = max_per_owner
+        self.owner_limits = dict(owner_limits or {})
+        self.owner_weights = dict(owner_weights or {})
+
+        # owner -> deque of runners
+        self._pending = dict()
+        # owner -> (number of its last turn, 0) or, for the owners that
+        # never had one, (-1, order of arrival)
+        self._last_turn = dict()
+        self._turns = count(1)
+        self._arrivals = count()
+        # owner in its turn, and runners it started in it
+        self._current = _NOBODY
+        self._started_in_turn = 0
+        self._running = set()
+        # owner -> number of running runners
+        self._running_by_owner = dict()
+        # runner -> owner
+        self._owners = dict()
+        self._lock = Lock()
+
+    def submit(self, runner, owner=None):
+        self.submit_all([runner], owner)
+
+    def submit_all(self, runners, owner=None):
+        # queues the runners one after the other, in a single go
+        if not runners:
+            return
+        for runner in runners:
+            runner.add_done_callback(self._release)
+        with self._lock:
+            for runner in runners:
+                self._owners[runner] = owner
+            if owner not in self._last_turn:
+                self._last_turn[owner] = (-1, next(self._arrivals))
+            self._pending.setdefault(owner, deque()).extend(runners)
+            self._dispatch()
+
+    def queued(self):
+        """
+        Returns the runners waiting to start, in the order of their owner's
+        queues
+        """
+        with self._lock:
+            return [runner for queue in self._pending.values()
+                    for runner in queue if runner.state == State.Queued]
+
+    def running(self):
+        with self._lock:
+            return list(self._running)
+
+    def limit(self, owner):
+        return self.owner_limits.get(owner, self.max_per_owner)
+
+    def _release(self, runner):
+        with self._lock:
+            if runner in self._running:
+                self._running.discard(runner)
+                owner = self._owners[runner]
+                self._running_by_owner[owner] -= 1
+                if not self._running_by_owner[owner]:
+                    del self._running_by_owner[owner]
+            self._owners.pop(runner, None)
+            self._dispatch()
+
+    def _dispatch(self):
+        # must be called while holding self._lock
+        while self._pending and len(self._running) < self.max_running:
+            owner = self._next_owner()
+            if owner is _NOBODY:
+                # the owners with pending runners are all at their limit
+                return
+            runner = self._pending[owner].popleft()
+            if not self._pending[owner]:
+                del self._pending[owner]
+            self._running.add(runner)
+            self._running_by_owner[owner] = (
+                self._running_by_owner.get(owner, 0) + 1)
+            self._started_in_turn += 1
+            runner.start()
+
+    def _next_owner(self):
+        # returns the owner of the next runner to start, _NOBODY if none
+        # of the owners with pending runners can start one
+        current = self._current
+        if (current is not _NOBODY and current in self._pending and
+                self._can_start(current) and
+                self._started_in_turn < self.owner_weights.get(current, 1)):
+            return current
+
+        owners = [owner for owner in self._pending if self._can_start(owner)]
+        if not owners:
+            return _NOBODY
+        owner = min(owners, key=self._last_turn.get)
+        self._last_turn[owner] = (next(self._turns), 0)
+        self._current = owner
+        self._started_in_turn = 0
+        return owner
+
+    def _can_start(self, owner):
+        limit = self.limit(owner)
+        return limit is None or self._running_by_owner.get(owner, 0) < limit
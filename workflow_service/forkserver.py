@@ -0,0 +1,287 @@
+"""
+Runs cwltool in processes forked from a server that has already imported
+it, so jobs don't pay for starting the interpreter and importing cwltool,
+schema-salad and ruamel every time.
+
+The fork server is a separate process, started with
+`python -m workflow_service.forkserver`, that reads requests as JSON lines
+from its stdin and answers through its stdout:
+
+    {"id": 1, "args": [...], "cwd": ..., "stdin": ..., "stdout": ...,
+     "stderr": ...}  ->  {"id": 1, "pid": 1234}
+
+and, once the process 1234 exits,
+
+    {"pid": 1234, "returncode": 0}
+
+Each job runs cwltool's main() in its own forked process, from its own
+working directory and with its standard streams redirected to files.
+"""
+import json
+import os
+from select import select
+from signal import SIG_DFL, SIGKILL, SIGQUIT, SIGTSTP, SIGCONT, SIGINT, signal
+from subprocess import Popen, PIPE
+from sys import prefix
+import sys
+from threading import Event, Lock, Thread
+from time import sleep
+
+from workflow_service.processes import is_running
+
+# seconds between checks for finished jobs in the fork server
+REAP_INTERVAL = 0.2
+# seconds a request waits for the fork server to start a job
+SPAWN_TIMEOUT = 60
+# seconds between checks of the jobs of a fork server that died
+LOST_INTERVAL = 1
+
+
+class ForkedProcess(object):
+    """
+    Job forked by the fork server, it quacks enough like a Popen to be
+    used by a JobRunner
+    """
+    def __init__(self, pid, cwd=None):
+        self.pid = pid
+        # tells the process apart from a later one with its pid, see lost
+        self.cwd = cwd
+        self.returncode = None
+        # see usage_of
+        self.rusage = None
+        self._exited = Event()
+
+    def send_signal(self, signum):
+        if self.returncode is None:
+            os.kill(self.pid, signum)
+
+    def wait(self):
+        self._exited.wait()
+        return self.returncode
+
+    def exited(self, returncode, rusage=None):
+        self.returncode = returncode
+        self.rusage = rusage
+        self._exited.set()
+
+    def lost(self):
+        """
+        The fork server is gone, and with it the way of knowing how the
+        process ends. It's watched until it no longer runs in its working
+        directory, and then exits with None as returncode: its results are
+        whatever it left on disk
+        """
+        watcher = Thread(target=self._watch)
+        watcher.daemon = True
+        watcher.start()
+
+    def _watch(self):
+        while is_running(self.pid, self.cwd):
+            sleep(LOST_INTERVAL)
+        self.exited(None)
+
+
+class ForkServer(object):
+    """
+    Client of the fork server, which is started on the first spawn and
+    again if it ever dies
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._proc = None
+        self._next_id = 0
+        # request id -> [event, ForkedProcess, working directory]
+        self._requests = dict()
+        # pid -> ForkedProcess
+        self._processes = dict()
+
+    def spawn(self, args, cwd, stdin, stdout, stderr):
+        """
+        Runs cwltool with args in a new process, with cwd as working
+        directory and its standard streams redirected to the files in
+        stdin, stdout and stderr.
+        Returns a ForkedProcess, raises OSError if the job couldn't be
+        started.
+        """
+        request = {
+            u'args': args,
+            u'cwd': cwd,
+            u'stdin': stdin,
+            u'stdout': stdout,
+            u'stderr': stderr
+        }
+        started = Event()
+        with self._lock:
+            if self._proc is None or self._proc.poll() is not None:
+                self._start()
+            self._next_id += 1
+            request[u'id'] = self._next_id
+            self._requests[self._next_id] = [started, None, cwd]
+            try:
+                self._proc.stdin.write(
+                    (json.dumps(request) + u'\n').encode(u'utf-8'))
+                self._proc.stdin.flush()
+            except (IOError, OSError):
+                self._requests.pop(request[u'id'], None)
+                raise
+
+        started.wait(SPAWN_TIMEOUT)
+        with self._lock:
+            _, process, _ = self._requests.pop(request[u'id'],
+                                               (None, None, None))
+        if process is None:
+            raise OSError(u'The fork server could not start the job')
+        return process
+
+    def _start(self):
+        # must be called while holding self._lock
+        self._proc = Popen(
+            [prefix + u'/bin/python', u'-m', u'workflow_service.forkserver'],
+            stdin=PIPE, stdout=PIPE, close_fds=True)
+        reader = Thread(target=self._read, args=(self._proc,))
+        reader.daemon = True
+        reader.start()
+
+    def _read(self, proc):
+        for line in iter(proc.stdout.readline, b''):
+            message = json.loads(line.decode(u'utf-8'))
+            with self._lock:
+                if u'id' in message:
+                    request = self._requests.get(message[u'id'], None)
+                    if request is None:
+                        # started after spawn gave up on it, the job was
+                        # already failed
+                        _abandon(message[u'pid'])
+                        continue
+                    process = ForkedProcess(message[u'pid'], request[2])
+                    self._processes[process.pid] = process
+                    request[1] = process
+                    request[0].set()
+                    continue
+                process = self._processes.pop(message[u'pid'], None)
+            if process is not None:
+                process.exited(message[u'returncode'],
+                               message.get(u'rusage', None))
+
+        # the fork server is gone, the jobs it started carry on without it
+        with self._lock:
+            processes = list(self._processes.values())
+            self._processes.clear()
+            for request in self._requests.values():
+                request[0].set()
+        for process in processes:
+            process.lost()
+
+
+def _abandon(pid):
+    # kills a job nobody waits for, with the processes it started, which
+    # share its session unless it didn't get to start one
+    try:
+        os.killpg(pid, SIGKILL)
+    except OSError:
+        try:
+            os.kill(pid, SIGKILL)
+        except OSError:
+            pass
+
+
+def exit_returncode(status):
+    """
+    Returns the status of a waited process as a Popen returncode
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def usage_of(rusage):
+    """
+    Returns the resources used by a process waited with wait4, in the
+    columns the jobs keep them. Memory is in kilobytes, and I/O in blocks
+    of 512 bytes
+    """
+    return {
+        u'cpu_user': rusage.ru_utime,
+        u'cpu_system': rusage.ru_stime,
+        u'max_rss': rusage.ru_maxrss,
+        u'blocks_in': rusage.ru_inblock,
+        u'blocks_out': rusage.ru_oublock
+    }
+
+
+def _reply(message):
+    os.write(1, (json.dumps(message) + u'\n').encode(u'utf-8'))
+
+
+def _run_job(request):
+    # runs in the forked process, it never returns
+    returncode = 1
+    try:
+        for signum in (SIGQUIT, SIGTSTP, SIGCONT, SIGINT):
+            signal(signum, SIG_DFL)
+        # carries on if the server goes away, like the jobs it starts itself
+        os.setsid()
+        os.chdir(request[u'cwd'])
+        for fd, path, flags in (
+                (0, request[u'stdin'], os.O_RDONLY),
+                (1, request[u'stdout'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC),
+                (2, request[u'stderr'], os.O_WRONLY | os.O_APPEND)):
+            handle = os.open(path, flags, 0o600)
+            os.dup2(handle, fd)
+            os.close(handle)
+
+        import cwltool.main
+        # cwltool names itself after argv[0] in its logs
+        sys.argv = [u'cwltool'] + request[u'args']
+        returncode = cwltool.main.main(argsl=request[u'args'])
+    except BaseException:  # pylint: disable=broad-except
+        import traceback
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(returncode)  # pylint: disable=protected-access
+
+
+def _reap():
+    while True:
+        try:
+            pid, status, rusage = os.wait4(-1, os.WNOHANG)
+        except OSError:
+            return
+        if pid == 0:
+            return
+        _reply({u'pid': pid, u'returncode': exit_returncode(status),
+                u'rusage': usage_of(rusage)})
+
+
+def serve():
+    # pylint: disable=unused-variable
+    import cwltool.main  # noqa: F401, the reason this process exists
+
+    pending = b''
+    while True:
+        ready, _, _ = select([0], [], [], REAP_INTERVAL)
+        if ready:
+            data = os.read(0, 64 * 1024)
+            if not data:
+                # the server is gone, the running jobs are left to finish
+                return
+            pending += data
+            while b'\n' in pending:
+                line, pending = pending.split(b'\n', 1)
+                request = json.loads(line.decode(u'utf-8'))
+                pid = os.fork()
+                if pid == 0:
+                    _run_job(request)
+                _reply({u'id': request[u'id'], u'pid': pid})
+        _reap()
+
+
+FORK_SERVER = ForkServer()
+
+
+if __name__ == u'__main__':
+    serve()
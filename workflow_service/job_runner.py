@@ -1,15 +1,65 @@
 from sys import prefix
 import os
 from signal import SIGQUIT, SIGTSTP, SIGCONT
-from subprocess import Popen, PIPE
+from subprocess import Popen
 import tempfile
-from threading import Thread, Lock
-from time import sleep
+from threading import Thread, RLock
+from time import time
 
 import yaml
 
+from workflow_service.forkserver import FORK_SERVER, exit_returncode, usage_of
+from workflow_service.log_streamer import LOG_WATCHER
 from workflow_service.models import State
 
+# cwltool logs it right before writing the output object
+SUCCESS = b'Final process status is success'
+# bytes at the end of the log searched for it
+LOG_TAIL = 64 * 1024
+
+
+def resource_usage(rusage, wall_time):
+    """
+    Returns the resources used by a cwltool process, and the processes it
+    waited for, as kept in the Job columns. rusage is what
+    forkserver.usage_of returned for the process, if anything
+    """
+    usage = {u'wall_time': wall_time}
+    if rusage:
+        usage.update(rusage)
+    return usage
+
+
+def output_file(outdir):
+    """
+    Returns where the cwltool process writing to outdir writes its output
+    object, it's kept in a file so it outlives the server process
+    """
+    return os.path.join(os.path.split(outdir)[0], u'output.json')
+
+
+def read_output(path):
+    # returns the output object cwltool left at path, None if there's none
+    try:
+        with open(path, 'rb') as output:
+            return yaml.safe_load(output)
+    except (IOError, yaml.YAMLError):
+        return None
+
+
+def succeeded(logname):
+    """
+    Returns whether the log of a cwltool process says it succeeded, for
+    the processes that can't be waited for to get their exit status
+    """
+    try:
+        with open(logname, 'rb') as log:
+            log.seek(0, os.SEEK_END)
+            log.seek(max(log.tell() - LOG_TAIL, 0))
+            return SUCCESS in log.read()
+    except (IOError, OSError):
+        return False
+
 
 def makedirs(path):
     try:
@@ -22,92 +72,248 @@ def makedirs(path):
 class JobRunner(Thread):  # pylint: disable=R0902
     # pylint: disable=R0913
     """
+    Runners are created in the Queued state, the cwltool process is only
+    launched once the thread is started, usually by a JobExecutor.
+
     Args:
-        onsuccess: action that is performed when any job finishes
-                   successfully. Its signature must be in the form of
-                   f(JobRunner) -> None
-        onfailure: action that is performed when any job fails.
-                   Its signature must be in the form of
-                   f(JobRunner) -> None
+        onfinishing: action that is performed when the job finishes,
+                     whether it succeeded, failed or was cancelled.
+                     Its signature must be in the form of
+                     f(JobRunner) -> None
+        onstarting: action that is performed right after the cwltool
+                    process has been launched.
+                    Its signature must be in the form of
+                    f(JobRunner) -> None
+        workflow_cache: WorkflowCache that provides the local copy of
+                        the workflow handed to cwltool, if any.
+        scratch_dir: directory where the job gets a directory of its own,
+                     for its log, outputs and temporary files. The system's
+                     temporary directory by default.
+        command: command that runs cwltool, as a list, the cwltool module
+                 of this interpreter by default. It is only used when
+                 cwltool runs in a process of its own.
+        cachedir: cwltool's step cache, see workflow_service.step_cache.
+                  Steps run there and the outputs are copied to the job's
+                  directory. None to run them in the job's directory.
+        parallel: whether cwltool runs independent steps in parallel.
     """
     def __init__(self, wf_path, input_obj, uuid,
-                 onfinishing=lambda *args, **kwargs: None):
+                 onfinishing=lambda *args, **kwargs: None,
+                 onstarting=lambda *args, **kwargs: None,
+                 workflow_cache=None, scratch_dir=None, command=None,
+                 cachedir=None, parallel=False):
         super(JobRunner, self).__init__()
 
+        self._wf_path = wf_path
+        self._workflow_cache = workflow_cache
         self._inputobj = input_obj
         self._onfinishing = onfinishing
+        self._onstarting = onstarting
+        self._command = list(command or [prefix + u'/bin/python', u'-m',
+                                         u'cwltool'])
+        self._cachedir = cachedir
+        self._parallel = parallel
+        self._done_callbacks = []
         self.uuid = uuid
 
-        self.state = State.Running
+        self.state = State.Queued
         self.output = None
+        # resources used by the cwltool process, see resource_usage
+        self.usage = None
+        self._rusage = None
 
         self.outdir = os.path.join(
-            tempfile.gettempdir(), str(self.uuid), 'out')
+            scratch_dir or tempfile.gettempdir(), str(self.uuid), 'out')
         makedirs(self.outdir)
-        loghandle, self.logname =\
+        self._loghandle, self.logname =\
             tempfile.mkstemp(dir=os.path.split(self.outdir)[0])
+        self.outputname = output_file(self.outdir)
+        self._ordername = os.path.join(
+            os.path.split(self.outdir)[0], u'job.json')
 
-        self._updatelock = Lock()
+        self._updatelock = RLock()
+        self._proc = None
 
-        with self._updatelock:
-            self._proc = Popen([prefix + u'/bin/python',
-                                u'-m',
-                                u'cwltool',
-                                u'--leave-outputs', wf_path, u'-'],
-                               stdin=PIPE,
-                               stdout=PIPE,
-                               stderr=loghandle,
-                               close_fds=True,
-                               cwd=self.outdir)
+    def add_done_callback(self, func):
+        """
+        Registers func to be called, as f(JobRunner) -> None, once the
+        runner has finished, after onfinishing has been called.
+        """
+        self._done_callbacks.append(func)
 
     def run(self):
-        stdoutdata, _ = self._proc.communicate(self._inputobj)
-        if self._proc.returncode == 0:
-            outobj = yaml.load(stdoutdata)
+        try:
+            self._run()
+        finally:
+            os.close(self._loghandle)
+            for func in self._done_callbacks:
+                func(self)
+
+    def _run(self):
+        wf_path = self._wf_path
+        if self._workflow_cache is not None and self.state == State.Queued:
+            wf_path = self._workflow_cache.get(wf_path)
+        # written before taking the lock, which cancel, pause and resume
+        # need, however big the job order is
+        ordered = self._write_order()
+
+        with self._updatelock:
+            if self.state != State.Queued:
+                # cancelled before it had the chance to run
+                self._onfinishing(self)
+                return
+            try:
+                self._proc = self._launch(wf_path) if ordered else None
+            except OSError:
+                self._proc = None
+            if self._proc is None:
+                self.state = State.Error
+                self.output = {}
+                self._onfinishing(self)
+                return
+            self.state = State.Running
+            launched = time()
+            self._onstarting(self)
+
+        try:
+            self._wait()
+            returncode = self._proc.returncode
+        except (IOError, OSError):
+            # the process can't be waited for
+            returncode = None
+        self.usage = resource_usage(self._rusage, time() - launched)
+        outobj = {}
+        state = State.Error
+        if returncode == 0:
+            outobj = read_output(self.outputname)
             state = State.Complete
-        else:
-            outobj = {}
-            state = State.Error
+        elif returncode is None and succeeded(self.logname):
+            # how the process ended is unknown, it's told by what it left
+            output = read_output(self.outputname)
+            if isinstance(output, dict):
+                outobj = output
+                state = State.Complete
 
         with self._updatelock:
-            self.state = state
+            if returncode == -SIGQUIT:
+                # cancelled, possibly by another server process
+                self.state = State.Cancelled
+            elif self.state != State.Cancelled:
+                self.state = state
             self.output = outobj
             self._onfinishing(self)
 
-    def logspooler(self):
-        with open(self.logname, 'r') as logfile:
-            chunk = logfile.readline(4096)
-            try:
-                while chunk:
-                    yield chunk
-                    chunk = logfile.readline(4096)
-
-                while self.state == State.Running:
-                    if chunk:
-                        yield chunk
-                    else:
-                        sleep(1)
-                    chunk = logfile.readline(4096)
-            except IOError:
-                pass
+    def _write_order(self):
+        # returns False if the job order couldn't be written
+        try:
+            with open(self._ordername, 'wb') as order:
+                order.write(self._encoded_input())
+        except (IOError, OSError):
+            return False
+        return True
+
+    def _launch(self, wf_path):
+        # returns the process running cwltool, which must work like a Popen.
+        # It runs in a session of its own, reads the job order from a file
+        # and writes its output to another, so it carries on if the server
+        # process goes away
+        with open(self._ordername, 'rb') as order:
+            with open(self.outputname, 'wb') as output:
+                return Popen(self._command + self._cwltool_args(wf_path),
+                             stdin=order,
+                             stdout=output,
+                             stderr=self._loghandle,
+                             close_fds=True,
+                             cwd=self.outdir,
+                             preexec_fn=os.setsid)
+
+    def _wait(self):
+        # waits for cwltool to finish, with wait4 to get its resource usage.
+        # Popen reaps it instead when it's polled first, send_signal does
+        # on newer Pythons, and then the usage is lost
+        try:
+            _, status, rusage = os.wait4(self._proc.pid, 0)
+        except OSError:
+            self._proc.wait()
+            return
+        self._proc.returncode = exit_returncode(status)
+        self._rusage = usage_of(rusage)
+
+    def _cwltool_args(self, wf_path):
+        args = [u'--parallel'] if self._parallel else []
+        if self._cachedir is None:
+            # the outputs and temporary files are kept in the job's
+            # directory, so they go away with it
+            args += [u'--leave-outputs',
+                     u'--tmp-outdir-prefix', self.outdir + os.sep]
+        else:
+            # the steps' outputs stay in the cache, the final ones are
+            # copied to the working directory, the job's
+            args += [u'--copy-outputs', u'--cachedir', self._cachedir]
+        return args + [u'--tmpdir-prefix',
+                       os.path.join(os.path.split(self.outdir)[0], u'tmp'),
+                       wf_path, u'-']
 
+    def _encoded_input(self):
+        inputobj = self._inputobj
+        if not isinstance(inputobj, bytes):
+            inputobj = inputobj.encode(u'utf-8')
+        return inputobj
+
+    @property
+    def pid(self):
+        return self._proc.pid if self._proc else None
+
+    def is_live(self):
+        return self.state in (State.Queued, State.Running, State.Paused)
+
+    def logspooler(self, offset=0):
+        """
+        Yields (offset, data) tuples with the log from offset onwards,
+        see LogWatcher.follow
+        """
+        return LOG_WATCHER.follow(self.logname, offset, self.is_live)
+
+    # the signalling methods also accept the states other server processes
+    # may have moved the job to, the database is the one keeping track.
     def cancel(self):
         with self._updatelock:
-            if self.state == State.Running:
+            if self.state == State.Queued:
+                self.state = State.Cancelled
+            elif self.state in (State.Running, State.Paused):
                 self._proc.send_signal(SIGQUIT)
-                self.state = State.Canceled
+                # stopped processes only get the signal once continued
+                self._proc.send_signal(SIGCONT)
+                self.state = State.Cancelled
 
     def pause(self):
         with self._updatelock:
-            if self.state == State.Running:
+            if self.state in (State.Running, State.Paused):
                 self._proc.send_signal(SIGTSTP)
                 self.state = State.Paused
 
     def resume(self):
         with self._updatelock:
-            if self.state == State.Paused:
+            if self.state in (State.Running, State.Paused):
                 self._proc.send_signal(SIGCONT)
                 self.state = State.Running
 
     def __repr__(self):
         return u'JobRunner {}:\t{}\t{}'.format(self.uuid, self.state, self.output)
+
+
+class PrewarmedJobRunner(JobRunner):
+    """
+    Runs cwltool in a process forked from a server that has already
+    imported it, see workflow_service.forkserver.
+    """
+    def _launch(self, wf_path):
+        return FORK_SERVER.spawn(self._cwltool_args(wf_path),
+                                 cwd=self.outdir,
+                                 stdin=self._ordername,
+                                 stdout=self.outputname,
+                                 stderr=self.logname)
+
+    def _wait(self):
+        self._proc.wait()
+        self._rusage = self._proc.rusage
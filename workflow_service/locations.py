@@ -0,0 +1,65 @@
+"""
+Locations of the outputs of jobs, rewritten from cwltool's local paths to
+the URLs the service serves them from, and indexed by their output ids.
+"""
+import logging
+
+from future.utils import iteritems
+
+LOGGER = logging.getLogger(__name__)
+
+
+# changes location from local filesystem to flask endpoint URL
+def url_location(url_root):
+    def new_locations(job_runner, jobid):
+        # replace locations in the outputs so web clients can retrieve all
+        # the outputs
+        output = job_runner.output if job_runner.output else {}
+        return change_all_locations(
+            output,
+            url_root[:-1] + u'/jobs/' + jobid + u'/output')
+    return new_locations
+
+
+def change_all_locations(obj, url_name):
+    if isinstance(obj, list):
+        for o_name, output in enumerate(obj):
+            change_all_locations(output, url_name + u'/' + str(o_name))
+    elif isinstance(obj, dict):
+        if 'location' not in obj:
+            for o_name, output in iteritems(obj):
+                change_all_locations(output, url_name + u'/' + o_name)
+        else:
+            obj[u'location'] = url_name
+    else:
+        LOGGER.warning(
+            u'Couldn\'t process output "%s" to change the locations', url_name)
+    return obj
+
+
+def index_outputs(obj, outputid=u'', index=None):
+    """
+    Returns a flat index of the files in the output object, from the output
+    ids used in their URLs to their path, basename, size and checksum
+    """
+    if index is None:
+        index = dict()
+    if isinstance(obj, list):
+        for o_name, output in enumerate(obj):
+            index_outputs(output, outputid + str(o_name) + u'/', index)
+    elif isinstance(obj, dict):
+        if u'location' not in obj:
+            for o_name, output in iteritems(obj):
+                index_outputs(output, outputid + o_name + u'/', index)
+        elif isfile(obj):
+            index[outputid[:-1]] = {
+                u'path': obj[u'path'],
+                u'basename': obj[u'basename'],
+                u'size': obj.get(u'size', None),
+                u'checksum': obj.get(u'checksum', None)
+            }
+    return index
+
+
+def isfile(obj):
+    return isinstance(obj, dict) and u'path' in obj and u'basename' in obj
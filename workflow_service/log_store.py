@@ -0,0 +1,161 @@
+"""
+Storage of job logs.
+
+Logs are plain files while their job runs, so they can be followed as they
+grow. Once the job is finished, the compressor gzips its log to
+<log>.gz and deletes the original, readers that already had it open keep
+reading it. open_log opens a log whichever way it's stored, offsets are
+always positions in the uncompressed log.
+"""
+import gzip
+import logging
+import os
+import shutil
+from collections import deque
+from threading import Condition, Thread
+
+LOGGER = logging.getLogger(__name__)
+
+BLOCK_SIZE = 64 * 1024
+
+
+def compressed_name(logname):
+    return logname + u'.gz'
+
+
+def is_compressed(logname):
+    return not os.path.exists(logname) and \
+        os.path.exists(compressed_name(logname))
+
+
+def open_log(logname):
+    """
+    Returns the log open for reading in binary mode, raises IOError if it
+    doesn't exist
+    """
+    try:
+        return open(logname, 'rb')
+    except (IOError, OSError):
+        # compressed, maybe since we checked
+        return gzip.open(compressed_name(logname), 'rb')
+
+
+def compress_log(logname, level=6):
+    """
+    Replaces the log with its gzipped copy, returns False if there's no
+    plain log to compress
+    """
+    target = compressed_name(logname)
+    partial = target + u'.part'
+    try:
+        with open(logname, 'rb') as log:
+            with gzip.open(partial, 'wb', level) as compressed:
+                shutil.copyfileobj(log, compressed, BLOCK_SIZE)
+    except (IOError, OSError):
+        if os.path.exists(partial):
+            os.remove(partial)
+        return False
+    # there's always a complete copy of the log to read
+    os.rename(partial, target)
+    os.remove(logname)
+    return True
+
+
+def tail_offset(logname, lines):
+    """
+    Returns the offset where the last lines of the log start, a last line
+    without a newline counts as a line
+    """
+    with open_log(logname) as log:
+        if isinstance(log, gzip.GzipFile):
+            return _forward_tail_offset(log, lines)
+        return _backward_tail_offset(log, lines)
+
+
+def _backward_tail_offset(log, lines):
+    log.seek(0, os.SEEK_END)
+    end = position = log.tell()
+    if lines <= 0:
+        return end
+    found = 0
+    while position > 0:
+        start = max(position - BLOCK_SIZE, 0)
+        log.seek(start)
+        block = log.read(position - start)
+        index = block.rfind(b'\n')
+        while index >= 0:
+            # a newline at the very end doesn't start a line
+            if start + index + 1 != end:
+                found += 1
+                if found == lines:
+                    return start + index + 1
+            index = block.rfind(b'\n', 0, index)
+        position = start
+    return 0
+
+
+def _forward_tail_offset(log, lines):
+    # compressed logs can only be read forwards, the starts of the last
+    # lines are kept along the way
+    starts = deque([0], maxlen=max(lines, 0) + 1)
+    size = 0
+    for block in iter(lambda: log.read(BLOCK_SIZE), b''):
+        index = block.find(b'\n')
+        while index >= 0:
+            starts.append(size + index + 1)
+            index = block.find(b'\n', index + 1)
+        size += len(block)
+    if lines <= 0:
+        return size
+    if starts[-1] == size:
+        # a newline at the very end doesn't start a line
+        starts.pop()
+    return starts[-lines] if len(starts) >= lines else 0
+
+
+class LogCompressor(object):
+    """
+    Compresses the logs of finished jobs in a thread of its own, so the
+    runners don't wait for it.
+
+    Args:
+        level: gzip compression level.
+    """
+    def __init__(self, level=6):
+        self.level = level
+        self._pending = deque()
+        self._changed = Condition()
+        self._thread = None
+
+    def compress(self, logname):
+        """
+        Queues the log to be compressed
+        """
+        with self._changed:
+            self._pending.append(logname)
+            if self._thread is None:
+                self._thread = Thread(target=self._compress_forever)
+                self._thread.daemon = True
+                self._thread.start()
+            self._changed.notify()
+
+    def flush(self):
+        """
+        Compresses all the queued logs, in this thread
+        """
+        while True:
+            with self._changed:
+                if not self._pending:
+                    return
+                logname = self._pending.popleft()
+            try:
+                compress_log(logname, self.level)
+            except (IOError, OSError) as err:
+                LOGGER.error(u'Couldn\'t compress %s: %s', logname, err)
+
+    def _compress_forever(self):
+        while True:
+            with self._changed:
+                while not self._pending:
+                    self._changed.wait()
+            self.flush()
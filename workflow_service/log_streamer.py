@@ -0,0 +1,267 @@
+"""
+Streams job logs to any number of clients.
+
+A single watcher thread keeps an eye on every log that is being followed
+and wakes up the clients of a log as soon as it grows, instead of having
+each client poll its own copy of the file. Clients are handed byte offsets
+along with the data so they can resume where they left it, the offsets
+are the same whether the log is compressed or not.
+"""
+import gzip
+import os
+import tempfile
+from threading import Condition, Lock, Thread
+from time import sleep
+
+from workflow_service.log_store import open_log
+
+CHUNK_SIZE = 64 * 1024
+
+# how often the watcher checks the size of the logs, in seconds
+WATCH_INTERVAL = 0.2
+# how long a client waits for new data before checking if the job is alive
+LIVENESS_INTERVAL = 5
+
+
+class _Feed(object):  # pylint: disable=too-few-public-methods
+    def __init__(self, logname):
+        self.logname = logname
+        self.size = 0
+        self.subscribers = 0
+        self.changed = Condition(Lock())
+        # called from the watcher thread whenever the log changes
+        self.callbacks = set()
+
+    def wait(self, offset, timeout):
+        # returns once the log is bigger than offset, woken up or timed out
+        with self.changed:
+            if self.size <= offset:
+                self.changed.wait(timeout)
+
+    def notify(self):
+        with self.changed:
+            self.changed.notify_all()
+        for callback in list(self.callbacks):
+            callback()
+
+
+class LogWatcher(object):
+    def __init__(self, interval=WATCH_INTERVAL):
+        self._interval = interval
+        self._feeds = dict()
+        self._lock = Lock()
+        self._thread = None
+
+    def follow(self, logname, offset, is_live):
+        """
+        Yields (offset, data) tuples with the contents of the log from
+        offset onwards, where offset is the position right after data.
+        Data is always cut after a newline, except for the last chunk
+        of a finished log.
+        Keeps following the log for as long as is_live() returns True.
+        """
+        feed = self._subscribe(logname)
+        try:
+            with open_log(logname) as logfile:
+                reader = LogReader(logfile, offset)
+                live = True
+                while True:
+                    chunk = reader.read()
+                    if chunk:
+                        yield chunk
+                        continue
+
+                    if not live:
+                        break
+                    live = is_live()
+                    if live:
+                        feed.wait(reader.position, LIVENESS_INTERVAL)
+                    # else read once more, the log may have grown before
+                    # the job finished
+
+                chunk = reader.rest()
+                if chunk:
+                    yield chunk
+        except IOError:
+            pass
+        finally:
+            self._unsubscribe(feed)
+
+    def watch(self, logname, callback):
+        """
+        Calls callback(), from the watcher thread, whenever the log grows or
+        its clients are woken up. Returns the feed to pass to unwatch
+        """
+        feed = self._subscribe(logname)
+        feed.callbacks.add(callback)
+        return feed
+
+    def unwatch(self, feed, callback):
+        feed.callbacks.discard(callback)
+        self._unsubscribe(feed)
+
+    def wake(self, logname):
+        """
+        Wakes up the clients of a log so they notice a change in the job
+        without waiting
+        """
+        with self._lock:
+            feed = self._feeds.get(logname, None)
+        if feed is not None:
+            feed.notify()
+
+    def _subscribe(self, logname):
+        with self._lock:
+            feed = self._feeds.get(logname, None)
+            if feed is None:
+                feed = self._feeds[logname] = _Feed(logname)
+            feed.subscribers += 1
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._watch)
+                self._thread.daemon = True
+                self._thread.start()
+        return feed
+
+    def _unsubscribe(self, feed):
+        with self._lock:
+            feed.subscribers -= 1
+            if feed.subscribers == 0:
+                self._feeds.pop(feed.logname, None)
+
+    def _watch(self):
+        # the thread quits when nobody is following any log
+        while True:
+            with self._lock:
+                feeds = list(self._feeds.values())
+                if not feeds:
+                    self._thread = None
+                    return
+
+            for feed in feeds:
+                try:
+                    size = os.stat(feed.logname).st_size
+                except OSError:
+                    continue
+                if size != feed.size:
+                    with feed.changed:
+                        feed.size = size
+                    feed.notify()
+
+            sleep(self._interval)
+
+
+class LogReader(object):
+    """
+    Reads an open log from offset onwards in the chunks LogWatcher.follow
+    yields, for the clients that wait for the log to grow their own way.
+    offset is the position right after the last chunk handed out.
+    """
+    def __init__(self, logfile, offset):
+        self._logfile = logfile
+        self._pending = b''
+        self.offset = offset
+        logfile.seek(offset)
+
+    @property
+    def position(self):
+        # how far the log has been read
+        return self.offset + len(self._pending)
+
+    def read(self):
+        """
+        Returns the next (offset, data) tuple, None once it has caught up
+        with the log
+        """
+        while True:
+            data = self._logfile.read(CHUNK_SIZE)
+            if not data:
+                return None
+            self._pending += data
+            cut = cut_at(self._pending)
+            if cut:
+                return self._hand_out(cut)
+
+    def rest(self):
+        """
+        Returns the rest of a finished log, which may not end with a
+        newline, None if there's nothing left
+        """
+        if not self._pending:
+            return None
+        return self._hand_out(len(self._pending))
+
+    def _hand_out(self, size):
+        data, self._pending = self._pending[:size], self._pending[size:]
+        self.offset += size
+        return self.offset, data
+
+
+def cut_at(pending):
+    """
+    Returns how much of the pending data read from a log can be handed to
+    the clients, 0 if they have to wait for the rest of the line
+    """
+    if len(pending) >= CHUNK_SIZE:
+        # a line that long is not worth waiting for
+        return len(pending)
+    return pending.rfind(b'\n') + 1
+
+
+def sse_events(chunks, offset=0):
+    """
+    Frames (offset, data) tuples as server-sent events, using the offsets
+    as event ids so clients can resume with Last-Event-ID
+    """
+    for offset, data in chunks:
+        yield sse_event(offset, data)
+    yield sse_end(offset)
+
+
+def compressed_events(logname, level=6):
+    """
+    Returns the path of the whole log, which must be finished, framed as
+    server-sent events and gzipped. It's written the first time it's asked
+    for, the clients reading a finished log from the start are then sent
+    the file as it is. Raises IOError if the log can't be read
+    """
+    target = logname + u'.events.gz'
+    if os.path.exists(target):
+        return target
+
+    def chunks(reader):
+        for chunk in iter(reader.read, None):
+            yield chunk
+        chunk = reader.rest()
+        if chunk:
+            yield chunk
+
+    handle, partial = tempfile.mkstemp(dir=os.path.dirname(logname),
+                                       suffix=u'.part')
+    try:
+        with os.fdopen(handle, 'wb') as events:
+            with gzip.GzipFile(fileobj=events, mode='wb',
+                               compresslevel=level) as compressed:
+                with open_log(logname) as log:
+                    for event in sse_events(chunks(LogReader(log, 0))):
+                        compressed.write(event.encode(u'utf-8'))
+        # requests writing it at once write the same
+        os.rename(partial, target)
+    except (IOError, OSError):
+        os.remove(partial)
+        raise
+    return target
+
+
+def sse_event(offset, data):
+    lines = data.decode(u'utf-8', u'replace').splitlines()
+    return u'id: {}\n{}\n'.format(
+        offset, u''.join(u'data: {}\n'.format(line) for line in lines))
+
+
+def sse_end(offset):
+    # lets the client know it shouldn't reconnect
+    return u'id: {}\nevent: end\ndata: \n\n'.format(offset)
+
+
+LOG_WATCHER = LogWatcher()
@@ -0,0 +1,138 @@
+"""
+Memoization of job results.
+
+Jobs are keyed by a hash of the workflow, its URL and packed contents, so
+changes to the documents it imports count, of the job order, canonicalized
+so the same inputs written differently give the same key, and of the size
+and modification time of the local files and directories it refers to.
+A new job with the key of a recently completed one, whose outputs are
+still on disk, gets a copy of its results instead of running cwltool
+again. Jobs whose inputs can't be told unchanged, remote or relative
+locations and job orders in YAML, aren't memoized.
+"""
+import hashlib
+import json
+import os
+
+from future.moves.urllib.parse import urlparse
+from future.moves.urllib.request import url2pathname
+from future.utils import iteritems
+
+from workflow_service.workflow_cache import packed_workflow
+
+
+def memo_key(url, job_order, fetch=packed_workflow):
+    """
+    Returns the key of running the workflow at url with job_order, or None
+    if the workflow can't be fetched or the inputs can't be hashed
+    """
+    return memo_keys(url, [job_order], fetch)[0]
+
+
+def memo_keys(url, job_orders, fetch=packed_workflow):
+    """
+    Returns the keys of running the workflow at url with each of the
+    job_orders, fetching the workflow only once. They are all None if the
+    workflow can't be fetched, and the key of a job order is None if its
+    inputs can't be hashed
+    """
+    try:
+        contents = fetch(url)
+    except (IOError, OSError, ValueError):
+        return [None] * len(job_orders)
+
+    return [_key(url, contents, job_order) for job_order in job_orders]
+
+
+def _key(url, contents, job_order):
+    try:
+        order = json.loads(job_order)
+    except ValueError:
+        # cwltool also takes YAML, whose files we can't find
+        return None
+    inputs = input_states(order)
+    if inputs is None:
+        return None
+
+    digest = hashlib.sha256()
+    parts = [url.encode(u'utf-8'), contents,
+             json.dumps(order, sort_keys=True,
+                        separators=(u',', u':')).encode(u'utf-8')]
+    for part in parts + [state.encode(u'utf-8') for state in inputs]:
+        # prefixing the lengths keeps the parts from running into each other
+        digest.update(u'{}:'.format(len(part)).encode(u'utf-8'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def input_states(order):
+    """
+    Returns the path, size and modification time of every local file and
+    directory in the job order, and the ones in the directories, as
+    strings. None if some of them are remote, relative or missing
+    """
+    states = []
+    for location in input_locations(order):
+        parsed = urlparse(location)
+        if parsed.scheme == u'file':
+            path = url2pathname(parsed.path)
+        elif parsed.scheme == u'':
+            path = location
+        else:
+            return None
+        if not os.path.isabs(path) or not os.path.exists(path):
+            return None
+        paths = [path]
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            paths.extend(os.path.join(root, name)
+                         for name in sorted(dirs + files))
+        for entry in paths:
+            try:
+                stat = os.stat(entry)
+            except OSError:
+                return None
+            states.append(u'{}:{}:{!r}'.format(entry, stat.st_size,
+                                               stat.st_mtime))
+    return states
+
+
+def input_locations(order):
+    """
+    Yields the locations of the Files and Directories in a job order,
+    their secondary files included. Literals, which have none, are left out
+    """
+    if isinstance(order, list):
+        for item in order:
+            for location in input_locations(item):
+                yield location
+    elif isinstance(order, dict):
+        if order.get(u'class', None) in (u'File', u'Directory'):
+            location = order.get(u'location', order.get(u'path', None))
+            if location is not None:
+                yield location
+        for value in order.values():
+            for location in input_locations(value):
+                yield location
+
+
+def output_paths(output):
+    """
+    Yields the paths of the files and directories in a cwltool output
+    object
+    """
+    if isinstance(output, list):
+        for item in output:
+            for path in output_paths(item):
+                yield path
+    elif isinstance(output, dict):
+        if u'path' in output and u'location' in output:
+            yield output[u'path']
+        for key, value in iteritems(output):
+            if key not in (u'path', u'location'):
+                for path in output_paths(value):
+                    yield path
+
+
+def outputs_exist(output):
+    return all(os.path.exists(path) for path in output_paths(output))
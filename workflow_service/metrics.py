@@ -0,0 +1,356 @@
+"""
+Metrics of the service, exposed in the Prometheus text format.
+
+Each server process keeps its own metrics and, when a metrics directory is
+configured, writes them to a file of its own in it every FLUSH_INTERVAL
+seconds. The metrics of all the processes of the node are added up when
+they're exposed, so it doesn't matter which worker serves /metrics.
+Counters and histograms include the processes that are gone, gauges only
+the live ones: the files of processes that are gone are folded into the
+retired totals and deleted when the metrics are collected.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import tempfile
+from threading import Lock, Thread
+from time import sleep, time
+
+from workflow_service.processes import identity, is_identity_alive
+
+# seconds between writes of the metrics of this process to its file
+FLUSH_INTERVAL = 1
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DURATION_BUCKETS = (1, 5, 10, 30, 60, 300, 600, 1800, 3600, 7200, 21600, 86400)
+
+# counters and histograms of the processes that are gone, and the names of
+# their files, which are only deleted once they're counted in here
+RETIRED_NAME = u'retired.totals'
+LOCK_NAME = u'.lock'
+
+
+class Metric(object):
+    """
+    Family of values of a metric, one for each combination of labels
+    """
+    kind = None
+
+    def __init__(self, registry, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._registry = registry
+
+    def key(self, **labels):
+        # labels are stored as the JSON list of their values
+        return json.dumps([labels.get(name, u'') for name in self.labelnames])
+
+    def _update(self, labels, func):
+        self._registry.update(self.name, self.key(**labels), func)
+
+
+class Counter(Metric):
+    kind = u'counter'
+
+    def inc(self, amount=1, **labels):
+        self._update(labels, lambda value: (value or 0) + amount)
+
+
+class Gauge(Metric):
+    kind = u'gauge'
+
+    def inc(self, amount=1, **labels):
+        self._update(labels, lambda value: (value or 0) + amount)
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        self._update(labels, lambda _: value)
+
+
+class Histogram(Metric):
+    kind = u'histogram'
+
+    def __init__(self, registry, name, description, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(registry, name, description, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, amount, **labels):
+        def add(value):
+            value = value or {
+                u'buckets': [0] * len(self.buckets), u'sum': 0, u'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    value[u'buckets'][index] += 1
+            value[u'sum'] += amount
+            value[u'count'] += 1
+            return value
+        self._update(labels, add)
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+
+class _Timer(object):  # pylint: disable=too-few-public-methods
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+        self._start = None
+
+    def __enter__(self):
+        self._start = time()
+        return self
+
+    def __exit__(self, *args):
+        self._histogram.observe(time() - self._start, **self._labels)
+
+
+class Registry(object):
+    """
+    Metrics of this process.
+
+    Args:
+        metrics_dir: directory shared by the server processes of the node,
+                     where each one writes its metrics. None keeps them in
+                     memory, which is enough for a single process.
+    """
+    def __init__(self, metrics_dir=None):
+        self.metrics_dir = metrics_dir
+        self._metrics = OrderedDict()
+        # metric name -> label key -> value
+        self._values = dict()
+        self._lock = Lock()
+        self._dirty = False
+        self._filename = None
+        self._identity = None
+        self._thread = None
+
+        if metrics_dir is not None:
+            try:
+                os.makedirs(metrics_dir)
+            except OSError:
+                if not os.path.isdir(metrics_dir):
+                    raise
+
+    def counter(self, name, description, labelnames=()):
+        return self._add(Counter(self, name, description, labelnames))
+
+    def gauge(self, name, description, labelnames=()):
+        return self._add(Gauge(self, name, description, labelnames))
+
+    def histogram(self, name, description, labelnames=(),
+                  buckets=LATENCY_BUCKETS):
+        return self._add(
+            Histogram(self, name, description, labelnames, buckets))
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def update(self, name, key, func):
+        with self._lock:
+            values = self._values.setdefault(name, dict())
+            values[key] = func(values.get(key, None))
+            self._dirty = True
+            if self.metrics_dir is not None and self._thread is None:
+                self._thread = Thread(target=self._flush_forever)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def flush(self):
+        """
+        Writes the metrics of this process to its file in the metrics dir
+        """
+        if self.metrics_dir is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            if self._filename is None:
+                # identities tell apart processes that reuse a pid
+                self._identity = identity()
+                self._filename = os.path.join(
+                    self.metrics_dir, u'{}.json'.format(self._identity))
+            data = json.dumps({u'pid': os.getpid(),
+                               u'process': self._identity,
+                               u'values': self._values})
+            self._dirty = False
+
+        _write(self._filename, data)
+
+    def _flush_forever(self):
+        while True:
+            sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except (IOError, OSError):
+                pass
+
+    def collect(self):
+        """
+        Returns the values of the metrics of all the processes, added up
+        """
+        self.flush()
+        with self._lock:
+            processes = [(True, json.loads(json.dumps(self._values)))]
+        if self.metrics_dir is not None:
+            processes.extend(self._other_processes())
+
+        totals = dict()
+        for live, values in processes:
+            for name, metric in self._metrics.items():
+                if metric.kind == u'gauge' and not live:
+                    continue
+                family = totals.setdefault(name, dict())
+                for key, value in values.get(name, {}).items():
+                    family[key] = _add(family.get(key, None), value)
+        return totals
+
+    def _other_processes(self):
+        # returns (live, values) for the other processes and the retired
+        # totals, after folding the processes that are gone into them
+        own = identity()
+        with _locked(os.path.join(self.metrics_dir, LOCK_NAME)):
+            others = []
+            gone = []
+            for name, process, values in _read_processes(self.metrics_dir):
+                if not is_identity_alive(process):
+                    gone.append((name, values))
+                elif process != own:
+                    others.append((True, values))
+            return others + [(False, self._retire(gone))]
+
+    def _retire(self, gone):
+        # folds the counters and histograms of the processes that are gone,
+        # (file name, values), into the retired totals, deletes their files
+        # and returns the totals. Only called with the lock held
+        path = os.path.join(self.metrics_dir, RETIRED_NAME)
+        try:
+            with open(path) as retired_file:
+                retired = json.load(retired_file)
+        except (IOError, OSError, ValueError):
+            retired = {u'values': {}, u'folded': []}
+        if not gone:
+            return retired[u'values']
+
+        # the names are kept until the files are gone, so the ones that
+        # couldn't be deleted aren't counted twice
+        folded = [name for name in retired[u'folded'] if os.path.exists(
+            os.path.join(self.metrics_dir, name))]
+        totals = retired[u'values']
+        for name, values in gone:
+            if name in folded:
+                continue
+            folded.append(name)
+            for metric_name, family in values.items():
+                metric = self._metrics.get(metric_name, None)
+                if metric is not None and metric.kind == u'gauge':
+                    continue
+                total = totals.setdefault(metric_name, dict())
+                for key, value in family.items():
+                    total[key] = _add(total.get(key, None), value)
+        _write(path, json.dumps({u'values': totals, u'folded': folded}))
+
+        for name, _ in gone:
+            try:
+                os.remove(os.path.join(self.metrics_dir, name))
+            except OSError:
+                pass
+        return totals
+
+    def exposition(self, extra=()):
+        """
+        Returns the metrics in the Prometheus text format, extra are
+        (metric, {label key: value}) pairs computed by the caller
+        """
+        totals = self.collect()
+        lines = []
+        families = [(metric, totals.get(name, {}))
+                    for name, metric in self._metrics.items()]
+        for metric, values in families + list(extra):
+            lines.append(u'# HELP {} {}'.format(metric.name,
+                                                metric.description))
+            lines.append(u'# TYPE {} {}'.format(metric.name, metric.kind))
+            for key in sorted(values):
+                labels = list(zip(metric.labelnames, json.loads(key)))
+                value = values[key]
+                if metric.kind != u'histogram':
+                    lines.append(_sample(metric.name, labels, value))
+                    continue
+                for bound, count in zip(metric.buckets, value[u'buckets']):
+                    lines.append(_sample(metric.name + u'_bucket',
+                                         labels + [(u'le', repr(float(bound)))],
+                                         count))
+                lines.append(_sample(metric.name + u'_bucket',
+                                     labels + [(u'le', u'+Inf')],
+                                     value[u'count']))
+                lines.append(_sample(metric.name + u'_sum', labels,
+                                     value[u'sum']))
+                lines.append(_sample(metric.name + u'_count', labels,
+                                     value[u'count']))
+        return u'\n'.join(lines) + u'\n'
+
+
+def _read_processes(metrics_dir):
+    # yields (file name, identity, values) for every file in the metrics
+    # dir, files without an identity are from before they had one
+    for name in os.listdir(metrics_dir):
+        if not name.endswith(u'.json'):
+            continue
+        try:
+            with open(os.path.join(metrics_dir, name)) as metrics_file:
+                data = json.load(metrics_file)
+        except (IOError, OSError, ValueError):
+            continue
+        yield name, data.get(u'process', data[u'pid']), data[u'values']
+
+
+def _write(path, data):
+    # replaces the file in one go, readers never see it half written
+    handle, tmppath = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       suffix=u'.tmp')
+    with os.fdopen(handle, 'w') as tmpfile:
+        tmpfile.write(data)
+    os.rename(tmppath, path)
+
+
+@contextmanager
+def _locked(path):
+    # holds an exclusive lock on the file, shared by the processes
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _add(total, value):
+    if total is None:
+        return value
+    if isinstance(value, dict):
+        return {
+            u'buckets': [a + b for a, b in zip(total[u'buckets'],
+                                               value[u'buckets'])],
+            u'sum': total[u'sum'] + value[u'sum'],
+            u'count': total[u'count'] + value[u'count']
+        }
+    return total + value
+
+
+def _sample(name, labels, value):
+    if labels:
+        name += u'{' + u','.join(
+            u'{}="{}"'.format(label, _escape(label_value))
+            for label, label_value in labels) + u'}'
+    return u'{} {}'.format(name, repr(float(value)))
+
+
+def _escape(value):
+    return (u'{}'.format(value).replace(u'\\', u'\\\\')
+            .replace(u'"', u'\\"').replace(u'\n', u'\\n'))
@@ -0,0 +1,255 @@
+"""
+Upgrades of the schema of existing databases.
+
+create_all only creates the tables that are missing, it never changes the
+ones that are there, so every change to the jobs table comes with a step
+here that makes it on databases created before it. The version of a
+database is kept in the schema_version table: new databases are created
+at the latest version, databases from before the table existed are at
+version 1, the schema of the first release.
+Steps check what they change before changing it, a database created by
+create_all at any version can be upgraded from version 1.
+"""
+import logging
+import re
+
+from sqlalchemy import (
+    BigInteger, Boolean, Column, DateTime, Float, Integer, MetaData, String,
+    Table, UnicodeText, inspect
+)
+from sqlalchemy_utils import JSONType
+
+LOGGER = logging.getLogger(__name__)
+
+VERSIONS = MetaData()
+SCHEMA_VERSION = Table(
+    u'schema_version', VERSIONS,
+    Column(u'version', Integer, nullable=False))
+
+# values of the state enum, in the order of workflow_service.models.State
+STATES = (u'Queued', u'Running', u'Complete', u'Paused', u'Error',
+          u'Cancelled')
+
+
+def upgrade(engine, metadata):
+    """
+    Brings the database to the latest version, the tables are created
+    from metadata if they don't exist. Returns the versions applied.
+    """
+    if not engine.has_table(u'jobs'):
+        metadata.create_all(bind=engine)
+        VERSIONS.create_all(bind=engine)
+        stamp(engine, latest_version())
+        return []
+
+    VERSIONS.create_all(bind=engine)
+    version = current_version(engine)
+    applied = []
+    for number, step in MIGRATIONS:
+        if number <= version:
+            continue
+        LOGGER.warning(u'Upgrading the database to version %d', number)
+        step(engine)
+        stamp(engine, number)
+        applied.append(number)
+    return applied
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def current_version(engine):
+    version = engine.execute(SCHEMA_VERSION.select()).scalar()
+    return 1 if version is None else version
+
+
+def stamp(engine, version):
+    with engine.begin() as connection:
+        connection.execute(SCHEMA_VERSION.delete())
+        connection.execute(SCHEMA_VERSION.insert().values(version=version))
+
+
+def add_columns(engine, table, columns):
+    """Adds the columns, sqlalchemy Columns, that the table lacks"""
+    existing = set(column[u'name']
+                   for column in inspect(engine).get_columns(table))
+    with engine.begin() as connection:
+        for column in columns:
+            if column.name in existing:
+                continue
+            connection.execute(u'ALTER TABLE {} ADD COLUMN {} {}'.format(
+                table, column.name, column.type.compile(engine.dialect)))
+
+
+def add_indexes(engine, table, indexes):
+    """Creates the indexes, pairs of name and columns, the table lacks"""
+    existing = set(index[u'name']
+                   for index in inspect(engine).get_indexes(table))
+    with engine.begin() as connection:
+        for name, columns in indexes:
+            if name in existing:
+                continue
+            connection.execute(u'CREATE INDEX {} ON {} ({})'.format(
+                name, table, u', '.join(columns)))
+
+
+def add_queued_state(engine):
+    """
+    Lets the state column hold Queued: it's a native enum on postgres and
+    mysql, and a varchar with a check constraint on sqlite
+    """
+    dialect = engine.dialect.name
+    if dialect == u'postgresql':
+        # enum values can't be added inside a transaction
+        connection = engine.connect().execution_options(
+            isolation_level=u'AUTOCOMMIT')
+        with connection:
+            connection.execute(
+                u"ALTER TYPE state ADD VALUE IF NOT EXISTS 'Queued'")
+    elif dialect == u'mysql':
+        engine.execute(u'ALTER TABLE jobs MODIFY state ENUM({})'.format(
+            u', '.join(u"'{}'".format(state) for state in STATES)))
+    elif dialect == u'sqlite':
+        rebuild_sqlite_table(engine, u'jobs', _widen_state_check)
+
+
+def _widen_state_check(sql):
+    def widen(match):
+        values = match.group(1)
+        if u"'Queued'" in values:
+            return match.group(0)
+        return u"CHECK (state IN ('Queued', {}))".format(values)
+    return re.sub(r'CHECK \(state IN \(([^)]*)\)\)', widen, sql)
+
+
+def rebuild_sqlite_table(engine, table, change):
+    """
+    sqlite can't alter constraints, the table is created again from its
+    sql, as changed by change, and the rows copied over
+    """
+    with engine.begin() as connection:
+        sql = connection.execute(
+            u"SELECT sql FROM sqlite_master WHERE type = 'table' "
+            u"AND name = ?", table).scalar()
+        new_sql = change(sql)
+        if new_sql == sql:
+            return
+        indexes = [row[0] for row in connection.execute(
+            u"SELECT sql FROM sqlite_master WHERE type = 'index' "
+            u"AND tbl_name = ? AND sql IS NOT NULL", table)]
+        staging = table + u'_upgrade'
+        connection.execute(re.sub(
+            r'^CREATE TABLE\s+"?{}"?'.format(table),
+            u'CREATE TABLE ' + staging, new_sql))
+        connection.execute(u'INSERT INTO {} SELECT * FROM {}'.format(
+            staging, table))
+        connection.execute(u'DROP TABLE ' + table)
+        connection.execute(u'ALTER TABLE {} RENAME TO {}'.format(
+            staging, table))
+        for index in indexes:
+            connection.execute(index)
+
+
+def queued_jobs(engine):
+    add_queued_state(engine)
+    add_columns(engine, u'jobs', [
+        Column(u'launch_time', DateTime),
+    ])
+
+
+def runner_locations(engine):
+    add_columns(engine, u'jobs', [
+        Column(u'node', String(255)),
+        Column(u'pid', Integer),
+        Column(u'logfile', UnicodeText),
+        Column(u'outdir', UnicodeText),
+    ])
+
+
+def listing_indexes(engine):
+    add_indexes(engine, u'jobs', [
+        (u'ix_jobs_owner_start_time', [u'owner', u'start_time']),
+        (u'ix_jobs_state', [u'state']),
+    ])
+
+
+def memo_keys(engine):
+    add_columns(engine, u'jobs', [
+        Column(u'memo_key', String(64)),
+    ])
+    add_indexes(engine, u'jobs', [
+        (u'ix_jobs_memo_key', [u'memo_key']),
+    ])
+
+
+def output_indexes(engine):
+    add_columns(engine, u'jobs', [
+        Column(u'output_index', JSONType),
+    ])
+
+
+def resource_usage(engine):
+    add_columns(engine, u'jobs', [
+        Column(u'wall_time', Float),
+        Column(u'cpu_user', Float),
+        Column(u'cpu_system', Float),
+        Column(u'max_rss', BigInteger),
+        Column(u'blocks_in', BigInteger),
+        Column(u'blocks_out', BigInteger),
+    ])
+
+
+def supervisors(engine):
+    add_columns(engine, u'jobs', [
+        Column(u'supervisor', String(64)),
+    ])
+    # the column held integers at first, sqlite stores strings in them as
+    # they are, the other databases need them widened
+    supervisor = [column for column in inspect(engine).get_columns(u'jobs')
+                  if column[u'name'] == u'supervisor'][0]
+    if not isinstance(supervisor[u'type'], Integer):
+        return
+    if engine.dialect.name == u'postgresql':
+        engine.execute(
+            u'ALTER TABLE jobs ALTER COLUMN supervisor TYPE VARCHAR(64)')
+    elif engine.dialect.name == u'mysql':
+        engine.execute(u'ALTER TABLE jobs MODIFY supervisor VARCHAR(64)')
+
+
+def evicted_jobs(engine):
+    add_columns(engine, u'jobs', [
+        Column(u'evicted', Boolean),
+    ])
+
+
+def step_cache_options(engine):
+    add_columns(engine, u'jobs', [
+        Column(u'step_cache', Boolean),
+        Column(u'parallel', Boolean),
+        Column(u'cache_hits', Integer),
+        Column(u'cache_misses', Integer),
+    ])
+
+
+def row_versions(engine):
+    add_columns(engine, u'jobs', [
+        Column(u'version', Integer),
+    ])
+    engine.execute(u'UPDATE jobs SET version = 0 WHERE version IS NULL')
+
+
+# ordered pairs of the version and the step that upgrades the previous
+# version to it
+MIGRATIONS = [
+    (2, queued_jobs),
+    (3, runner_locations),
+    (4, listing_indexes),
+    (5, memo_keys),
+    (6, output_indexes),
+    (7, resource_usage),
+    (8, supervisors),
+    (9, evicted_jobs),
+    (10, step_cache_options),
+    (11, row_versions),
+]
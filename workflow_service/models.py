@@ -1,9 +1,14 @@
-from __future__ import print_function
+from __future__ import division, print_function
+from datetime import datetime
 import enum
 from uuid import uuid4
 from sqlalchemy.exc import SQLAlchemyError
 
-from sqlalchemy import Column, DateTime, Enum, String, UnicodeText, func
+from sqlalchemy import (
+    BigInteger, Boolean, Column, DateTime, Enum, Float, Index, Integer, String,
+    UnicodeText, and_, func, literal_column, or_
+)
+from sqlalchemy.orm import aliased
 from sqlalchemy_utils import JSONType, UUIDType
 
 from workflow_service.database import BASE, DB_SESSION
@@ -11,6 +16,7 @@ from workflow_service.database import BASE, DB_SESSION
 
 @enum.unique  # pylint: disable=too-few-public-methods
 class State(enum.Enum):
+    Queued = u'Queued'
     Running = u'Running'
     Complete = u'Complete'
     Paused = u'Paused'
@@ -18,18 +24,60 @@ class State(enum.Enum):
     Cancelled = u'Cancelled'
 
 
+# the states a job can still leave
+LIVE_STATES = (State.Queued, State.Running, State.Paused)
+
+
 # pylint: disable=bad-whitespace
 class Job(BASE):  # pylint: disable=too-few-public-methods
     __tablename__ = 'jobs'
+    __table_args__ = (
+        # listings are per owner, ordered by start_time
+        Index('ix_jobs_owner_start_time', 'owner', 'start_time'),
+        Index('ix_jobs_state', 'state'),
+        Index('ix_jobs_memo_key', 'memo_key'),
+    )
     id            = Column(UUIDType(native=True), primary_key=True, default=uuid4)
     input_json    = Column(JSONType)
     workflow      = Column(UnicodeText)
     output        = Column(JSONType)
-    state         = Column(Enum(State), default=State.Running)
+    # output id -> file, built when the job finishes, see index_outputs
+    output_index  = Column(JSONType)
+    state         = Column(Enum(State), default=State.Queued)
     start_time    = Column(DateTime, server_default=func.now())
+    launch_time   = Column(DateTime)
     state_time    = Column(DateTime, onupdate=func.now())
+    # bumped by every update of the row, see job_etag
+    version       = Column(Integer, default=0,
+                           onupdate=literal_column(u'version') + 1)
     owner         = Column(String(50))
     run_by_host   = Column(String(50))
+    # where the runner lives, so any server process can reach it
+    node          = Column(String(255))
+    pid           = Column(Integer)
+    # identity of the server process that looks after the job, see
+    # workflow_service.processes and workflow_service.reconciler
+    supervisor    = Column(String(64))
+    logfile       = Column(UnicodeText)
+    outdir        = Column(UnicodeText)
+    # the log and outputs were deleted, see workflow_service.scratch
+    evicted       = Column(Boolean, default=False)
+    # hash of the workflow and job order, see workflow_service.memo
+    memo_key      = Column(String(64))
+    # options of the cwltool run, see workflow_service.step_cache
+    step_cache    = Column(Boolean, default=False)
+    parallel      = Column(Boolean, default=False)
+    # steps read from the step cache and steps that ran
+    cache_hits    = Column(Integer)
+    cache_misses  = Column(Integer)
+    # resources used by the cwltool process and the processes it waited
+    # for: seconds, kilobytes and blocks of 512 bytes
+    wall_time     = Column(Float)
+    cpu_user      = Column(Float)
+    cpu_system    = Column(Float)
+    max_rss       = Column(BigInteger)
+    blocks_in     = Column(BigInteger)
+    blocks_out    = Column(BigInteger)
 
     def __init__(self, workflow, input_json, hostname, owner=None):
         self.input_json = input_json
@@ -38,32 +86,145 @@ class Job(BASE):  # pylint: disable=too-few-public-methods
         self.run_by_host = hostname
 
     def status(self):
-        status = {
-            u'id': u'/'.join([self.run_by_host[:-1], u'jobs', str(self.id)]),
-            u'log': u'/'.join([self.run_by_host[:-1], u'jobs', str(self.id), u'log']),
-            u'run': self.workflow,
-            u'state': self.state,
-            u'input': self.input_json,
-            u'output': self.output
-        }
-
-        return status
+        return job_status(self)
 
     def __repr__(self):
         return str(self.status())
 
 
-def update_job(flask_app, job, state, output):
+def job_status(job, position=None):
     """
-    Meant to run at the end of asynchronous tasks, in a separate thread,
-    which is why we can remove the per-thread db session
+    Builds the status of a job, job can be a Job or a row with the
+    STATUS_COLUMNS, which avoids loading whole Jobs when listing them.
+    The position of a Queued job is looked up unless it's given, listings
+    get them with queue_positions.
+    """
+    status = {
+        u'id': u'/'.join([job.run_by_host[:-1], u'jobs', str(job.id)]),
+        u'log': u'/'.join([job.run_by_host[:-1], u'jobs', str(job.id), u'log']),
+        u'run': job.workflow,
+        u'state': job.state,
+        u'input': job.input_json,
+        u'output': job.output,
+        u'time_queued': time_queued(job)
+    }
+    if job.state == State.Queued:
+        status[u'queue_position'] = (
+            queue_position(job) if position is None else position)
+    if job.evicted:
+        status[u'evicted'] = True
+    if job.wall_time is not None:
+        status[u'resources'] = {
+            column: getattr(job, column) for column in USAGE_COLUMNS}
+    if job.cache_hits is not None:
+        steps = job.cache_hits + job.cache_misses
+        status[u'step_cache'] = {
+            u'hits': job.cache_hits,
+            u'misses': job.cache_misses,
+            u'hit_rate': job.cache_hits / steps if steps else None
+        }
+
+    return status
+
+
+def queue_position(job):
+    # each owner has a FIFO queue, so the jobs ahead are the ones the owner
+    # submitted earlier
+    owned = Job.owner.is_(None) if job.owner is None else Job.owner == job.owner
+    ahead = Job.query.filter(
+        Job.state == State.Queued,
+        Job.run_by_host == job.run_by_host,
+        owned,
+        Job.start_time < job.start_time
+    ).count()
+    return ahead + 1
+
+
+def queue_positions(jobs):
     """
+    Returns the queue positions of the Queued jobs among jobs, by id, with
+    one grouped query instead of a count for each job
+    """
+    jobids = [job.id for job in jobs if job.state == State.Queued]
+    if not jobids:
+        return {}
+    ahead = aliased(Job)
+    owned = (ahead.owner == Job.owner) | (
+        ahead.owner.is_(None) & Job.owner.is_(None))
+    rows = DB_SESSION().query(Job.id, func.count(ahead.id)).outerjoin(
+        ahead, and_(
+            ahead.state == State.Queued,
+            ahead.run_by_host == Job.run_by_host,
+            owned,
+            ahead.start_time < Job.start_time
+        )
+    ).filter(Job.id.in_(jobids)).group_by(Job.id)
+    return {jobid: count + 1 for jobid, count in rows}
+
+
+def time_queued(job):
+    # seconds the job spent waiting for a free slot, so far
+    if job.start_time is None:
+        return None
+    until = job.launch_time
+    if until is None:
+        if job.state != State.Queued:
+            return None
+        until = datetime.utcnow()
+    return max((until - job.start_time).total_seconds(), 0)
+
+
+def job_etag(job, position=None):
+    """
+    Tag that changes whenever the status of the job does, the position of
+    a Queued job is looked up unless it's given. The time_queued of a
+    Queued job grows with the clock alone, and doesn't change the tag
+    """
+    etag = u'{}-{}'.format(job.state.value, job.version or 0)
+    if job.state == State.Queued:
+        etag += u'-{}'.format(
+            queue_position(job) if position is None else position)
+    return etag
+
+
+def current_etag(jobid):
+    """
+    Returns the ETag of the job as it is in the database, None if it's gone
+    """
+    job = DB_SESSION().query(Job).get(jobid)
+    return job_etag(job) if job else None
+
+
+USAGE_COLUMNS = (
+    u'wall_time', u'cpu_user', u'cpu_system', u'max_rss', u'blocks_in',
+    u'blocks_out'
+)
+
+STATUS_COLUMNS = (
+    Job.id, Job.run_by_host, Job.workflow, Job.state, Job.input_json,
+    Job.output, Job.start_time, Job.launch_time, Job.owner, Job.evicted,
+    Job.cache_hits, Job.cache_misses
+) + tuple(getattr(Job, column) for column in USAGE_COLUMNS)
+
+
+def start_job(flask_app, jobid, pid):
+    """
+    Meant to run when a queued job gets its cwltool process launched,
+    in the runner's thread.
+    Returns False if the job was not queued anymore, which happens when
+    another server process cancels it.
+    """
+    started = False
     try:
         session = DB_SESSION()
-        # update job in db
-        job = session.merge(job)
-        job.state = state
-        job.output = output
+        started = session.query(Job).filter(
+            Job.id == jobid,
+            Job.state == State.Queued
+        ).update({
+            Job.state: State.Running,
+            Job.launch_time: func.now(),
+            Job.pid: pid
+        }, synchronize_session=False) == 1
         session.commit()
     except SQLAlchemyError as err:
         flask_app.logger.error(err)
@@ -71,3 +232,204 @@ def update_job(flask_app, job, state, output):
             session.rollback()
     finally:
         DB_SESSION.remove()
+    return started
+
+
+def transition_job(jobid, from_states, state):
+    """
+    Moves the job to state if it's in one of from_states, returns whether
+    the job was moved.
+    Raises SQLAlchemyError, it's meant to be used while serving requests.
+    """
+    session = DB_SESSION()
+    try:
+        moved = session.query(Job).filter(
+            Job.id == jobid,
+            Job.state.in_(from_states)
+        ).update({Job.state: state}, synchronize_session=False) == 1
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+    return moved
+
+
+def claim_job(jobid, supervisor, claimant):
+    """
+    Hands the job over to the server process with the identity claimant
+    if it's still live and looked after by supervisor, returns whether it
+    was.
+    Raises SQLAlchemyError.
+    """
+    session = DB_SESSION()
+    current = (Job.supervisor.is_(None) if supervisor is None
+               else Job.supervisor == supervisor)
+    try:
+        claimed = session.query(Job).filter(
+            Job.id == jobid,
+            Job.state.in_(LIVE_STATES),
+            current
+        ).update({Job.supervisor: claimant},
+                 synchronize_session=False) == 1
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+    return claimed
+
+
+def job_state(jobid):
+    """
+    Returns the state of the job as stored in the database.
+    Meant for response generators, which outlive the request's session
+    """
+    try:
+        row = DB_SESSION().query(Job.state).filter(Job.id == jobid).first()
+    finally:
+        DB_SESSION.remove()
+    return row.state if row else None
+
+
+def finished_job(state, output, output_index=None, usage=None, cache=None):
+    """
+    Returns the values of the columns of a job that finished, for
+    update_job and update_jobs. cache is the CacheStats of the job, if it
+    used the step cache
+    """
+    values = {
+        Job.state: state,
+        Job.output: output,
+        Job.output_index: output_index
+    }
+    for column in USAGE_COLUMNS:
+        values[getattr(Job, column)] = (usage or {}).get(column, None)
+    if cache is not None:
+        values[Job.cache_hits] = cache.hits
+        values[Job.cache_misses] = cache.misses
+    return values
+
+
+def update_job(flask_app, jobid, state, output, output_index=None,
+               usage=None):
+    """
+    Meant to run at the end of asynchronous tasks, in a separate thread,
+    which is why we can remove the per-thread db session
+    """
+    try:
+        update_jobs([(jobid, finished_job(state, output, output_index,
+                                          usage))])
+    except SQLAlchemyError as err:
+        flask_app.logger.error(err)
+    finally:
+        DB_SESSION.remove()
+
+
+def update_jobs(updates):
+    """
+    Applies the (jobid, {column: value}) updates in a single transaction.
+    Only the given columns are written, so the ones set by other processes
+    while the jobs ran are kept.
+    Raises SQLAlchemyError.
+    """
+    session = DB_SESSION()
+    try:
+        for jobid, values in updates:
+            session.query(Job).filter(Job.id == jobid).update(
+                values, synchronize_session=False)
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+
+
+def memoized_job(key, owner, since):
+    """
+    Returns the latest job of owner with the memo key that completed after
+    since, or None
+    """
+    finished = func.coalesce(Job.state_time, Job.start_time)
+    owned = Job.owner.is_(None) if owner is None else Job.owner == owner
+    return DB_SESSION().query(Job).filter(
+        Job.memo_key == key,
+        Job.state == State.Complete,
+        owned,
+        finished >= since
+    ).order_by(finished.desc()).first()
+
+
+def count_by_state():
+    """
+    Returns (state, number of jobs) for the states with any jobs
+    """
+    return DB_SESSION().query(Job.state, func.count(Job.id)).group_by(
+        Job.state).all()
+
+
+def workflow_stats(owner):
+    """
+    Returns, for each workflow owner ran, the resources used by its jobs,
+    only counting the jobs that got to run cwltool
+    """
+    cpu_time = Job.cpu_user + Job.cpu_system
+    return DB_SESSION().query(
+        Job.workflow,
+        func.count(Job.id).label(u'jobs'),
+        func.sum(Job.wall_time).label(u'wall_time'),
+        func.avg(Job.wall_time).label(u'mean_wall_time'),
+        func.max(Job.wall_time).label(u'max_wall_time'),
+        func.sum(cpu_time).label(u'cpu_time'),
+        func.avg(cpu_time).label(u'mean_cpu_time'),
+        func.max(Job.max_rss).label(u'max_rss'),
+        func.sum(Job.blocks_in).label(u'blocks_in'),
+        func.sum(Job.blocks_out).label(u'blocks_out')
+    ).filter(
+        Job.owner == owner,
+        Job.wall_time != None
+    ).group_by(Job.workflow).order_by(Job.workflow).all()
+
+
+def finished_job_dirs(node):
+    """
+    Returns (outdir, owner, time it finished) for the output directories
+    of the finished jobs of node that weren't evicted, oldest first.
+    Jobs sharing their outputs with a memoized run share the row.
+    """
+    finished = func.max(func.coalesce(Job.state_time, Job.start_time))
+    return DB_SESSION().query(
+        Job.outdir, Job.owner, finished.label(u'finished')
+    ).filter(
+        Job.node == node,
+        Job.outdir != None,
+        Job.state.in_((State.Complete, State.Error, State.Cancelled)),
+        or_(Job.evicted.is_(None), Job.evicted == False)
+    ).group_by(Job.outdir, Job.owner).order_by(finished).all()
+
+
+def cached_job_logs(node):
+    """
+    Returns the logs of the live jobs of node that use the step cache
+    """
+    return [row.logfile for row in DB_SESSION().query(Job.logfile).filter(
+        Job.node == node,
+        Job.step_cache == True,
+        Job.state.in_(LIVE_STATES),
+        Job.logfile != None
+    )]
+
+
+def evict_jobs(outdir):
+    """
+    Marks the jobs with their outputs in outdir as evicted, they can't be
+    memoized anymore either.
+    Raises SQLAlchemyError.
+    """
+    session = DB_SESSION()
+    try:
+        session.query(Job).filter(Job.outdir == outdir).update({
+            Job.evicted: True,
+            Job.memo_key: None
+        }, synchronize_session=False)
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        raise
@@ -0,0 +1,52 @@
+"""
+Parsing of the query parameters of the Flask views, and of the ASGI front
+end that answers some of them. The parsers raise ValueError for values
+that aren't valid.
+"""
+import math
+
+from workflow_service.log_store import tail_offset
+
+
+def boolean(value, default):
+    """
+    Returns the value of a boolean option, true or false, default if it
+    wasn't given
+    """
+    if value is None:
+        return default
+    if value not in (u'true', u'false'):
+        raise ValueError(u'Invalid boolean: {}'.format(value))
+    return value == u'true'
+
+
+def wait_seconds(value, max_wait):
+    """
+    Returns the seconds a status request may be held for with ?wait=,
+    up to max_wait
+    """
+    seconds = float(value)
+    if math.isnan(seconds) or math.isinf(seconds) or seconds < 0:
+        raise ValueError(u'Invalid wait: {}'.format(value))
+    return min(seconds, max_wait)
+
+
+def log_offset(logname, offset, tail=None):
+    """
+    Returns where to start sending the log from, given the offset and
+    the number of lines of the tail the client asked for, if any.
+    Raises ValueError if either is not a positive integer
+    """
+    offset = int(offset)
+    if offset < 0:
+        raise ValueError(u'Negative offset')
+    if tail is None:
+        return offset
+    tail = int(tail)
+    if tail < 0:
+        raise ValueError(u'Negative tail')
+    try:
+        return max(offset, tail_offset(logname, tail))
+    except IOError:
+        # there's no log yet, or anymore
+        return offset
@@ -0,0 +1,96 @@
+"""
+Identities of the server processes of a node.
+
+A pid alone doesn't tell a process apart from a later one that got the
+same pid, which is the rule rather than the exception for the servers of
+containers restarted in place, often pid 1. Identities are the pid and
+the time the process started, <pid>-<start time>, where the start time
+is the one in /proc/<pid>/stat. Without /proc they're just the pid.
+
+The cwltool processes of jobs are told apart by their working directory,
+the output directory of their job, see is_running.
+"""
+import errno
+import os
+
+
+def start_time(pid):
+    """
+    Returns when the process started, in clock ticks since boot, None if
+    it's gone or there's no /proc to tell
+    """
+    try:
+        with open(u'/proc/{}/stat'.format(pid), 'rb') as stat:
+            data = stat.read()
+    except (IOError, OSError):
+        return None
+    # the command name is in parentheses and may contain anything
+    fields = data[data.rfind(b')') + 2:].split()
+    try:
+        return int(fields[19])
+    except (IndexError, ValueError):
+        return None
+
+
+def identity(pid=None):
+    """
+    Returns the identity of the process pid, this one by default
+    """
+    if pid is None:
+        pid = os.getpid()
+    started = start_time(pid)
+    if started is None:
+        return u'{}'.format(pid)
+    return u'{}-{}'.format(pid, started)
+
+
+def pid_of(ident):
+    """
+    Returns the pid of the identity, None if it isn't one
+    """
+    try:
+        return int(u'{}'.format(ident).split(u'-', 1)[0])
+    except ValueError:
+        return None
+
+
+def is_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        # the process exists when we just aren't allowed to signal it
+        return err.errno == errno.EPERM
+    return True
+
+
+def is_identity_alive(ident):
+    """
+    Returns whether the process with the identity is still running, and
+    isn't another one that reused its pid
+    """
+    pid = pid_of(ident)
+    if not is_alive(pid):
+        return False
+    parts = u'{}'.format(ident).split(u'-', 1)
+    if len(parts) == 1:
+        return True
+    current = start_time(pid)
+    return current is None or u'{}'.format(current) == parts[1]
+
+
+def is_running(pid, outdir):
+    """
+    Returns whether pid is a process running in outdir, which tells apart
+    the cwltool process of a job from a new process that got its pid
+    """
+    if not is_alive(pid):
+        return False
+    try:
+        cwd = os.readlink(u'/proc/{}/cwd'.format(pid))
+    except OSError:
+        # zombies have no working directory, and without /proc the pid
+        # is all there is to go by
+        return not os.path.isdir(u'/proc/self')
+    return os.path.realpath(cwd) == os.path.realpath(outdir)
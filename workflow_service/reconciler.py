@@ -0,0 +1,123 @@
+"""
+Reconciliation of the jobs left behind by server processes that are gone.
+
+Each live job records the node it runs on and the identity of the server
+process looking after it, its supervisor, see workflow_service.processes.
+cwltool processes run in sessions of their own and write their output to
+a file, so they carry on when their supervisor goes away, and a new server
+process on the same node can claim its jobs:
+- queued jobs are handed back to it, to be queued again,
+- jobs whose cwltool process is still running are watched until it exits,
+- the rest get the results their process left on disk, or are marked as
+  Error if it didn't leave any.
+"""
+from threading import Thread
+from time import sleep
+
+from workflow_service.database import DB_SESSION
+from workflow_service.job_runner import output_file, read_output, succeeded
+from workflow_service.models import (
+    LIVE_STATES, Job, State, claim_job, job_state
+)
+from workflow_service.processes import (
+    identity, is_identity_alive, is_running, pid_of
+)
+
+# seconds between checks of the processes being watched
+WATCH_INTERVAL = 1
+
+
+def reconcile(node, requeue, finish, supervisor=None):
+    """
+    Claims the orphaned jobs of node for the server process with the
+    identity supervisor, this one by default. It's meant to run when the
+    server starts, before it looks after any job.
+    requeue(job) is called for each queued job, in the order they were
+    submitted, and finish(job, state, output) for each of the others once
+    its cwltool process is gone. job is a row with the columns of Job.
+    Returns the thread watching the processes that are still running,
+    None if there aren't any.
+    """
+    if supervisor is None:
+        supervisor = identity()
+
+    watched = []
+    for job in orphaned_jobs(node, supervisor):
+        if not claim_job(job.id, job.supervisor, supervisor):
+            # another server process got to it first
+            continue
+        if job.state == State.Queued:
+            requeue(job)
+        elif is_running(job.pid, job.outdir):
+            watched.append(job)
+        else:
+            _finish(job, finish)
+
+    if not watched:
+        return None
+    thread = Thread(target=_watch, args=(watched, finish))
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def orphaned_jobs(node, supervisor=None):
+    """
+    Returns the queued, running and paused jobs of node whose supervisor
+    is gone, for the process with the identity supervisor, this one by
+    default. Jobs of other processes with its pid are orphans too, they
+    were looked after by an earlier process that got the same pid
+    """
+    if supervisor is None:
+        supervisor = identity()
+    try:
+        jobs = DB_SESSION().query(Job).filter(
+            Job.node == node,
+            Job.state.in_(LIVE_STATES)
+        ).order_by(Job.start_time).all()
+        rows = [_row(job) for job in jobs]
+    finally:
+        DB_SESSION.remove()
+    return [row for row in rows if row.supervisor != supervisor and (
+        pid_of(row.supervisor) == pid_of(supervisor) or
+        not is_identity_alive(row.supervisor))]
+
+
+def collect(job):
+    """
+    Returns the state and output of the job whose cwltool process is gone,
+    from the output file and the log it left
+    """
+    if job_state(job.id) == State.Cancelled:
+        return State.Cancelled, {}
+    if job.outdir is None or job.logfile is None:
+        return State.Error, {}
+    output = read_output(output_file(job.outdir))
+    if isinstance(output, dict) and succeeded(job.logfile):
+        return State.Complete, output
+    return State.Error, {}
+
+
+def _finish(job, finish):
+    state, output = collect(job)
+    finish(job, state, output)
+
+
+def _watch(jobs, finish):
+    while jobs:
+        sleep(WATCH_INTERVAL)
+        for job in list(jobs):
+            if not is_running(job.pid, job.outdir):
+                jobs.remove(job)
+                _finish(job, finish)
+
+
+class _Row(object):  # pylint: disable=too-few-public-methods
+    # the columns of a job, usable once its session is gone
+    def __init__(self, **columns):
+        self.__dict__.update(columns)
+
+
+def _row(job):
+    return _Row(**{column.name: getattr(job, column.name)
+                   for column in Job.__table__.columns})
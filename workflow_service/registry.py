@@ -0,0 +1,134 @@
+"""
+Registry of job runners shared by all the server processes.
+
+Each process keeps its own runners in RUNNERS, while the database keeps
+the node, pid, log file and output directory of every job. That way any
+process on the same node can follow the log of a job or signal its cwltool
+process, regardless of which process started it.
+"""
+import os
+import socket
+from signal import SIGQUIT, SIGTSTP, SIGCONT
+
+from workflow_service.events import JOB_EVENTS
+from workflow_service.log_streamer import LOG_WATCHER
+from workflow_service.models import State, job_state, transition_job
+from workflow_service.processes import identity, is_running
+
+# jobid -> runner, only for the runners started by this process
+RUNNERS = dict()
+
+NODE = socket.gethostname()
+
+# action -> (states it can be applied to, resulting state)
+TRANSITIONS = {
+    u'cancel': ((State.Queued, State.Running, State.Paused), State.Cancelled),
+    u'pause': ((State.Running,), State.Paused),
+    u'resume': ((State.Paused,), State.Running)
+}
+
+
+def register(job, runner):
+    """
+    Records where the runner lives on the job, the caller has to commit it
+    """
+    job.node = NODE
+    job.supervisor = identity()
+    job.logfile = runner.logname
+    job.outdir = runner.outdir
+
+    RUNNERS[runner.uuid] = runner
+    runner.add_done_callback(unregister)
+
+
+def unregister(runner):
+    RUNNERS.pop(runner.uuid, None)
+    # the clients following the log can stop right away
+    LOG_WATCHER.wake(runner.logname)
+
+
+def runner_for(job):
+    """
+    Returns the runner of the job, or a proxy to it if it's run by another
+    process. Returns None if there isn't enough information to reach it.
+    """
+    runner = RUNNERS.get(job.id, None)
+    if runner is not None:
+        return runner
+    if job.logfile is None:
+        return None
+    return RemoteRunner(job)
+
+
+def control(job, action):
+    """
+    Applies action to the job, returns False if the job's state doesn't
+    allow it or the runner can't be reached from this process
+    """
+    from_states, state = TRANSITIONS[action]
+    if job.state not in from_states:
+        return False
+
+    runner = runner_for(job)
+    if runner is None:
+        return False
+    if isinstance(runner, RemoteRunner) and not runner.reachable():
+        return False
+
+    if not transition_job(job.id, from_states, state):
+        return False
+    getattr(runner, action)()
+    JOB_EVENTS.notify(job.id)
+    return True
+
+
+class RemoteRunner(object):
+    """
+    Stands in for a runner started by another server process, using what
+    the database knows about it
+    """
+    def __init__(self, job):
+        self.uuid = job.id
+        self.logname = job.logfile
+        self.outdir = job.outdir
+        self.node = job.node
+        self.pid = job.pid
+
+    @property
+    def state(self):
+        return job_state(self.uuid)
+
+    def reachable(self):
+        return self.node == NODE
+
+    def is_live(self):
+        return self.state in (State.Queued, State.Running, State.Paused)
+
+    def logspooler(self, offset=0):
+        return LOG_WATCHER.follow(self.logname, offset, self.is_live)
+
+    def cancel(self):
+        # a queued job has no process yet, its runner will find the job
+        # cancelled when it tries to start it
+        if self.pid is not None:
+            self._signal(SIGQUIT)
+            self._signal(SIGCONT)
+
+    def pause(self):
+        self._signal(SIGTSTP)
+
+    def resume(self):
+        self._signal(SIGCONT)
+
+    def _signal(self, signum):
+        # the pid may have gone to another process since cwltool exited
+        if self.pid is None or not is_running(self.pid, self.outdir):
+            return
+        try:
+            os.kill(self.pid, signum)
+        except OSError:
+            # the process is already gone
+            pass
+
+    def __repr__(self):
+        return u'RemoteRunner {}:\t{}@{}'.format(self.uuid, self.pid, self.node)
@@ -0,0 +1,189 @@
+"""
+Runners of the jobs of this server process.
+
+The runners are made with the callbacks that record the progress of their
+jobs: the process starting in the database, the results written in
+batches once it finishes, and the metrics of both. Jobs left behind by
+server processes that are gone are taken over at startup, see
+workflow_service.reconciler.
+"""
+import fcntl
+import os
+import tempfile
+from time import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from workflow_service import registry
+from workflow_service.database import DB_SESSION
+from workflow_service.events import JOB_EVENTS
+from workflow_service.locations import (
+    change_all_locations, index_outputs, url_location
+)
+from workflow_service.log_streamer import LOG_WATCHER
+from workflow_service.metrics import DURATION_BUCKETS
+from workflow_service.models import (
+    Job, State, finished_job, start_job, update_job
+)
+from workflow_service.reconciler import reconcile
+from workflow_service.step_cache import cache_stats
+
+
+class JobRunners(object):
+    """
+    Args:
+        flask_app: the app, for its configuration and logger.
+        runner_class: JobRunner or one of its subclasses.
+        executor: the JobExecutor the runners are submitted to.
+        writer: the JobWriter of the results of finished jobs.
+        metrics: the Registry the metrics of the runners are added to.
+        db_latency: histogram of the time spent in database queries.
+        workflow_cache: WorkflowCache the runners get the workflows from.
+        scratch_dir: where the jobs get a directory of their own.
+        step_cache: the StepCache jobs asking for it use, if any.
+        log_compressor: LogCompressor of the logs of finished jobs, if any.
+    """
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(self, flask_app, runner_class, executor, writer, metrics,
+                 db_latency, workflow_cache=None, scratch_dir=None,
+                 step_cache=None, log_compressor=None):
+        self.app = flask_app
+        self.runner_class = runner_class
+        self.executor = executor
+        self.writer = writer
+        self.workflow_cache = workflow_cache
+        self.scratch_dir = scratch_dir
+        self.step_cache = step_cache
+        self.log_compressor = log_compressor
+
+        self.job_duration = metrics.histogram(
+            u'workflow_service_job_seconds',
+            u'Time cwltool processes ran for, by the state they finished in',
+            (u'state',), buckets=DURATION_BUCKETS)
+        self.job_wait = metrics.histogram(
+            u'workflow_service_job_wait_seconds',
+            u'Time from the submission of jobs to the start of their process',
+            buckets=(0.1, 0.5) + DURATION_BUCKETS)
+        self.db_latency = db_latency
+        self.running_processes = metrics.gauge(
+            u'workflow_service_running_processes',
+            u'cwltool processes currently running')
+        self.queue_depth = metrics.gauge(
+            u'workflow_service_queued_runners',
+            u'Jobs waiting for a free slot on this node')
+
+    def submit(self, runners, owner):
+        self.executor.submit_all(runners, owner)
+        self.queue_depth.set(len(self.executor.queued()))
+
+    def compress_log(self, logname):
+        if self.log_compressor is not None and logname is not None:
+            self.log_compressor.compress(logname)
+
+    def make_runner(self, job):
+        """
+        Returns a runner for the queued job, registered on it
+        """
+        jobid = job.id
+        url_root = job.run_by_host
+        cachedir = None
+        if job.step_cache and self.step_cache is not None:
+            cachedir = self.step_cache.cachedir
+        # when the job was queued, and when its process started
+        times = [time(), None]
+
+        def on_finishing(job_runner):
+            state = State.Error
+            output = None
+            index = None
+            try:
+                output = url_location(url_root)(job_runner, str(jobid))
+                index = index_outputs(output)
+                state = job_runner.state
+            except Exception as err:  # pylint: disable=broad-except
+                self.app.logger.exception(err)
+
+            cache = None
+            if cachedir is not None:
+                cache = cache_stats(job_runner.logname)
+                self.step_cache.touch(cache.paths)
+
+            # the requests waiting for the job hear of it once it's written
+            self.writer.update(
+                jobid,
+                finished_job(state, output, index, job_runner.usage, cache),
+                then=lambda: JOB_EVENTS.notify(jobid))
+
+            self.queue_depth.set(len(self.executor.queued()))
+            if times[1] is not None:
+                self.running_processes.dec()
+                self.job_duration.observe(time() - times[1],
+                                          state=state.name)
+
+        def on_starting(job_runner):
+            times[1] = time()
+            self.job_wait.observe(times[1] - times[0])
+            self.running_processes.inc()
+            self.queue_depth.set(len(self.executor.queued()))
+            try:
+                with self.db_latency.time(query=u'start_job'):
+                    started = start_job(self.app, jobid, job_runner.pid)
+                if not started:
+                    # cancelled by another process while it was queued
+                    job_runner.cancel()
+            except SQLAlchemyError as err:
+                self.app.logger.error(err)
+            JOB_EVENTS.notify(jobid)
+
+        runner = self.runner_class(
+            job.workflow, job.input_json, jobid, on_finishing, on_starting,
+            workflow_cache=self.workflow_cache, scratch_dir=self.scratch_dir,
+            command=self.app.config.get(u'CWLTOOL_COMMAND', None),
+            cachedir=cachedir, parallel=bool(job.parallel))
+        registry.register(job, runner)
+        # after the clients following the log are woken up
+        runner.add_done_callback(
+            lambda job_runner: self.compress_log(job_runner.logname))
+        return runner
+
+    def adopt_orphans(self):
+        """
+        Takes over the jobs of this node left behind by server processes
+        that are gone, see workflow_service.reconciler. The server
+        processes of the node starting together take turns, the later
+        ones find nothing left to claim
+        """
+        lock_path = os.path.join(self.scratch_dir or tempfile.gettempdir(),
+                                 u'.reconcile.lock')
+        try:
+            with open(lock_path, 'a') as lock_file:
+                # released when the file is closed
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                return reconcile(registry.NODE, self.requeue_orphan,
+                                 self.finish_orphan)
+        except (IOError, OSError, SQLAlchemyError) as err:
+            self.app.logger.error(err)
+        return None
+
+    def requeue_orphan(self, orphan):
+        session = DB_SESSION()
+        try:
+            job = session.query(Job).get(orphan.id)
+            runner = self.make_runner(job)
+            session.commit()
+        except SQLAlchemyError as err:
+            self.app.logger.error(err)
+            session.rollback()
+            return
+        finally:
+            DB_SESSION.remove()
+        self.submit([runner], orphan.owner)
+
+    def finish_orphan(self, orphan, state, output):
+        output = change_all_locations(
+            output,
+            orphan.run_by_host[:-1] + u'/jobs/' + str(orphan.id) + u'/output')
+        update_job(self.app, orphan.id, state, output, index_outputs(output))
+        JOB_EVENTS.notify(orphan.id)
+        LOG_WATCHER.wake(orphan.logfile)
+        self.compress_log(orphan.logfile)
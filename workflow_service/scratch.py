@@ -0,0 +1,184 @@
+"""
+Garbage collection of the scratch directory.
+
+Each job gets a directory of its own in the scratch directory, with its
+log, its outputs and cwltool's temporary files. The collector deletes the
+directories of finished jobs, oldest first, when they're older than
+max_age seconds, when the directories of an owner's finished jobs take
+more than owner_quota bytes, or when the directories of all the jobs take
+more than quota bytes. The jobs are then marked as evicted, so their
+outputs are known to be gone.
+
+Only the directories of jobs run by this node, and inside the scratch
+directory, are ever deleted.
+"""
+from collections import namedtuple
+from datetime import datetime
+import logging
+import os
+import shutil
+from threading import Thread
+from time import sleep
+from uuid import UUID
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from workflow_service.database import DB_SESSION
+from workflow_service.models import evict_jobs, finished_job_dirs
+
+LOGGER = logging.getLogger(__name__)
+
+JobDir = namedtuple(u'JobDir', [u'path', u'owner', u'finished', u'size'])
+
+
+def dir_size(path):
+    """
+    Returns the bytes taken by the files under path
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                # deleted while walking
+                pass
+    return size
+
+
+def jobs_size(scratch_dir, sizes=None):
+    """
+    Returns the bytes taken by the job directories in scratch_dir, the ones
+    named after a job id, the rest of its contents aren't the service's.
+    sizes has the known sizes of some of them, by path
+    """
+    sizes = sizes or {}
+    used = 0
+    for name in os.listdir(scratch_dir):
+        try:
+            UUID(name)
+        except ValueError:
+            continue
+        path = os.path.join(scratch_dir, name)
+        if os.path.isdir(path):
+            used += sizes[path] if path in sizes else dir_size(path)
+    return used
+
+
+def to_evict(job_dirs, now, used=None, max_age=None, quota=None,
+             owner_quota=None):
+    """
+    Returns the paths of the JobDirs to evict. job_dirs must be sorted by
+    the time the jobs finished, used is the size of all the job
+    directories, see jobs_size
+    """
+    evicted = []
+
+    def evict(job_dir):
+        if job_dir.path not in evicted:
+            evicted.append(job_dir.path)
+
+    if max_age is not None:
+        for job_dir in job_dirs:
+            if (now - job_dir.finished).total_seconds() > max_age:
+                evict(job_dir)
+
+    if owner_quota is not None:
+        owned = dict()
+        for job_dir in job_dirs:
+            if job_dir.path not in evicted:
+                owned[job_dir.owner] = owned.get(job_dir.owner, 0) + job_dir.size
+        for job_dir in job_dirs:
+            if job_dir.path in evicted or owned[job_dir.owner] <= owner_quota:
+                continue
+            evict(job_dir)
+            owned[job_dir.owner] -= job_dir.size
+
+    if quota is not None and used is not None:
+        used -= sum(job_dir.size for job_dir in job_dirs
+                    if job_dir.path in evicted)
+        for job_dir in job_dirs:
+            if used <= quota:
+                break
+            if job_dir.path not in evicted:
+                evict(job_dir)
+                used -= job_dir.size
+
+    return evicted
+
+
+class ScratchCollector(object):
+    """
+    Args:
+        scratch_dir: directory where the jobs get their own directories.
+        node: node whose jobs are collected.
+        max_age: seconds the directory of a finished job is kept, None to
+                 keep it regardless of its age.
+        quota: bytes the directories of all the jobs may take, None for no
+               limit.
+        owner_quota: bytes the directories of the finished jobs of each
+                     owner may take, None for no limit.
+        interval: seconds between collections, once started.
+    """
+    # pylint: disable=too-many-arguments
+    def __init__(self, scratch_dir, node, max_age=None, quota=None,
+                 owner_quota=None, interval=600):
+        self.scratch_dir = os.path.realpath(scratch_dir)
+        self.node = node
+        self.max_age = max_age
+        self.quota = quota
+        self.owner_quota = owner_quota
+        self.interval = interval
+        # the directories of finished jobs don't change, their sizes are
+        # only computed once
+        self._sizes = dict()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._collect_forever)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _collect_forever(self):
+        while True:
+            sleep(self.interval)
+            try:
+                self.collect()
+            except (IOError, OSError, SQLAlchemyError) as err:
+                LOGGER.error(u'Couldn\'t collect the scratch directory: %s',
+                             err)
+
+    def collect(self):
+        """
+        Evicts the directories of the finished jobs the policy asks for,
+        returns their paths
+        """
+        try:
+            rows = finished_job_dirs(self.node)
+        finally:
+            DB_SESSION.remove()
+
+        job_dirs = []
+        for outdir, owner, finished in rows:
+            path = os.path.dirname(os.path.realpath(outdir))
+            if os.path.dirname(path) != self.scratch_dir:
+                continue
+            if path not in self._sizes:
+                self._sizes[path] = dir_size(path)
+            job_dirs.append(JobDir(outdir, owner, finished, self._sizes[path]))
+
+        used = None
+        if self.quota is not None:
+            used = jobs_size(self.scratch_dir, self._sizes)
+        evicted = to_evict(job_dirs, datetime.utcnow(), used, self.max_age,
+                           self.quota, self.owner_quota)
+        for outdir in evicted:
+            path = os.path.dirname(os.path.realpath(outdir))
+            shutil.rmtree(path, ignore_errors=True)
+            self._sizes.pop(path, None)
+            try:
+                evict_jobs(outdir)
+            finally:
+                DB_SESSION.remove()
+        return evicted
@@ -0,0 +1,40 @@
+"""
+Serialization of the payloads sent to clients, like job statuses.
+
+Enums are sent by name, UUIDs and datetimes as strings and decimals as
+floats. orjson is used when it's installed, it's much faster than the
+standard library for the large listings of jobs.
+"""
+from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+import json
+from uuid import UUID
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # pylint: disable=invalid-name
+
+
+def _default(obj):
+    if isinstance(obj, Enum):
+        return obj.name
+    if isinstance(obj, UUID):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        # what some databases return for sums and averages
+        return float(obj)
+    raise TypeError(u'{!r} is not JSON serializable'.format(obj))
+
+
+def dumps(obj):
+    """
+    Returns obj as a JSON string
+    """
+    if orjson is not None:
+        # orjson sends enums by value, the states' values are their names
+        return orjson.dumps(obj, default=_default).decode(u'utf-8')
+    return json.dumps(obj, default=_default)
@@ -1,19 +1,27 @@
 from __future__ import print_function
+from copy import deepcopy
+from datetime import datetime, timedelta
+from functools import partial
+import atexit
 import os
+import tempfile
+from threading import Lock
+from time import time
+from uuid import UUID, uuid4
+import zlib
 
 import json
-from future.utils import iteritems
 
 from flask import (
-    Response, request, redirect, abort, send_from_directory, jsonify
+    Response, request, redirect, abort, send_file, send_from_directory,
+    jsonify, stream_with_context, g
 )
 
 from aap_client.flask.decorators import jwt_optional, jwt_required, get_user
+from werkzeug.http import quote_etag
 from sqlalchemy.exc import SQLAlchemyError
 
-import workflow_service.make_enum_json_serializable  # pylint: disable=W0611
-
-from workflow_service import app, RUNNER_FOR
+from workflow_service import app
 
 # We need to initialize the database engine before importing the models and
 # its dependencies because what these depend on it being ready to go.
@@ -21,38 +29,145 @@ from workflow_service import app, RUNNER_FOR
 # establish the connection is gathered by Flask
 APP = app()
 
+from workflow_service.archive import ( # pylint: disable=C0413
+    ZIP_STREAMING, archive_entries, tar_stream, zip_stream
+)
 from workflow_service.database import DB_SESSION # pylint: disable=C0413
-from workflow_service.models import Job, State, update_job # pylint: disable=C0413
-from workflow_service.decorators import user_owns_job # pylint: disable=C0413
-from workflow_service.job_runner import JobRunner # pylint: disable=C0413
-
-
-# changes location from local filesystem to flask endpoint URL
-def url_location(url_root):
-    def new_locations(job_runner, jobid):
-        # replace locations in the outputs so web clients can retrieve all
-        # the outputs
-        output = job_runner.output if job_runner.output else {}
-        return change_all_locations(
-            output,
-            url_root[:-1] + u'/jobs/' + jobid + u'/output')
-    return new_locations
-
-
-def change_all_locations(obj, url_name):
-    if isinstance(obj, list):
-        for o_name, output in enumerate(obj):
-            change_all_locations(output, url_name + u'/' + str(o_name))
-    elif isinstance(obj, dict):
-        if 'location' not in obj:
-            for o_name, output in iteritems(obj):
-                change_all_locations(output, url_name + u'/' + o_name)
-        else:
-            obj[u'location'] = url_name
-    else:
-        APP.logger.warning(
-            u'Couldn\'t process output "%s" to change the locations', url_name)
-    return obj
+from workflow_service.models import ( # pylint: disable=C0413
+    LIVE_STATES, STATUS_COLUMNS, Job, State, count_by_state, current_etag,
+    job_etag, job_status, memoized_job, queue_position, queue_positions,
+    update_jobs, workflow_stats
+)
+from workflow_service.decorators import load_deferred, user_owns_job # pylint: disable=C0413
+from workflow_service.events import JOB_EVENTS, time_left, waits_for # pylint: disable=C0413
+from workflow_service.executor import JobExecutor # pylint: disable=C0413
+from workflow_service.log_store import ( # pylint: disable=C0413
+    LogCompressor, is_compressed
+)
+from workflow_service.log_streamer import ( # pylint: disable=C0413
+    compressed_events, sse_events
+)
+from workflow_service.locations import ( # pylint: disable=C0413
+    change_all_locations, index_outputs, isfile
+)
+from workflow_service.memo import memo_keys, outputs_exist # pylint: disable=C0413
+from workflow_service.metrics import ( # pylint: disable=C0413
+    Gauge, Registry
+)
+from workflow_service.params import ( # pylint: disable=C0413
+    boolean, log_offset, wait_seconds
+)
+from workflow_service.scratch import ScratchCollector # pylint: disable=C0413
+from workflow_service.serialization import dumps # pylint: disable=C0413
+from workflow_service.step_cache import StepCache # pylint: disable=C0413
+from workflow_service.job_runner import ( # pylint: disable=C0413
+    JobRunner, PrewarmedJobRunner, makedirs
+)
+from workflow_service.runners import JobRunners # pylint: disable=C0413
+from workflow_service.uploads import ( # pylint: disable=C0413
+    Staging, staged_job_order, staging_dir
+)
+from workflow_service.workflow_cache import WorkflowCache, packed_workflow # pylint: disable=C0413
+from workflow_service.writer import JobWriter # pylint: disable=C0413
+from workflow_service import registry # pylint: disable=C0413
+
+EXECUTOR = JobExecutor(
+    APP.config.get(u'MAX_RUNNING_JOBS', 4),
+    max_per_owner=APP.config.get(u'MAX_RUNNING_JOBS_PER_OWNER', None),
+    owner_limits=APP.config.get(u'OWNER_MAX_RUNNING_JOBS', None),
+    owner_weights=APP.config.get(u'OWNER_WEIGHTS', None))
+
+# 'subprocess' starts a new cwltool process for each job, 'prewarmed' forks
+# them from a process that has already imported cwltool
+RUNNER_FOR_MODE = {
+    u'subprocess': JobRunner,
+    u'prewarmed': PrewarmedJobRunner
+}
+RUNNER_CLASS = RUNNER_FOR_MODE[APP.config.get(u'RUNNER_MODE', u'subprocess')]
+
+METRICS = Registry(APP.config.get(u'METRICS_DIR', None))
+REQUEST_LATENCY = METRICS.histogram(
+    u'workflow_service_request_seconds',
+    u'Time taken to answer requests, until the response starts',
+    (u'route', u'method', u'status'))
+DB_LATENCY = METRICS.histogram(
+    u'workflow_service_db_seconds',
+    u'Time spent in database queries', (u'query',))
+LOG_STREAMS = METRICS.gauge(
+    u'workflow_service_log_streams',
+    u'Clients currently following a job log')
+# computed from the database when the metrics are collected
+JOBS = Gauge(METRICS, u'workflow_service_jobs', u'Jobs by state', (u'state',))
+
+WORKFLOW_CACHE = None
+if APP.config.get(u'WORKFLOW_CACHE_DIR', None):
+    WORKFLOW_CACHE = WorkflowCache(
+        APP.config[u'WORKFLOW_CACHE_DIR'],
+        ttl=APP.config.get(u'WORKFLOW_CACHE_TTL', 300),
+        max_bytes=APP.config.get(u'WORKFLOW_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+
+def timed_update_jobs(updates):
+    with DB_LATENCY.time(query=u'update_jobs'):
+        update_jobs(updates)
+
+
+# writes the results of the finishing jobs in batches
+JOB_WRITER = JobWriter(APP.config.get(u'DB_WRITE_DELAY', 0.05),
+                       APP.config.get(u'DB_WRITE_BATCH', 100),
+                       write=timed_update_jobs)
+atexit.register(JOB_WRITER.flush)
+
+# where the jobs get a directory of their own, and the policy to evict them
+SCRATCH_DIR = APP.config.get(u'SCRATCH_DIR', None) or tempfile.gettempdir()
+SCRATCH_COLLECTOR = ScratchCollector(
+    SCRATCH_DIR, registry.NODE,
+    max_age=APP.config.get(u'SCRATCH_MAX_AGE', None),
+    quota=APP.config.get(u'SCRATCH_QUOTA', None),
+    owner_quota=APP.config.get(u'SCRATCH_OWNER_QUOTA', None),
+    interval=APP.config.get(u'SCRATCH_GC_INTERVAL', 600))
+if any(limit is not None for limit in (SCRATCH_COLLECTOR.max_age,
+                                       SCRATCH_COLLECTOR.quota,
+                                       SCRATCH_COLLECTOR.owner_quota)):
+    SCRATCH_COLLECTOR.start()
+
+# cwltool's step cache, shared by the jobs of this node, and whether jobs
+# use it and run steps in parallel unless they ask otherwise
+STEP_CACHE = None
+if APP.config.get(u'STEP_CACHE_DIR', None):
+    makedirs(APP.config[u'STEP_CACHE_DIR'])
+    STEP_CACHE = StepCache(
+        APP.config[u'STEP_CACHE_DIR'],
+        max_bytes=APP.config.get(u'STEP_CACHE_MAX_BYTES', None),
+        min_age=APP.config.get(u'STEP_CACHE_MIN_AGE', 3600),
+        interval=APP.config.get(u'STEP_CACHE_GC_INTERVAL', 600),
+        node=registry.NODE)
+    if STEP_CACHE.max_bytes is not None:
+        STEP_CACHE.start()
+STEP_CACHE_BY_DEFAULT = APP.config.get(u'STEP_CACHE_BY_DEFAULT', False)
+PARALLEL_BY_DEFAULT = APP.config.get(u'PARALLEL_BY_DEFAULT', False)
+
+# gzips the logs of the jobs once they're finished
+LOG_COMPRESSOR = None
+if APP.config.get(u'COMPRESS_LOGS', True):
+    LOG_COMPRESSOR = LogCompressor(APP.config.get(u'LOG_COMPRESSION_LEVEL', 6))
+
+# makes the runners of the jobs, and takes over the orphaned ones
+JOB_RUNNERS = JobRunners(APP, RUNNER_CLASS, EXECUTOR, JOB_WRITER, METRICS,
+                         DB_LATENCY, workflow_cache=WORKFLOW_CACHE,
+                         scratch_dir=SCRATCH_DIR, step_cache=STEP_CACHE,
+                         log_compressor=LOG_COMPRESSOR)
+
+
+# number of rows fetched at a time when listing jobs
+JOBS_BATCH_SIZE = 100
+# number of ids looked up by a single query, SQLite takes up to 999
+STATUS_BATCH_SIZE = 500
+
+
+@APP.errorhandler(400)
+def bad_request(error):
+    return jsonify(error=400, text=str(error)), 400
 
 
 @APP.errorhandler(404)
@@ -60,6 +175,21 @@ def page_not_found(error):
     return jsonify(error=404, text=str(error)), 404
 
 
+@APP.errorhandler(409)
+def conflict(error):
+    return jsonify(error=409, text=str(error)), 409
+
+
+@APP.errorhandler(410)
+def gone(error):
+    return jsonify(error=410, text=str(error)), 410
+
+
+@APP.errorhandler(413)
+def too_large(error):
+    return jsonify(error=413, text=str(error)), 413
+
+
 @APP.errorhandler(500)
 def internal_error_handler(error):
     APP.logger.exception(error)
@@ -76,6 +206,33 @@ def shutdown_session(exception=None):  # pylint: disable=unused-argument
     DB_SESSION.remove()
 
 
+@APP.before_request
+def start_timer():
+    g.request_start = time()
+
+
+@APP.after_request
+def record_latency(response):
+    if u'request_start' in g:
+        rule = request.url_rule.rule if request.url_rule else u'unmatched'
+        REQUEST_LATENCY.observe(time() - g.request_start, route=rule,
+                                method=request.method,
+                                status=str(response.status_code))
+    return response
+
+
+@APP.route(u'/metrics', methods=[u'GET'])
+def get_metrics():
+    try:
+        with DB_LATENCY.time(query=u'count_by_state'):
+            jobs = count_by_state()
+    except SQLAlchemyError:
+        return abort(500)
+    states = {JOBS.key(state=state.name): count for state, count in jobs}
+    return Response(METRICS.exposition([(JOBS, states)]),
+                    mimetype=u'text/plain; version=0.0.4')
+
+
 @APP.route(u'/health', methods=[u'GET'])
 def health_report():
     return Response('It\'s alive!')
@@ -84,42 +241,193 @@ def health_report():
 @APP.route(u'/run', methods=[u'POST'])
 @jwt_optional
 def run_workflow():
+    """
+    Runs the workflow in ?wf= with the job order in the body, or with the
+    job order and the files uploaded in a multipart/form-data body, see
+    workflow_service.uploads
+    """
     path = request.args[u'wf']
-    current_user = get_user()
-    body = request.stream.read().decode(u'utf-8')
-    url_root = request.url_root
+    jobid = uuid4()
+    staging = None
+    if request.mimetype == u'multipart/form-data':
+        staging = Staging(staging_dir(SCRATCH_DIR, jobid),
+                          APP.config.get(u'MAX_UPLOAD_BYTES',
+                                         1024 * 1024 * 1024))
+        body = staged_job_order(
+            request.environ, staging,
+            APP.config.get(u'MAX_JOB_ORDER_BYTES', 16 * 1024 * 1024))
+    else:
+        body = request.stream.read().decode(u'utf-8')
 
-    session = DB_SESSION()
+    created = False
     try:
-        job = Job(path, body, request.url_root, current_user)
-        session.add(job)
-        session.commit()
+        jobids, runners = create_runs(path, [body], [jobid])
+        # memoized runs are copies of another job, with another id
+        created = jobids[0] == jobid
     except SQLAlchemyError:
-        session.rollback()
         return internal_error_handler(
             u'Internal error: could not access persistence layer. ' +
             u'Please try again. If the error persists contact an admin.'
         )
+    finally:
+        # the uploads are only kept for the job that's going to use them,
+        # not when it's aborted with a bad option or fails to be stored
+        if staging is not None and not created:
+            staging.discard()
+    JOB_RUNNERS.submit(runners, get_user())
 
-    def on_finishing(job_runner):
-        state = State.Error
-        output = None
-        try:
-            output = url_location(url_root)(job_runner, str(job.id))
-            state = job_runner.state
-        except Exception as err:  # pylint: disable=broad-except
-            APP.logger.exception(err)
+    return redirect(u'/jobs/{}'.format(jobids[0]), code=303)
 
-        try:
-            update_job(APP, job, state, output)
-        except SQLAlchemyError as err:
-            APP.logger.error(err)
 
-    runner = JobRunner(path, body, job.id, on_finishing)
-    RUNNER_FOR[job.id] = runner
-    runner.start()
+@APP.route(u'/runs', methods=[u'POST'])
+@jwt_optional
+def run_workflows():
+    """
+    Runs the workflow in ?wf= once for each job order in the body, which
+    is either a JSON array or newline-delimited JSON objects.
+    Returns the list of the URLs of the jobs, in the same order.
+    """
+    path = request.args[u'wf']
+    try:
+        bodies = job_orders(request.stream.read().decode(u'utf-8'))
+    except ValueError:
+        return abort(400)
+    if not bodies:
+        return abort(400)
 
-    return redirect(u'/jobs/{}'.format(job.id), code=303)
+    try:
+        jobids, runners = create_runs(path, bodies)
+    except SQLAlchemyError:
+        return internal_error_handler(
+            u'Internal error: could not access persistence layer. ' +
+            u'Please try again. If the error persists contact an admin.'
+        )
+    JOB_RUNNERS.submit(runners, get_user())
+
+    url_root = request.url_root[:-1]
+    return Response(
+        dumps([u'{}/jobs/{}'.format(url_root, jobid) for jobid in jobids]),
+        mimetype='application/json')
+
+
+def job_orders(body):
+    """
+    Splits a JSON array or newline-delimited JSON objects in job orders,
+    raises ValueError if any of them isn't a JSON object
+    """
+    if body.lstrip().startswith(u'['):
+        orders = json.loads(body)
+    else:
+        orders = [json.loads(line) for line in body.splitlines()
+                  if line.strip()]
+    if not all(isinstance(order, dict) for order in orders):
+        raise ValueError(u'Job orders must be JSON objects')
+    return [json.dumps(order) for order in orders]
+
+
+def create_runs(path, bodies, jobids=None):
+    """
+    Creates a job of the workflow at path for each job order in bodies, all
+    in a single transaction, and returns their ids and the runners that
+    have to be submitted. New jobs get the ids in jobids, if given.
+    Identical runs reuse the results of a previous one when MEMOIZE is on,
+    unless the client asks for new runs with ?memoize=false.
+    ?cache= and ?parallel= turn the step cache and parallel steps on or
+    off for the new runs.
+    Raises SQLAlchemyError if the jobs can't be stored.
+    """
+    owner = get_user()
+    url_root = request.url_root
+    try:
+        step_cache = boolean(request.args.get(u'cache', None),
+                             STEP_CACHE_BY_DEFAULT) and STEP_CACHE is not None
+        parallel = boolean(request.args.get(u'parallel', None),
+                           PARALLEL_BY_DEFAULT)
+    except ValueError:
+        abort(400)
+
+    keys = [None] * len(bodies)
+    if APP.config.get(u'MEMOIZE', False):
+        # the packed workflow comes from the cache the runners use
+        keys = memo_keys(path, bodies,
+                         partial(packed_workflow, cache=WORKFLOW_CACHE))
+    memoize = request.args.get(u'memoize', u'true') != u'false'
+
+    session = DB_SESSION()
+    new_ids = jobids or [None] * len(bodies)
+    jobids = []
+    runners = []
+    try:
+        for body, key, new_id in zip(bodies, keys, new_ids):
+            jobid = None
+            if key is not None and memoize:
+                jobid = clone_memoized(path, body, owner, key, url_root)
+            if jobid is None:
+                jobid, runner = new_run(path, body, owner, key, url_root,
+                                        step_cache, parallel, new_id)
+                runners.append(runner)
+            jobids.append(jobid)
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        for runner in runners:
+            registry.unregister(runner)
+        raise
+    return jobids, runners
+
+
+def new_run(path, body, owner, key, url_root, step_cache=False,
+            parallel=False, jobid=None):
+    # pylint: disable=too-many-arguments
+    """
+    Adds a queued job to the session, and returns its id and its runner
+    """
+    job = Job(path, body, url_root, owner)
+    # the id is set here so the runner's callbacks don't need to load it
+    job.id = jobid or uuid4()
+    job.memo_key = key
+    job.step_cache = step_cache
+    job.parallel = parallel
+    runner = JOB_RUNNERS.make_runner(job)
+    DB_SESSION().add(job)
+    return job.id, runner
+
+
+def clone_memoized(path, body, owner, key, url_root):
+    """
+    Adds a complete job with the results of the latest run of owner with
+    the memo key to the session, if its outputs are still on disk, and
+    returns its id.
+    Runs older than MEMO_MAX_AGE seconds, or whose outputs are gone, are
+    not reused, the latter lose their key so they're not checked again.
+    Returns None if there's no run to reuse.
+    """
+    session = DB_SESSION()
+    since = datetime.utcnow() - timedelta(
+        seconds=APP.config.get(u'MEMO_MAX_AGE', 24 * 60 * 60))
+    while True:
+        earlier = memoized_job(key, owner, since)
+        if earlier is None:
+            return None
+        if outputs_exist(earlier.output):
+            break
+        earlier.memo_key = None
+        session.flush()
+
+    job = Job(path, body, url_root, owner)
+    job.id = uuid4()
+    job.memo_key = key
+    job.state = State.Complete
+    job.output = change_all_locations(
+        deepcopy(earlier.output),
+        url_root[:-1] + u'/jobs/' + str(job.id) + u'/output')
+    job.output_index = index_outputs(job.output)
+    # the log and outputs are the earlier job's, they're shared
+    job.node = earlier.node
+    job.logfile = earlier.logfile
+    job.outdir = earlier.outdir
+    session.add(job)
+    return job.id
 
 
 @APP.route(u'/jobs/<uuid:jobid>',
@@ -127,25 +435,149 @@ def run_workflow():
            strict_slashes=False)
 @jwt_optional
 @user_owns_job
-def job_control(jobid):
-    job = job_from_id(jobid)
-    return json.dumps(job.status()), 200, u''
+def job_control(jobid):  # pylint: disable=unused-argument
+    """
+    Supports conditional requests, the ETag changes with the state of the
+    job. With ?wait=<seconds> the request is held until the job changes
+    state, or the time runs out; clients sending If-None-Match wait for
+    a state other than the one they already have. Finished jobs are
+    answered right away, they won't change.
+    """
+    job = g.job
+    # the body and the ETag share the position of a queued job
+    position = queue_position(job) if job.state == State.Queued else None
+    etag = job_etag(job, position)
+
+    wait = request.args.get(u'wait', None)
+    if wait is not None:
+        try:
+            wait = wait_seconds(wait, APP.config.get(u'MAX_STATUS_WAIT', 60))
+        except ValueError:
+            return abort(400)
+        if (waits_for(request.if_none_match, etag) and
+                job.state in LIVE_STATES):
+            etag = wait_for_change(job, etag, wait)
+            position = None
+
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={u'ETag': quote_etag(etag)})
+
+    load_deferred(job, u'input_json', u'output')
+    return (dumps(job_status(job, position)), 200,
+            {u'ETag': quote_etag(etag), u'Content-Type': u'application/json'})
+
+
+def wait_for_change(job, etag, timeout):
+    """
+    Waits until the ETag of the job is not etag anymore, or timeout seconds
+    pass, and returns the current ETag. Only jobs run by this process wake
+    up the request, the rest are checked again once the time runs out.
+    """
+    session = DB_SESSION()
+    deadline = time() + timeout
+    changed = JOB_EVENTS.listen(job.id)
+    try:
+        while True:
+            # releases the connection while waiting, and reloads the job
+            # once it's accessed again
+            session.rollback()
+            current = current_etag(job.id)
+            remaining = time_left(etag, current, deadline)
+            if not remaining:
+                return current
+            changed.wait(remaining)
+            changed.clear()
+    finally:
+        JOB_EVENTS.forget(job.id, changed)
 
 
 @APP.route(u'/jobs/<uuid:jobid>/log', methods=[u'GET'])
 @jwt_optional
 @user_owns_job
-def get_log(jobid):
-    return Response(RUNNER_FOR[jobid].logspooler(), mimetype='text/event-stream')
+def get_log(jobid):  # pylint: disable=unused-argument
+    if g.job.evicted:
+        return abort(410)
+    runner = registry.runner_for(g.job)
+    if runner is None:
+        return abort(404)
 
+    # clients resume from the id of the last event they got, ?tail= starts
+    # at most that many lines from the end
+    try:
+        offset = log_offset(
+            runner.logname,
+            request.args.get(u'offset',
+                             request.headers.get(u'Last-Event-ID', 0)),
+            request.args.get(u'tail', None))
+    except ValueError:
+        return abort(400)
+
+    headers = {u'Cache-Control': u'no-cache', u'Vary': u'Accept-Encoding'}
+    # finished logs are sent compressed, live ones can't wait for a
+    # compressor's buffer to fill
+    compressed = (is_compressed(runner.logname) and
+                  u'gzip' in request.accept_encodings)
+    if compressed:
+        headers[u'Content-Encoding'] = u'gzip'
+    if compressed and offset == 0:
+        # the whole log is sent as it's kept, once it has been compressed
+        try:
+            events = compressed_events(
+                runner.logname, APP.config.get(u'LOG_COMPRESSION_LEVEL', 6))
+        except (IOError, OSError) as err:
+            APP.logger.warning(u'Couldn\'t store the events of %s: %s',
+                               runner.logname, err)
+        else:
+            response = send_file(events, mimetype=u'text/event-stream',
+                                 cache_timeout=0)
+            for name, value in headers.items():
+                response.headers[name] = value
+            return response
 
-@APP.route(u'/jobs/<uuid:jobid>/output/<path:outputid>', methods=[u'GET'])
+    events = counted_stream(sse_events(runner.logspooler(offset), offset))
+    if compressed:
+        events = gzipped(events)
+    return Response(events, mimetype='text/event-stream', headers=headers)
+
+
+def counted_stream(events):
+    # keeps count of the clients following logs
+    LOG_STREAMS.inc()
+    try:
+        for event in events:
+            yield event
+    finally:
+        LOG_STREAMS.dec()
+
+
+@APP.route(u'/jobs/<uuid:jobid>/<any(cancel, pause, resume):action>',
+           methods=[u'POST'])
 @jwt_optional
 @user_owns_job
-def get_output(jobid, outputid):
-    job = job_from_id(jobid)
+def job_action(jobid, action):  # pylint: disable=unused-argument
+    job = g.job
+    try:
+        if not registry.control(job, action):
+            return abort(409)
+    except SQLAlchemyError:
+        return abort(500)
+
+    return redirect(u'/jobs/{}'.format(job.id), code=303)
+
 
-    output = getoutputobj(job.status(), outputid)
+@APP.route(u'/jobs/<uuid:jobid>/output/<path:outputid>', methods=[u'GET'])
+@jwt_optional
+@user_owns_job(load=(u'output_index',))
+def get_output(jobid, outputid):  # pylint: disable=unused-argument
+    job = g.job
+    if job.evicted:
+        # deleted by the scratch collector
+        return abort(410)
+    if job.output_index is not None:
+        output = job.output_index.get(outputid, None)
+    else:
+        # finished before outputs were indexed
+        output = getoutputobj({u'output': job.output}, outputid)
     if not output or not isfile(output):
         return abort(404)
 
@@ -153,14 +585,151 @@ def get_output(jobid, outputid):
     if not path or not filename:
         return abort(404)
 
-    return send_from_directory(path, filename, attachment_filename=wf_filename)
+    # conditional responses answer Range requests, and the file is handed
+    # to the WSGI server's file wrapper, or to the web server when
+    # USE_X_SENDFILE is set
+    return send_from_directory(path, filename, attachment_filename=wf_filename,
+                               conditional=True)
+
+
+@APP.route(u'/jobs/<uuid:jobid>/outputs.<any(tar, zip):archive>',
+           methods=[u'GET'])
+@jwt_optional
+@user_owns_job(load=(u'output',))
+def get_outputs_archive(jobid, archive):
+    """
+    Streams all the outputs of a finished job in a single archive
+    """
+    job = g.job
+    if job.state != State.Complete:
+        return abort(409)
+    if job.evicted:
+        return abort(410)
+    if archive == u'zip' and not ZIP_STREAMING:
+        return abort(501)
+
+    entries = list(archive_entries(job.output))
+    if not all(os.path.exists(path) for _, path in entries):
+        return abort(404)
+
+    stream = tar_stream if archive == u'tar' else zip_stream
+    return Response(stream(entries),
+                    mimetype=u'application/x-tar' if archive == u'tar'
+                    else u'application/zip',
+                    headers={u'Content-Disposition':
+                             u'attachment; filename={}.{}'.format(jobid,
+                                                                  archive)})
 
 
 @APP.route(u'/jobs', methods=[u'GET'], strict_slashes=False)
 @jwt_required
 def get_jobs():
-    jobs = jobs_from_owner(get_user())
-    return Response(spool(jobs), mimetype='application/json')
+    """
+    Lists the jobs of the user, oldest first. Accepts:
+        after: id of the last job of the previous page
+        limit: maximum number of jobs to list, JOBS_PAGE_SIZE by default
+               and never more than MAX_JOBS_PAGE_SIZE
+        state: only list jobs in this state, can be repeated
+        since, until: only list jobs started in this time range, as
+                      ISO 8601 UTC dates or datetimes
+    """
+    args = request.args
+    try:
+        after = UUID(args[u'after']) if u'after' in args else None
+        limit = (int(args[u'limit']) if u'limit' in args
+                 else APP.config.get(u'JOBS_PAGE_SIZE', 100))
+        states = [State[state] for state in args.getlist(u'state')]
+        since = parse_time(args[u'since']) if u'since' in args else None
+        until = parse_time(args[u'until']) if u'until' in args else None
+    except (KeyError, ValueError):
+        return abort(400)
+    if limit < 1:
+        return abort(400)
+    limit = min(limit, APP.config.get(u'MAX_JOBS_PAGE_SIZE', 1000))
+
+    jobs = jobs_from_owner(get_user(), after=after, limit=limit,
+                           states=states, since=since, until=until)
+    listing = spool(jobs)
+    headers = {u'Vary': u'Accept-Encoding'}
+    if u'gzip' in request.accept_encodings:
+        listing = gzipped(listing)
+        headers[u'Content-Encoding'] = u'gzip'
+    return Response(stream_with_context(listing),
+                    mimetype='application/json', headers=headers)
+
+
+@APP.route(u'/jobs/status', methods=[u'POST'])
+@jwt_optional
+def get_statuses():
+    """
+    Looks up many jobs at once. The body is a JSON array of job ids, the
+    response maps the ids of the jobs the user can see to their state, or
+    to their whole status with ?full=true. Unknown ids are left out.
+    """
+    try:
+        jobids = json.loads(request.stream.read().decode(u'utf-8'))
+        if not isinstance(jobids, list):
+            return abort(400)
+        jobids = [UUID(jobid) for jobid in jobids]
+    except (TypeError, ValueError, AttributeError):
+        return abort(400)
+    full = request.args.get(u'full', u'false') == u'true'
+
+    try:
+        jobs = jobs_from_ids(get_user(), jobids, full)
+    except SQLAlchemyError:
+        return abort(500)
+
+    if full:
+        positions = queue_positions(jobs)
+        statuses = {str(job.id): job_status(job, positions.get(job.id))
+                    for job in jobs}
+    else:
+        statuses = {str(job.id): job.state for job in jobs}
+    return Response(dumps(statuses), mimetype='application/json')
+
+
+def jobs_from_ids(owner, jobids, full=False):
+    """
+    Returns the jobs with the ids that owner can see, as rows with their id
+    and state, or with the STATUS_COLUMNS when full.
+    The ids are looked up with IN queries of STATUS_BATCH_SIZE ids each.
+    """
+    session = DB_SESSION()
+    columns = STATUS_COLUMNS if full else (Job.id, Job.state)
+    jobids = list(set(jobids))
+    jobs = []
+    for start in range(0, len(jobids), STATUS_BATCH_SIZE):
+        jobs.extend(session.query(*columns).filter(
+            Job.id.in_(jobids[start:start + STATUS_BATCH_SIZE]),
+            (Job.owner == owner) | (Job.owner == None)
+        ))
+    return jobs
+
+
+@APP.route(u'/workflows/stats', methods=[u'GET'])
+@jwt_required
+def get_workflow_stats():
+    """
+    Resources used by the jobs of the user, added up for each workflow:
+    seconds of wall and CPU time, peak memory in kilobytes and blocks of
+    512 bytes read and written
+    """
+    try:
+        stats = workflow_stats(get_user())
+    except SQLAlchemyError:
+        return abort(500)
+    return Response(dumps([row._asdict() for row in stats]),  # pylint: disable=W0212
+                    mimetype='application/json')
+
+
+def parse_time(value):
+    for time_format in (u'%Y-%m-%dT%H:%M:%S', u'%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    raise ValueError(u'Unknown time format: ' + value)
 
 
 def getoutputobj(status, outputid):
@@ -179,46 +748,121 @@ def getoutputobj(status, outputid):
         return None
 
 
-def isfile(obj):
-    return isinstance(obj, dict) and u'path' in obj and u'basename' in obj
-
-
 def getfile(file_dict):
     return os.path.split(file_dict[u'path']), file_dict[u'basename']
 
 
-def job_from_id(jobid):
-    return _filter_jobs(Job.id, jobid).first()
-
-
-def jobs_from_owner(owner):
-    return _filter_jobs(Job.owner, owner)
-
-
-def _filter_jobs(key, value):
-    jobs = []
-
+# pylint: disable=too-many-arguments
+def jobs_from_owner(owner, after=None, limit=None, states=None,
+                    since=None, until=None):
+    """
+    Returns the status columns of the jobs of owner, ordered by start time
+    and fetched in batches, without going through the identity map.
+    Pages are delimited with after, the id of the last job of the
+    previous page.
+    """
     try:
         session = DB_SESSION()
-        jobs = session.query(Job).filter(key == value)
+        jobs = session.query(*STATUS_COLUMNS).filter(Job.owner == owner)
+        if states:
+            jobs = jobs.filter(Job.state.in_(states))
+        if since is not None:
+            jobs = jobs.filter(Job.start_time >= since)
+        if until is not None:
+            jobs = jobs.filter(Job.start_time < until)
+        if after is not None:
+            last = session.query(Job.start_time).filter(
+                Job.owner == owner, Job.id == after)
+            if last.first() is None:
+                abort(400)
+            # compare in the database, start times don't always survive
+            # the round trip through python unchanged
+            last = last.as_scalar()
+            jobs = jobs.filter(
+                (Job.start_time > last) |
+                ((Job.start_time == last) & (Job.id > after))
+            )
+        jobs = jobs.order_by(Job.start_time, Job.id)
+        if limit is not None:
+            jobs = jobs.limit(limit)
     except SQLAlchemyError:
         abort(500)
 
-    return jobs
+    return timed_rows(jobs.yield_per(JOBS_BATCH_SIZE), u'list_jobs')
+
+
+def timed_rows(rows, query):
+    # yields the rows, recording the time spent fetching them
+    elapsed = 0
+    rows = iter(rows)
+    while True:
+        start = time()
+        try:
+            row = next(rows)
+        except StopIteration:
+            break
+        finally:
+            elapsed += time() - start
+        yield row
+    DB_LATENCY.observe(elapsed, query=query)
 
 
 def spool(jobs):
+    # yields the listing a batch of jobs at a time
     yield u'['
     connector = u''
+    batch = []
     for job in jobs:
-        yield connector + json.dumps(job.status())
-        if connector == u'':
+        batch.append(job)
+        if len(batch) == JOBS_BATCH_SIZE:
+            yield connector + dump_statuses(batch)
             connector = u', '
+            batch = []
+    if batch:
+        yield connector + dump_statuses(batch)
     yield u']'
 
 
+def dump_statuses(jobs):
+    positions = queue_positions(jobs)
+    return u', '.join(dumps(job_status(job, positions.get(job.id)))
+                      for job in jobs)
+
+
+def gzipped(chunks):
+    # compresses the chunks as they come, for clients accepting gzip
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode(u'utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+STARTED = False
+START_LOCK = Lock()
+
+
+@APP.before_first_request
+def start():
+    """
+    Takes over the jobs left behind by the server processes of the node
+    that are gone. Whatever serves the app calls it once before serving,
+    main and the ASGI lifespan do, other WSGI servers get it before the
+    first request
+    """
+    global STARTED  # pylint: disable=global-statement
+    with START_LOCK:
+        if STARTED:
+            return
+        STARTED = True
+    if APP.config.get(u'RECONCILE_ON_START', True):
+        JOB_RUNNERS.adopt_orphans()
+
+
 def main():
     # APP.debug = True
+    start()
     APP.run(u'0.0.0.0')
 
 
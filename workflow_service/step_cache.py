@@ -0,0 +1,211 @@
+"""
+cwltool's step cache, shared by the jobs of a node.
+
+Jobs run with --cachedir reuse the outputs of the steps any earlier job ran
+with the same inputs. Each step gets a directory in the cache, named after
+a hash of its inputs, with a <hash>.<thread>.pending file next to it while
+it's being written. cwltool never deletes them, so the cache is trimmed
+here to max_bytes, least recently used entries first.
+
+A step read from the cache doesn't change its directory, so the entries
+the jobs hit are touched once they finish, see cache_stats. Entries used
+in the last min_age seconds are kept regardless of the size of the cache,
+and so are the ones the live jobs of the node have logged so far, as they
+may still be reading or writing them.
+"""
+from collections import namedtuple
+import logging
+import os
+import re
+import shutil
+from threading import Lock, Thread
+from time import sleep, time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from workflow_service.database import DB_SESSION
+from workflow_service.models import cached_job_logs
+from workflow_service.scratch import dir_size
+
+LOGGER = logging.getLogger(__name__)
+
+# cwltool logs one of them for each step it runs with --cachedir
+_HIT = re.compile(br'\[job [^\]]*\] Using cached output in (.+)$')
+_MISS = re.compile(br'\[job [^\]]*\] Output of job will be cached in (.+)$')
+
+CacheStats = namedtuple(u'CacheStats', [u'hits', u'misses', u'paths'])
+
+CacheEntry = namedtuple(u'CacheEntry', [u'path', u'used', u'size'])
+
+
+def cache_stats(logname):
+    """
+    Returns the CacheStats of the job that logged to logname: how many
+    steps were read from the cache and how many ran, and the paths of the
+    entries it used
+    """
+    hits = misses = 0
+    paths = []
+    try:
+        with open(logname, 'rb') as log:
+            for line in log:
+                line = line.rstrip()
+                match = _HIT.search(line)
+                if match:
+                    hits += 1
+                else:
+                    match = _MISS.search(line)
+                    if not match:
+                        continue
+                    misses += 1
+                paths.append(match.group(1).decode(u'utf-8', u'replace'))
+    except (IOError, OSError):
+        pass
+    return CacheStats(hits, misses, paths)
+
+
+def to_trim(entries, now, max_bytes, min_age=0, in_use=()):
+    """
+    Returns the paths of the CacheEntries to delete so the cache takes no
+    more than max_bytes, least recently used first, sparing the ones used
+    in the last min_age seconds and the ones with their paths in in_use
+    """
+    used = sum(entry.size for entry in entries)
+    trimmed = []
+    for entry in sorted(entries, key=lambda entry: entry.used):
+        if used <= max_bytes:
+            break
+        if now - entry.used < min_age or entry.path in in_use:
+            continue
+        trimmed.append(entry.path)
+        used -= entry.size
+    return trimmed
+
+
+class StepCache(object):
+    """
+    Args:
+        cachedir: directory handed to cwltool with --cachedir.
+        max_bytes: bytes the cache may take, None for no limit.
+        min_age: seconds an entry is kept after it was last used.
+        interval: seconds between trims, once started.
+        node: the node whose live jobs' entries are kept, None to only go
+              by min_age.
+    """
+    def __init__(self, cachedir, max_bytes=None, min_age=3600,
+                 interval=600, node=None):
+        self.cachedir = os.path.realpath(cachedir)
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.interval = interval
+        self.node = node
+        # finished entries don't change, their sizes are only computed once
+        self._sizes = dict()
+        self._lock = Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._trim_forever)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _trim_forever(self):
+        while True:
+            sleep(self.interval)
+            try:
+                self.trim()
+            except (IOError, OSError) as err:
+                LOGGER.error(u'Couldn\'t trim the step cache: %s', err)
+
+    def touch(self, paths):
+        """
+        Marks the entries at paths as just used
+        """
+        for path in paths:
+            if os.path.dirname(os.path.realpath(path)) != self.cachedir:
+                continue
+            try:
+                os.utime(path, None)
+            except OSError:
+                # trimmed in the meantime
+                pass
+
+    def in_use(self):
+        """
+        Returns the paths of the entries the live jobs of the node have hit
+        or are writing, from their logs.
+        Raises SQLAlchemyError
+        """
+        if self.node is None:
+            return set()
+        try:
+            lognames = cached_job_logs(self.node)
+        finally:
+            DB_SESSION.remove()
+        return set(os.path.realpath(path) for logname in lognames
+                   for path in cache_stats(logname).paths)
+
+    def entries(self):
+        """
+        Returns the CacheEntries of the cache, with the .pending files of
+        the ones being written, or left behind by steps that failed
+        """
+        names = os.listdir(self.cachedir)
+        pending = dict()
+        for name in names:
+            if name.endswith(u'.pending'):
+                key = name.split(u'.', 1)[0]
+                pending.setdefault(key, []).append(name)
+
+        entries = []
+        for name in names:
+            path = os.path.join(self.cachedir, name)
+            if u'.' in name or not os.path.isdir(path):
+                continue
+            try:
+                used = os.stat(path).st_mtime
+                for pending_name in pending.get(name, []):
+                    used = max(used, os.stat(
+                        os.path.join(self.cachedir, pending_name)).st_mtime)
+            except OSError:
+                continue
+            if name in pending:
+                # still being written, it's sized again next time
+                size = dir_size(path)
+            else:
+                if path not in self._sizes:
+                    self._sizes[path] = dir_size(path)
+                size = self._sizes[path]
+            entries.append(CacheEntry(path, used, size))
+        return entries
+
+    def trim(self):
+        """
+        Deletes the entries the size limit asks for, returns their paths
+        """
+        if self.max_bytes is None:
+            return []
+        with self._lock:
+            entries = self.entries()
+            try:
+                # read last, so the jobs have the least time to get to
+                # other entries before these are deleted
+                in_use = self.in_use()
+            except SQLAlchemyError as err:
+                LOGGER.error(u'Couldn\'t find the live jobs: %s', err)
+                return []
+            trimmed = to_trim(entries, time(), self.max_bytes,
+                              self.min_age, in_use)
+            for path in trimmed:
+                shutil.rmtree(path, ignore_errors=True)
+                self._sizes.pop(path, None)
+                name = os.path.basename(path)
+                for pending in os.listdir(self.cachedir):
+                    if pending.startswith(name + u'.') and \
+                            pending.endswith(u'.pending'):
+                        try:
+                            os.remove(os.path.join(self.cachedir, pending))
+                        except OSError:
+                            pass
+        return trimmed
@@ -0,0 +1,166 @@
+"""
+Input files uploaded along with the job order.
+
+A multipart/form-data submission carries the job order in its job_order
+field, and files in fields named after the inputs they're for. The files
+are written to the job's staging directory as they arrive, so the memory
+used doesn't depend on their size, and the job order is rewritten to
+refer to them: an input with a single file gets a File, one with many
+files gets an array of them. Uploaded files take the place of whatever
+the job order had for their inputs.
+"""
+import json
+import os
+import shutil
+import tempfile
+
+from future.moves.urllib.request import pathname2url
+from future.utils import raise_from
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
+from werkzeug.utils import secure_filename
+
+from workflow_service.job_runner import makedirs
+
+JOB_ORDER_FIELD = u'job_order'
+
+
+def staging_dir(scratch_dir, jobid):
+    """
+    Returns where the files uploaded for the job go, in its directory
+    """
+    return os.path.join(scratch_dir, str(jobid), u'inputs')
+
+
+class _Upload(object):
+    # a file being uploaded, counted against the limit of its Staging
+    def __init__(self, staging, stream, path):
+        self._staging = staging
+        self._stream = stream
+        self.path = path
+
+    def write(self, data):
+        self._staging.count(len(data))
+        return self._stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class Staging(object):
+    """
+    Stream factory for werkzeug's form parser, writing the uploaded files
+    straight to the staging directory.
+
+    Args:
+        directory: the job's staging directory, created on the first file.
+        max_bytes: bytes all the files may take together, None for no
+                   limit. RequestEntityTooLarge is raised past it.
+    """
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.written = 0
+
+    def __call__(self, total_content_length, filename, content_type,
+                 content_length=None):
+        # pylint: disable=unused-argument
+        makedirs(self.directory)
+        handle, path = tempfile.mkstemp(dir=self.directory,
+                                        prefix=u'.upload-')
+        return _Upload(self, os.fdopen(handle, 'wb+'), path)
+
+    def count(self, size):
+        self.written += size
+        if self.max_bytes is not None and self.written > self.max_bytes:
+            raise RequestEntityTooLarge()
+
+    def discard(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        try:
+            # the job's directory, unless the job got to use it
+            os.rmdir(os.path.dirname(self.directory))
+        except OSError:
+            pass
+
+
+def staged_job_order(environ, staging, max_order_bytes=None):
+    """
+    Parses the multipart request, with the uploaded files going through
+    staging, and returns the job order referring to them, as JSON.
+    Raises BadRequest if the body is malformed, or the job order is missing
+    or isn't a JSON object, and RequestEntityTooLarge if the request is
+    bigger than the limits.
+    The staged files are discarded if it fails
+    """
+    try:
+        try:
+            _, form, files = parse_form_data(
+                environ, stream_factory=staging,
+                max_form_memory_size=max_order_bytes,
+                max_content_length=staging.max_bytes, silent=False)
+        except ValueError as err:
+            raise_from(BadRequest(u'The multipart body is malformed'), err)
+        try:
+            order = _read_order(form, files, max_order_bytes)
+            for name in files:
+                if name == JOB_ORDER_FIELD:
+                    continue
+                stored = [_store(staging.directory, upload)
+                          for upload in files.getlist(name)]
+                order[name] = stored[0] if len(stored) == 1 else stored
+        finally:
+            for upload in files.values():
+                upload.close()
+                if os.path.exists(upload.stream.path):
+                    os.remove(upload.stream.path)
+    except Exception:
+        staging.discard()
+        raise
+    return json.dumps(order)
+
+
+def _read_order(form, files, max_order_bytes):
+    if JOB_ORDER_FIELD in files:
+        # sent as a file, as curl -F job_order=@order.json does
+        upload = files[JOB_ORDER_FIELD]
+        upload.stream.seek(0)
+        if max_order_bytes is None:
+            data = upload.stream.read()
+        else:
+            data = upload.stream.read(max_order_bytes + 1)
+            if len(data) > max_order_bytes:
+                raise RequestEntityTooLarge()
+        text = data
+    elif JOB_ORDER_FIELD in form:
+        text = form[JOB_ORDER_FIELD]
+    else:
+        raise BadRequest(u'The job order is missing')
+    try:
+        if isinstance(text, bytes):
+            text = text.decode(u'utf-8')
+        order = json.loads(text)
+    except ValueError as err:  # UnicodeDecodeError included
+        raise_from(BadRequest(u'The job order is not valid JSON'), err)
+    if not isinstance(order, dict):
+        raise BadRequest(u'The job order must be a JSON object')
+    return order
+
+
+def _store(directory, upload):
+    # moves the uploaded file to its name, returns the File referring to it
+    upload.stream.flush()
+    name = secure_filename(upload.filename or u'') or u'upload'
+    path = os.path.join(directory, name)
+    root, extension = os.path.splitext(name)
+    copy = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, u'{}_{}{}'.format(root, copy,
+                                                         extension))
+        copy += 1
+    os.rename(upload.stream.path, path)
+    return {
+        u'class': u'File',
+        u'location': u'file://' + pathname2url(path),
+        u'basename': os.path.basename(path)
+    }
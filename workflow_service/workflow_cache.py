@@ -0,0 +1,193 @@
+"""
+Cache of resolved and packed workflow documents.
+
+Fetching, resolving, validating and packing a workflow takes cwltool a few
+seconds, which is wasted when the same workflow is run over and over. The
+cache keeps the packed documents on disk, keyed by the URL of the workflow
+and the hash of its contents, so cwltool can be handed a local copy that
+needs no further resolution.
+
+Only the top document is hashed, changes to the documents it imports are
+picked up once the entry expires, after ttl seconds.
+"""
+import hashlib
+import logging
+import os
+import shutil
+from subprocess import Popen, PIPE
+from sys import prefix
+import tempfile
+from threading import Lock
+from time import time
+
+from future.moves.urllib.parse import urlparse
+from future.moves.urllib.request import urlopen
+
+LOGGER = logging.getLogger(__name__)
+
+# seconds to wait for the server of a remote workflow
+FETCH_TIMEOUT = 30
+
+
+def pack_workflow(url):
+    """
+    Returns the packed version of the workflow at url, or None if cwltool
+    couldn't pack it
+    """
+    proc = Popen([prefix + u'/bin/python', u'-m', u'cwltool', u'--pack', url],
+                 stdout=PIPE, stderr=PIPE, close_fds=True)
+    packed, errors = proc.communicate()
+    if proc.returncode != 0:
+        LOGGER.warning(u'Couldn\'t pack "%s": %s', url, errors)
+        return None
+    return packed
+
+
+def packed_workflow(url, cache=None):
+    """
+    Returns the packed version of the workflow at url, the one in cache if
+    there's one. Raises IOError if it can't be packed
+    """
+    if cache is not None:
+        path = cache.get(url)
+        if path == url:
+            raise IOError(u'Couldn\'t cache ' + url)
+        with open(path, 'rb') as document:
+            return document.read()
+    packed = pack_workflow(url)
+    if packed is None:
+        raise IOError(u'Couldn\'t pack ' + url)
+    return packed
+
+
+def fetch_workflow(url):
+    """
+    Returns the contents of the document at url, which can be a local path.
+    Raises IOError if it can't be fetched
+    """
+    scheme = urlparse(url).scheme
+    if scheme in (u'', u'file'):
+        path = urlparse(url).path if scheme else url
+        with open(path, 'rb') as document:
+            return document.read()
+
+    handle = urlopen(url, timeout=FETCH_TIMEOUT)
+    try:
+        return handle.read()
+    finally:
+        handle.close()
+
+
+class WorkflowCache(object):
+    """
+    Args:
+        cachedir: where the packed documents are kept, it can be shared by
+                  several server processes.
+        ttl: seconds a fetched document is trusted without checking if it
+             changed.
+        max_bytes: size of the cache, the least recently used documents
+                   are evicted when it grows larger.
+    """
+    def __init__(self, cachedir, ttl=300, max_bytes=256 * 1024 * 1024,
+                 pack=pack_workflow, fetch=fetch_workflow):
+        self.cachedir = cachedir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._pack = pack
+        self._fetch = fetch
+
+        # url -> (path, time it was fetched)
+        self._fetched = dict()
+        self._lock = Lock()
+
+        try:
+            os.makedirs(cachedir)
+        except OSError:
+            if not os.path.isdir(cachedir):
+                raise
+
+    def get(self, url):
+        """
+        Returns the path to the packed document of the workflow at url,
+        or url itself if it can't be cached, so cwltool reports the problem
+        """
+        with self._lock:
+            path, fetched = self._fetched.get(url, (None, 0))
+        if path is not None and time() - fetched < self.ttl:
+            if self._touch(path):
+                return path
+
+        try:
+            contents = self._fetch(url)
+        except (IOError, OSError, ValueError) as err:
+            LOGGER.warning(u'Couldn\'t fetch "%s": %s', url, err)
+            return url
+
+        # keeps the name of the document, it shows up in the job logs
+        name = os.path.basename(urlparse(url).path) or u'workflow.cwl'
+        path = os.path.join(self.cachedir, self.key(url, contents), name)
+        if not self._touch(path):
+            packed = self._pack(url)
+            if packed is None:
+                return url
+            self._store(path, packed)
+            self.evict()
+
+        with self._lock:
+            self._fetched[url] = (path, time())
+        return path
+
+    @staticmethod
+    def key(url, contents):
+        return u'-'.join([
+            hashlib.sha1(url.encode(u'utf-8')).hexdigest(),
+            hashlib.sha256(contents).hexdigest()
+        ])
+
+    def evict(self):
+        """
+        Removes the least recently used documents until the cache fits in
+        max_bytes
+        """
+        entries = []
+        for key in os.listdir(self.cachedir):
+            entry = os.path.join(self.cachedir, key)
+            try:
+                stats = [os.stat(os.path.join(entry, name))
+                         for name in os.listdir(entry)]
+            except OSError:
+                continue
+            if stats:
+                entries.append((max(stat.st_mtime for stat in stats),
+                                sum(stat.st_size for stat in stats),
+                                entry))
+
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, entry in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            size -= entry_size
+
+    @staticmethod
+    def _store(path, packed):
+        entry = os.path.dirname(path)
+        try:
+            os.makedirs(entry)
+        except OSError:
+            if not os.path.isdir(entry):
+                raise
+        # written under another name first so no runner picks up half a file
+        handle, tmppath = tempfile.mkstemp(dir=entry, suffix=u'.tmp')
+        with os.fdopen(handle, 'wb') as document:
+            document.write(packed)
+        os.rename(tmppath, path)
+
+    @staticmethod
+    def _touch(path):
+        # marks the document as recently used, returns whether it exists
+        try:
+            os.utime(path, None)
+            return True
+        except OSError:
+            return False
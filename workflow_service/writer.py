@@ -0,0 +1,109 @@
+"""
+Batched writes of the updates of finishing jobs.
+
+Writing the results of each job in a transaction of its own makes the
+runners that finish at the same time fight for the database, which SQLite
+only lets one of them write at a time. The writer queues the updates and a
+single thread writes them in batches, each in one transaction. Queued
+updates of the same job are merged, the latest values win.
+"""
+import logging
+from threading import Condition, Thread
+from time import sleep
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from workflow_service.database import DB_SESSION
+from workflow_service.models import update_jobs
+
+LOGGER = logging.getLogger(__name__)
+
+
+class JobWriter(object):
+    """
+    Args:
+        delay: seconds the writer waits after the first update of a batch,
+               for more to come.
+        max_batch: maximum number of jobs written in a single transaction.
+        write: function applying a list of (jobid, {column: value})
+               updates in a single transaction, models.update_jobs by
+               default.
+    """
+    def __init__(self, delay=0.05, max_batch=100, write=update_jobs):
+        self.delay = delay
+        self.max_batch = max_batch
+        self._write = write
+        # jobid -> ({column: value}, callbacks), and jobids in arrival order
+        self._pending = dict()
+        self._order = []
+        self._changed = Condition()
+        self._thread = None
+
+    def update(self, jobid, values, then=None):
+        """
+        Queues the update of the job's columns, then() is called once it's
+        written, or once writing it failed
+        """
+        with self._changed:
+            if jobid in self._pending:
+                queued, callbacks = self._pending[jobid]
+                queued.update(values)
+            else:
+                callbacks = []
+                self._pending[jobid] = (dict(values), callbacks)
+                self._order.append(jobid)
+            if then is not None:
+                callbacks.append(then)
+
+            if self._thread is None:
+                self._thread = Thread(target=self._write_forever)
+                self._thread.daemon = True
+                self._thread.start()
+            self._changed.notify()
+
+    def flush(self):
+        """
+        Writes all the queued updates, in this thread
+        """
+        while self._write_batch():
+            pass
+
+    def _write_forever(self):
+        while True:
+            with self._changed:
+                while not self._order:
+                    self._changed.wait()
+            sleep(self.delay)
+            self.flush()
+
+    def _write_batch(self):
+        # returns False if there was nothing to write
+        with self._changed:
+            jobids = self._order[:self.max_batch]
+            del self._order[:self.max_batch]
+            batch = [(jobid, self._pending.pop(jobid)) for jobid in jobids]
+        if not batch:
+            return False
+
+        try:
+            self._write([(jobid, values) for jobid, (values, _) in batch])
+        except SQLAlchemyError as err:
+            LOGGER.error(u'Couldn\'t write %d job updates at once: %s',
+                         len(batch), err)
+            # one at a time, so a single bad update doesn't lose the rest
+            for jobid, (values, _) in batch:
+                try:
+                    self._write([(jobid, values)])
+                except SQLAlchemyError as job_err:
+                    LOGGER.error(u'Couldn\'t update job %s: %s', jobid,
+                                 job_err)
+        finally:
+            DB_SESSION.remove()
+
+        for _, (_, callbacks) in batch:
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as callback_err:  # pylint: disable=broad-except
+                    LOGGER.exception(callback_err)
+        return True